@@ -0,0 +1,131 @@
+=pod
+
+=head1 NAME
+
+    Bio::EnsEMBL::Hive::Examples::GC::PipeConfig::GCPct_pyconf
+
+=head1 SYNOPSIS
+
+       # initialize the database and build the graph in it (it will also print the value of EHIVE_URL) :
+    init_pipeline.pl Bio::EnsEMBL::Hive::Examples::GC::PipeConfig::GCPct_pyconf -pipeline_url sqlite:///gcpct.db
+
+        # run the pipeline with local workers:
+    beekeeper.pl -url sqlite:///gcpct.db -loop -local
+
+=head1 DESCRIPTION
+
+    This is a version of GCPct_conf where all the Runnables are implemented in Python:
+    eHive.runnables.FastaFactory, eHive.examples.GC.CountATGC and eHive.examples.GC.CalcOverallPercentage.
+
+    The input file is not split into chunk files. Instead, FastaFactory (with write_chunks set to 0)
+    gives every count_atgc job the byte ranges of its records in 'chunk_ranges', and CountATGC reads
+    these ranges from a memory-mapped 'inputfile'. The bases are counted with a NumPy lookup table
+    (or bytes.count() if NumPy is not installed). As in GCPct_conf, the counts are merged by the
+    'at_count' and 'gc_count' list Accumulators of the calc_overall_percentage funnel job.
+
+    Parameters:
+
+    inputfile        => Name of the input FASTA file (uncompressed)
+    max_chunk_length => Amount of sequence, in bases, to include in a single chunk
+    take_time        => Additional time, in seconds, taken by every job
+
+=head1 LICENSE
+
+    See the NOTICE file distributed with this work for additional information
+    regarding copyright ownership.
+
+    Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+         http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software distributed under the License
+    is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and limitations under the License.
+
+=head1 CONTACT
+
+    Please subscribe to the Hive mailing list:  http://listserver.ebi.ac.uk/mailman/listinfo/ehive-users  to discuss Hive-related questions or to be notified of our updates
+
+=cut
+
+
+package Bio::EnsEMBL::Hive::Examples::GC::PipeConfig::GCPct_pyconf;
+
+use strict;
+use warnings;
+
+use base ('Bio::EnsEMBL::Hive::PipeConfig::HiveGeneric_conf');  # All Hive databases configuration files should inherit from HiveGeneric, directly or indirectly
+
+
+sub default_options {
+    my ($self) = @_;
+    return {
+        %{ $self->SUPER::default_options() },   # inherit other stuff from the base class
+
+        'inputfile'     => $ENV{'EHIVE_ROOT_DIR'} . '/t/input_fasta.fa',    # name of the input file, here set to a sample file included with the eHive distribution
+    };
+}
+
+
+sub pipeline_create_commands {
+    my ($self) = @_;
+    return [
+        @{$self->SUPER::pipeline_create_commands},  # inheriting database and hive tables' creation
+
+        # create an additional table to store the end result of the computation:
+        $self->db_cmd('CREATE TABLE final_result (inputfile VARCHAR(255) NOT NULL, result DOUBLE PRECISION NOT NULL, PRIMARY KEY (inputfile))'),
+    ];
+}
+
+
+sub pipeline_wide_parameters {
+    my ($self) = @_;
+    return {
+        %{$self->SUPER::pipeline_wide_parameters},          # here we inherit anything from the base class
+
+        'inputfile'     => $self->o('inputfile'),
+        'take_time'     => 1,
+    };
+}
+
+
+sub pipeline_analyses {
+    my ($self) = @_;
+    return [
+        {   -logic_name => 'chunk_sequences',
+            -module     => 'eHive.runnables.FastaFactory',
+            -language   => 'python3',
+            -parameters => {
+                'max_chunk_length'  => 100,     # amount of sequence, in bases, to include in a single chunk
+                'write_chunks'      => 0,       # no chunk files: the jobs get the byte ranges of their records in 'chunk_ranges'
+                'output_dir'        => '.',
+            },
+            -input_ids => [ { } ],  # auto-seed one job with default parameters (coming from pipeline-wide parameters or analysis parameters)
+            -flow_into => {
+                '2->A' => [ 'count_atgc' ],
+                'A->1' => [ 'calc_overall_percentage'  ],
+            },
+        },
+
+        {   -logic_name => 'count_atgc',
+            -module     => 'eHive.examples.GC.CountATGC',
+            -language   => 'python3',
+            -analysis_capacity  =>  4,
+            -flow_into => {
+                1 => ['?accu_name=at_count&accu_address=[]',
+                      '?accu_name=gc_count&accu_address=[]'],
+            },
+        },
+
+        {   -logic_name => 'calc_overall_percentage',
+            -module     => 'eHive.examples.GC.CalcOverallPercentage',
+            -language   => 'python3',
+            -flow_into => {
+                1 => [ '?table_name=final_result' ],
+            },
+        },
+    ];
+}
+
+1;
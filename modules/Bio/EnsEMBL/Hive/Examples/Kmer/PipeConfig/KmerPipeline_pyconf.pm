@@ -0,0 +1,167 @@
+=pod
+
+=head1 NAME
+
+Bio::EnsEMBL::Hive::Examples::Kmer::PipeConfig::KmerPipeline_pyconf
+
+=head1 SYNOPSIS
+
+       # initialize the database and build the graph in it (it will also print the value of EHIVE_URL) :
+    init_pipeline.pl Bio::EnsEMBL::Hive::Examples::Kmer::PipeConfig::KmerPipeline_pyconf -k 5 -password <mypass>
+
+        # run the pipeline:
+    beekeeper.pl -url $EHIVE_URL -loop
+
+=head1 DESCRIPTION
+
+    This is a version of KmerPipelineHoH_conf where the k-mers are counted and compiled by Runnables implemented
+    in Python with NumPy (eHive.examples.Kmer.CountKmers and eHive.examples.Kmer.CompileCounts).
+    numpy must be installed for python3.
+
+    Every k-mer is encoded as an integer, and the counts of a chunk are dataflown as two parallel lists
+    (the codes and their counts) rather than one hash entry per k-mer. The "all_counts" Accumulator
+    thus stores one compact structure per chunk file, which CompileCounts merges in a single pass.
+
+    Only the FASTA format is supported. In short-sequence mode, the input file is chunked by the Python
+    FastaFactory (eHive.runnables.FastaFactory).
+
+    Parameters:
+
+    seqtype          => Can be 'short' or 'long' which determines whether the pipeline runs in short-sequence mode
+                        or long-sequence mode (see KmerPipelineHoH_conf)
+    inputfile        => Name of input file
+    chunk_size       => Size of sub-sequences or sub-files (in bases)
+    output_prefix    => Filename prefix for the intermediate split files generated by this pipeline
+    output_suffix    => Filename suffix for the intermediate split files generated by this pipeline
+    k                => Length of the k-mers (at most 32)
+
+=head1 LICENSE
+
+    See the NOTICE file distributed with this work for additional information
+    regarding copyright ownership.
+
+    Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except in compliance with the License.
+    You may obtain a copy of the License at
+
+         http://www.apache.org/licenses/LICENSE-2.0
+
+    Unless required by applicable law or agreed to in writing, software distributed under the License
+    is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+    See the License for the specific language governing permissions and limitations under the License.
+
+=head1 CONTACT
+
+    Please subscribe to the Hive mailing list:  http://listserver.ebi.ac.uk/mailman/listinfo/ehive-users  to discuss Hive-related questions or to be notified of our updates
+
+=cut
+
+package Bio::EnsEMBL::Hive::Examples::Kmer::PipeConfig::KmerPipeline_pyconf;
+
+use strict;
+use warnings;
+
+use base ('Bio::EnsEMBL::Hive::PipeConfig::HiveGeneric_conf');  # All Hive databases configuration files should inherit from HiveGeneric, directly or indirectly
+use Bio::EnsEMBL::Hive::PipeConfig::HiveGeneric_conf;           # Allow this particular config to use conditional dataflow
+
+
+sub default_options {
+  my ($self) = @_;
+
+  return {
+	  %{ $self->SUPER::default_options() },               # inherit other stuff from the base class
+	  'seqtype' => 'short',
+	  'inputfile' => $ENV{'EHIVE_ROOT_DIR'} . '/t/input_fasta.fa',
+	  'chunk_size' => 40,
+	  'output_dir' => '.',
+	  'output_prefix' => 'k_split_',
+	  'output_suffix' => '.fa',
+	 };
+}
+
+
+sub pipeline_create_commands {
+    my ($self) = @_;
+    return [
+        @{$self->SUPER::pipeline_create_commands},  # inheriting database and hive tables' creation
+
+        # additional table to store results:
+        $self->db_cmd('CREATE TABLE final_result (filename VARCHAR(255) NOT NULL, kmer VARCHAR(255) NOT NULL, count INT NOT NULL, PRIMARY KEY (filename, kmer))'),
+    ];
+}
+
+
+sub hive_meta_table {
+    my ($self) = @_;
+    return {
+        %{$self->SUPER::hive_meta_table},       # here we inherit anything from the base class
+        'hive_use_param_stack'  => 1,           # switch on the param_stack mechanism
+    };
+}
+
+
+sub pipeline_analyses {
+  my ($self) = @_;
+  return [
+	  {-logic_name => 'split_strategy',
+	   -module     => 'Bio::EnsEMBL::Hive::RunnableDB::Dummy',
+	   -meadow_type => 'LOCAL',
+	   -input_ids => [
+	  		  { 'seqtype' => $self->o('seqtype'),
+	  		    'input_format' => 'FASTA',
+	  		    'inputfile' => $self->o('inputfile'),
+	  		    'chunk_size' => $self->o('chunk_size'),
+                            'output_dir' => $self->o('output_dir'),
+	  		    'output_prefix' => $self->o('output_prefix'),
+	  		    'output_suffix' => $self->o('output_suffix'),
+			    'k' => $self->o('k'),
+	  		  },
+	  		 ],
+	   -flow_into => {
+	  		  '1->A' => WHEN('#seqtype# eq "short"' => [ 'chunk_sequence' ],
+					 ELSE [ 'split_sequence' ]),
+			  'A->1' => [ 'compile_counts' ],
+	  		 },
+	  },
+
+	  {   -logic_name => 'split_sequence',
+	      -module     => 'Bio::EnsEMBL::Hive::Examples::Kmer::RunnableDB::SplitSequence',
+	      -parameters => { "overlap_size" => "#expr(#k#-1)expr#"},
+	      -analysis_capacity  =>  2,
+	      -flow_into => {
+	  		     '2' => ['count_kmers'],
+	  		    },
+	  },
+
+	  { -logic_name => 'chunk_sequence',
+	    -module     => 'eHive.runnables.FastaFactory',
+	    -language   => 'python3',
+	    -parameters => { "max_chunk_length" => "#chunk_size#" },
+	    -flow_into => {
+	  		   '2' => ['count_kmers'],
+	  		  },
+	  },
+
+	  {   -logic_name => 'count_kmers',
+	      -module     => 'eHive.examples.Kmer.CountKmers',
+	      -language   => 'python3',
+	      -parameters => {
+	  		       "sequence_file" => '#chunk_name#',
+	  		     },
+	      -analysis_capacity  =>  4,
+	      -flow_into => {
+                             # One compact structure {'k', 'codes', 'counts'} per chunk file
+                             3 => [ '?accu_name=all_counts&accu_address={sequence_file}&accu_input_variable=counts' ],
+	  		    },
+	  },
+
+	  {   -logic_name => 'compile_counts',
+	      -module     => 'eHive.examples.Kmer.CompileCounts',
+	      -language   => 'python3',
+	      -flow_into => {
+	  		     4 => [ '?table_name=final_result' ],
+	  		    },
+	  },
+	 ];
+}
+
+1;
@@ -45,7 +45,10 @@ Each one first sends a JSON object to the child process to initialize the job pa
              "retry_count": XXX
            },
            "execute_writes": [1|0],
-           "debug": XXX
+           "debug": XXX,
+           "worker_log_dir": "XXX",  // null if the worker doesn't log to files
+           "analysis_name": "XXX",   // logic_name of the job's analysis
+           "hive_pipeline_url": "XXX"  // URL of the hive database, without the password
          }
     <--- "OK"
 
@@ -82,6 +85,13 @@ response from GuestProcess):
          // No content needed (ignored)
     ---> returns the temporary directory of the worker
 
+    <--- BRANCH_CONNECTED
+         // The content is a JSON object:
+            {
+              "branch_name_or_code": XXX,
+            }
+    ---> 1 if the analysis has dataflow rules on that branch, 0 otherwise
+
     <--- JOB_END
          // The content is a JSON object describing the final state of the job
             {
@@ -94,6 +104,11 @@ response from GuestProcess):
               "params": {
                 "substituted": { ... the parameters that are currently substituted ... }
                 "unsubstituted": { ... the parameters that have not yet been substituted ... }
+              },
+              // optional: the resources used by each step, and in total (stored as an INFO message of the job)
+              "resource_usage": {
+                "steps": { "run": { "user_cpu_seconds": XXX, "peak_rss_kb": XXX, ... }, ... },
+                "total": { ... }
               }
             }
     ---> "OK"
@@ -127,9 +142,12 @@ use warnings;
 
 use JSON;
 use IO::Handle;
+use IPC::Open2;
 
 use Data::Dumper;
 
+use Bio::EnsEMBL::Hive::DBSQL::DataflowRuleAdaptor;
+
 use base ('Bio::EnsEMBL::Hive::Process');
 
 
@@ -323,18 +341,74 @@ sub get_wrapper_version {
 =head2 assert_runnable_exists
 
   Example     : Bio::EnsEMBL::Hive::GuestProcess::assert_runnable_exists('python3', 'eHive.examples.TestRunnable');
-  Description : Ask the wrapper to check whether the runnable exists (can be loaded)
+  Description : Ask the wrapper to check whether the runnable exists (can be loaded).
+                Runnables that have already been checked are not checked again.
   Returntype  : None
   Exceptions  : Die if there is no wrapper or the runnable can't be loaded
 
 =cut
 
+my %runnables_known_to_exist;   # language => module name => 1
+
 sub assert_runnable_exists {
     my ($language, $runnable_module_name) = @_;
+    return if $runnables_known_to_exist{$language}{$runnable_module_name};
     my $wrapper = _get_wrapper_for_language($language);
     if (system($wrapper, 'check_exists', $runnable_module_name)) {
         die "The runnable module '$runnable_module_name' cannot be loaded or compiled\n";
     }
+    $runnables_known_to_exist{$language}{$runnable_module_name} = 1;
+}
+
+
+=head2 assert_runnables_exist
+
+  Example     : Bio::EnsEMBL::Hive::GuestProcess::assert_runnables_exist('python3', 'eHive.examples.LongMult.DigitFactory', 'eHive.examples.LongMult.AddTogether');
+  Description : Checks many runnables with a single call to the wrapper ("check_exists_batch" mode,
+                which reads the module names on its standard input and answers with one JSON object per line).
+                Falls back to calling assert_runnable_exists() on each runnable if the wrapper
+                doesn't understand that mode.
+  Returntype  : None
+  Exceptions  : Die if there is no wrapper or any of the runnables can't be loaded
+
+=cut
+
+sub assert_runnables_exist {
+    my ($language, @runnable_module_names) = @_;
+    my @to_check = grep {!$runnables_known_to_exist{$language}{$_}} @runnable_module_names;
+    return unless @to_check;
+
+    my $wrapper = _get_wrapper_for_language($language);
+    my ($from_wrapper, $to_wrapper);
+    my $pid = open2($from_wrapper, $to_wrapper, $wrapper, 'check_exists_batch');
+    # The wrapper reads all the names before answering
+    print $to_wrapper map {"$_\n"} @to_check;
+    close($to_wrapper);
+    my @results;
+    while (my $line = <$from_wrapper>) {
+        my $result = eval { JSON->new->decode($line) };
+        push @results, $result if ref($result) eq 'HASH' and exists $result->{'module'};
+    }
+    close($from_wrapper);
+    waitpid($pid, 0);
+
+    unless (@results) {
+        # Not supported by this wrapper
+        assert_runnable_exists($language, $_) for @to_check;
+        return;
+    }
+
+    my @errors;
+    foreach my $result (@results) {
+        if ($result->{'exists'}) {
+            $runnables_known_to_exist{$language}{$result->{'module'}} = 1;
+        } else {
+            push @errors, "The runnable module '$result->{'module'}' cannot be loaded or compiled\n".($result->{'error'} ? $result->{'error'}."\n" : '');
+        }
+    }
+    die join('', @errors) if @errors;
+    # Modules the wrapper may have skipped are checked individually
+    assert_runnable_exists($language, $_) for grep {!$runnables_known_to_exist{$language}{$_}} @to_check;
 }
 
 
@@ -586,6 +660,9 @@ sub life_cycle {
         },
         execute_writes => $self->execute_writes || 0,
         debug => $self->debug || 0,
+        worker_log_dir => $self->worker && $self->worker->log_dir,
+        analysis_name => $job->analysis && $job->analysis->logic_name,
+        hive_pipeline_url => $job->hive_pipeline && $job->hive_pipeline->unambig_key,
     );
     $self->print_debug("SEND JOB PARAM");
     $self->send_message(\%struct);
@@ -620,6 +697,10 @@ sub life_cycle {
             my $wtd = $self->worker_temp_directory;
             $self->send_response($wtd);
 
+        } elsif ($event eq 'BRANCH_CONNECTED') {
+            my $branch_code = Bio::EnsEMBL::Hive::DBSQL::DataflowRuleAdaptor::branch_name_2_code($content->{branch_name_or_code});
+            $self->send_response($job->analysis->dataflow_rules_by_branch->{$branch_code} ? 1 : 0);
+
         } elsif ($event eq 'JOB_END') {
             # Especially here we need to be careful about boolean values
             # They are coded as JSON::true and JSON::false which have
@@ -629,6 +710,10 @@ sub life_cycle {
             $job->transient_error($content->{job}->{transient_error}?1:0);
             $job->{_param_hash} = $content->{params}->{substituted};
             $job->{_unsubstituted_param_hash} = $content->{params}->{unsubstituted};
+            if (my $resource_usage = $content->{resource_usage}) {
+                # Kept in log_message, together with the other messages of the job
+                $self->warning( 'Resource usage: '.JSON->new->canonical->encode($resource_usage->{total}), 'INFO' );
+            }
 
             # This piece of code is duplicated from Process
             if ($content->{complete}) {
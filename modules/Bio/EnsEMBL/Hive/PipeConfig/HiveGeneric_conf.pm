@@ -473,6 +473,17 @@ sub add_objects_from_config {
     my %seen_logic_name = ();
     my %analyses_by_logic_name = map {$_->logic_name => $_} $pipeline->collection_of('Analysis')->list();
 
+        # Check the Runnables of the guest languages with one call to each wrapper,
+        # so that get_compiled_module_name() doesn't have to start a wrapper for every analysis
+    my %guest_modules_by_language;
+    foreach my $aha (@{$self->pipeline_analyses}) {
+        next if !$aha->{'-language'} or !$aha->{'-module'} or $analyses_by_logic_name{$aha->{'-logic_name'} // ''};
+        push @{$guest_modules_by_language{$aha->{'-language'}}}, $aha->{'-module'};
+    }
+    foreach my $language (sort keys %guest_modules_by_language) {
+        Bio::EnsEMBL::Hive::GuestProcess::assert_runnables_exist($language, @{$guest_modules_by_language{$language}});
+    }
+
     $self->print_debug( "Adding Analyses ...\n" );
     foreach my $aha (@{$self->pipeline_analyses}) {
         my %aha_copy = %$aha;
@@ -111,5 +111,17 @@ subtest 'dummy language' => sub {
         } qr/The runnable module 'runner' cannot be loaded or compiled/, 'Throws a relevant message if the runnable cannot be found';
     };
 
+    subtest 'assert_runnables_exist' => sub {
+        lives_ok( sub {
+            local $ENV{'EHIVE_EXPECTED_WRAPPER'} = 'check_exists other_runner';
+            Bio::EnsEMBL::Hive::GuestProcess::assert_runnables_exist('dummy', 'other_runner');
+        }, 'Falls back to check_exists when the wrapper has no batch mode');
+
+        lives_ok( sub {
+            local $ENV{'EHIVE_EXPECTED_WRAPPER'} = 'wrong_check_exists other_runner';
+            Bio::EnsEMBL::Hive::GuestProcess::assert_runnables_exist('dummy', 'other_runner');
+        }, 'Runnables are only checked once');
+    };
+
 };
 
@@ -39,13 +39,16 @@ my $inputfile = File::Basename::dirname( File::Basename::dirname( Cwd::realpath(
 
 my $dir = tempdir CLEANUP => 1;
 
-my $ehive_test_pipeconfigs   = $ENV{'EHIVE_TEST_PIPECONFIGS'} || 'GCPct_conf';
+my $ehive_test_pipeconfigs   = $ENV{'EHIVE_TEST_PIPECONFIGS'} || 'GCPct_conf GCPct_pyconf';
 
 my @pipeline_cfgs = split( /[\s,]+/, $ehive_test_pipeconfigs ) ;
 my $sleep_minutes = $ENV{'EHIVE_GCPCT_SLEEP'} || 0.02;
 
 foreach my $gcpct_version ( @pipeline_cfgs ) {
 
+        # The Python Runnables need python3
+        next if $gcpct_version =~ /_pyconf/ and system('python3 -c 1 2>/dev/null') != 0;
+
         note("\nInitializing the $gcpct_version pipeline ...\n\n");
 
         my $pipeline_url = get_test_url_or_die();
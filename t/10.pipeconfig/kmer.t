@@ -55,6 +55,15 @@ my $kmer_param_configs       = {'short' => [-seqtype => "short",
 					    -output_suffix => ".fastq",
 					    -input_format => "FASTQ",
 					    -k => 5],
+				# FASTA input chunked by FastaFactory (only the _pyconf version can read it)
+				'short_fasta' => [-seqtype => "short",
+					   -inputfile => "$inputfasta",
+					   -chunk_size => 40,
+					   -output_dir => $dir,
+					   -output_prefix => "k_split_",
+					   -output_suffix => ".fa",
+					   -input_format => "FASTA",
+					   -k => 5],
 				'long' => [-seqtype => "long",
 					   -inputfile => "$inputfasta",
 					   -chunk_size => 40,
@@ -68,12 +77,19 @@ my $kmer_param_configs       = {'short' => [-seqtype => "short",
 
 my @pipeline_cfgs = split( /[\s,]+/, $ehive_test_pipeconfigs ) ;
 my @kmer_pipeline_modes = split( /[\s,]+/, $kmer_pipeline_modes ) ;
+my @kmer_pyconf_modes   = ('short_fasta', 'long');
 
 my $pipeline_url = get_test_url_or_die();
 
   foreach my $kmer_version ( @pipeline_cfgs ) {
 
-    foreach my $kmer_pipeline_mode ( @kmer_pipeline_modes ) {
+    if ($kmer_version =~ /_pyconf/) {
+        # The Python Runnables need numpy
+        next unless system('python3 -c "import numpy" 2>/dev/null') == 0;
+    }
+
+    # The Python Runnables only read FASTA
+    foreach my $kmer_pipeline_mode ( $kmer_version =~ /_pyconf/ ? @kmer_pyconf_modes : @kmer_pipeline_modes ) {
       
       note("\nInitializing the $kmer_version $kmer_pipeline_mode sequence pipeline into $pipeline_url ...\n\n");
       
@@ -89,7 +105,8 @@ my $pipeline_url = get_test_url_or_die();
       my $final_result_nta = $hive_dba->get_NakedTableAdaptor( 'table_name' => 'final_result' );
       my $final_results = $final_result_nta->fetch_all();
       
-      if ($kmer_pipeline_mode eq 'long') {
+      # Whole sequences give the same k-mers as the overlapping splits
+      if ($kmer_pipeline_mode eq 'long' or $kmer_pipeline_mode eq 'short_fasta') {
 	is(scalar(@$final_results), 68, 'There are exactly 68 final_results');
 	
 	my $sum_of_spotchecks = 0;
@@ -17,7 +17,7 @@ if [[ $rt -ne 0 ]]; then
    exit $rt
 fi
 
-(cd wrappers/python3; python3 -m unittest -v eHive.process eHive.params eHive.examples.TestRunnable)
+(cd wrappers/python3; python3 -m unittest -v eHive.process eHive.params eHive.memo eHive.checkpoint eHive.staging eHive.profiling eHive.resources eHive.metrics eHive.tracing eHive.guest eHive.transcript eHive.db eHive.standalone eHive.runnable_index eHive.bundle eHive.benchmarks.protocol eHive.benchmarks.params eHive.benchmarks.kmer eHive.benchmarks.longmult eHive.benchmarks.claims eHive.runnables.JobFactory eHive.runnables.FastaFactory eHive.runnables.SystemCmd eHive.examples.TestRunnable eHive.examples.LongMult.digits eHive.examples.Kmer.CountKmers eHive.examples.Kmer.CompileCounts eHive.examples.GC.CountATGC eHive.examples.GC.CalcOverallPercentage eHive.stringify eHive.worker eHive.seeder)
 rtp=$?
 
 if [[ $rtp -ne 0 ]]; then
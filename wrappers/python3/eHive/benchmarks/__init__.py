@@ -0,0 +1,107 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of the Python wrapper.
+
+Each benchmark module has a `run_benchmarks()` function that returns its
+results as a JSON-serializable structure. They can be run with
+`wrapper bench <benchmark_name> <output_file>`, and the output files of
+two commits compared with find_regressions() to spot performance
+regressions.
+"""
+
+import json
+import math
+import platform
+import sys
+import time
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of a sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100. * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(values):
+    """Summary statistics of a list of durations (or any numbers)"""
+    values = sorted(values)
+    if not values:
+        return {'n': 0}
+    return {
+        'n': len(values),
+        'min': values[0],
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1],
+    }
+
+
+def environment():
+    """Describes the machine and the interpreter the benchmarks ran on"""
+    from .. import __version__
+    return {
+        'protocol_version': __version__,
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def load_results(path):
+    """Returns the results stored in a file written by write_results()"""
+    with open(path, 'r') as fh:
+        return json.load(fh)['results']
+
+
+def find_regressions(results, baseline, threshold, tolerances):
+    """Compares two sets of results. tolerances maps the names of the
+    metrics to compare to an absolute tolerance, so that tiny figures
+    dominated by noise are not reported. Returns the list of (path,
+    baseline value, new value) of the metrics that have increased by more
+    than threshold (e.g. 0.2 for 20%) plus the tolerance. Metrics missing
+    from either side are ignored"""
+    regressions = []
+    def walk(new, old, path):
+        for (key, value) in sorted(new.items()):
+            if key not in old:
+                continue
+            if isinstance(value, dict) and isinstance(old[key], dict):
+                walk(value, old[key], path + [key])
+            elif key in tolerances and isinstance(value, (int, float)) and isinstance(old[key], (int, float)):
+                if value > old[key] * (1 + threshold) + tolerances[key]:
+                    regressions.append(('/'.join(path + [key]), old[key], value))
+    walk(results, baseline, [])
+    return regressions
+
+
+def write_results(benchmark_name, results, output_file):
+    """Writes the results with a description of the environment, in JSON.
+    output_file can be "-" for the standard output"""
+    document = {'benchmark': benchmark_name, 'environment': environment(), 'results': results}
+    if output_file == '-':
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        with open(output_file, 'w') as fh:
+            json.dump(document, fh, indent=2, sort_keys=True)
+            fh.write("\n")
@@ -0,0 +1,217 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput and memory of the k-mer counting of the Kmer example pipeline,
+Python (eHive.examples.Kmer.CountKmers) versus Perl
+(Bio::EnsEMBL::Hive::Examples::Kmer::RunnableDB::CountKmers).
+
+The input files are made by repeating the records of t/input_fasta.fa
+(or random sequences with --random) up to the requested sizes. Each
+Runnable runs in its own process, through `wrapper standalone` and
+standaloneJob.pl respectively, without write_output, and the wall time,
+CPU time and peak RSS of the process are reported.
+
+    python3 -m eHive.benchmarks.kmer --size 10M --size 1G -k 11 -o kmer.json
+
+The Perl side is skipped if standaloneJob.pl cannot be found (it is
+searched in $EHIVE_ROOT_DIR/scripts and in the PATH) or if BioPerl is
+not installed.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+from . import write_results
+from ..runnables.SystemCmd import run_command
+
+
+PYTHON_MODULE = 'eHive.examples.Kmer.CountKmers'
+PERL_MODULE = 'Bio::EnsEMBL::Hive::Examples::Kmer::RunnableDB::CountKmers'
+
+DEFAULT_SIZES = ['1M', '16M']
+
+UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+LINE_LENGTH = 60
+
+# Maps every random byte to a base
+RANDOM_BASES = bytes(b'ACGT'[i % 4] for i in range(256))
+
+
+def parse_size(size):
+    """Parses a size like 500K, 10M or 2G"""
+    size = str(size).upper()
+    if size[-1:] in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1]])
+    return int(size)
+
+
+def ehive_root_dir():
+    """EHIVE_ROOT_DIR, or the root of the checkout this package belongs to"""
+    return os.environ.get('EHIVE_ROOT_DIR') or os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..'))
+
+
+def template_records(path):
+    """Returns the sequences of a FASTA file"""
+    records = []
+    with open(path, 'r') as fh:
+        for line in fh:
+            if line.startswith('>'):
+                records.append([])
+            elif records:
+                records[-1].append(line.strip())
+    return [''.join(r) for r in records]
+
+
+def make_fasta(path, size, template=None, seed=None):
+    """Writes a FASTA file of about size bytes, made of copies of the
+    template sequences, or random sequences of the same lengths if seed is
+    given"""
+    if template is None:
+        template = os.path.join(ehive_root_dir(), 't', 'input_fasta.fa')
+    records = template_records(template)
+    rng = random.Random(seed) if seed is not None else None
+    written = 0
+    with open(path, 'w') as fh:
+        i = 0
+        while written < size:
+            seq = records[i % len(records)]
+            if rng:
+                seq = rng.getrandbits(8 * len(seq)).to_bytes(len(seq), "little").translate(RANDOM_BASES).decode('ascii')
+            chunk = '>seq{0}\n'.format(i) + ''.join(seq[j:j + LINE_LENGTH] + '\n' for j in range(0, len(seq), LINE_LENGTH))
+            fh.write(chunk)
+            written += len(chunk)
+            i += 1
+    return written
+
+
+def find_standalone_job():
+    """Path of standaloneJob.pl, or None"""
+    path = os.path.join(ehive_root_dir(), 'scripts', 'standaloneJob.pl')
+    if os.path.isfile(path):
+        return path
+    return shutil.which('standaloneJob.pl')
+
+
+def perl_available():
+    result = run_command(['perl', '-MBio::SeqIO', '-e', '1'], buffer_size=4096)
+    return result['return_value'] == 0
+
+
+def measure(cmd):
+    """Runs the command and returns its resource usage, or its error"""
+    result = run_command(cmd, buffer_size=64 << 10)
+    if result['return_value']:
+        return {'error': result['stderr'].strip().splitlines()[-1:] or ['exit status {0}'.format(result['return_value'])]}
+    usage = result['rusage']
+    return {
+        'wall_seconds': usage['wall_seconds'],
+        'cpu_seconds': usage['user_cpu_seconds'] + usage['sys_cpu_seconds'],
+        'peak_rss_kb': usage['peak_rss_kb'],
+    }
+
+
+def python_command(path, k):
+    wrapper = os.path.join(os.path.dirname(__file__), '..', '..', 'wrapper')
+    return [sys.executable, wrapper, 'standalone', PYTHON_MODULE, '--param', 'sequence_file=' + path, '--param', 'k={0}'.format(k), '--no-write']
+
+
+def perl_command(standalone_job, path, k):
+    return ['perl', standalone_job, PERL_MODULE, '-sequence_file', path, '-k', str(k), '-no_write']
+
+
+def bench_size(path, size_bytes, k, with_perl):
+    results = {'input_bytes': size_bytes}
+    implementations = {'python': python_command(path, k)}
+    if with_perl:
+        implementations['perl'] = perl_command(with_perl, path, k)
+    for (name, cmd) in implementations.items():
+        results[name] = measure(cmd)
+        if 'wall_seconds' in results[name]:
+            results[name]['mb_per_second'] = size_bytes / (1 << 20) / max(results[name]['wall_seconds'], 1e-6)
+    if 'wall_seconds' in results.get('perl', {}) and 'wall_seconds' in results['python']:
+        results['speedup'] = results['perl']['wall_seconds'] / max(results['python']['wall_seconds'], 1e-6)
+        results['rss_ratio'] = results['perl']['peak_rss_kb'] / max(results['python']['peak_rss_kb'], 1)
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, k=11, seed=None, perl=True, work_dir=None):
+    """Runs the benchmark on inputs of the given sizes"""
+    with_perl = perl and perl_available() and find_standalone_job()
+    tmp_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        results = {'k': k, 'perl': bool(with_perl), 'sizes': {}}
+        for size in sizes:
+            path = os.path.join(tmp_dir, 'input_{0}.fa'.format(size))
+            size_bytes = make_fasta(path, parse_size(size), seed=seed)
+            results['sizes'][str(size)] = bench_size(path, size_bytes, k, with_perl)
+            os.remove(path)
+        return results
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the Python and Perl k-mer counting Runnables')
+    parser.add_argument('-o', '--output', default='-', help='Output file ("-" for the standard output)')
+    parser.add_argument('--size', action='append', help='Size of the input file, e.g. 100M or 2G. Can be repeated (default: {0})'.format(' '.join(DEFAULT_SIZES)))
+    parser.add_argument('-k', type=int, default=11, help='Length of the k-mers')
+    parser.add_argument('--random', type=int, metavar='SEED', help='Use random sequences (generated with this seed) instead of copies of t/input_fasta.fa')
+    parser.add_argument('--no-perl', action='store_true', help='Only run the Python version')
+    parser.add_argument('--work-dir', help='Where to write the input files (default: the system temporary directory)')
+    args = parser.parse_args()
+    results = run_benchmarks(args.size or DEFAULT_SIZES, args.k, args.random, not args.no_perl, args.work_dir)
+    write_results('kmer', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
+
+
+class KmerBenchmarkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parse_size(self):
+        self.assertEqual([parse_size(s) for s in ['100', '2k', '1.5M', '1G']], [100, 2048, 1572864, 1 << 30])
+
+    def test_make_fasta(self):
+        path = os.path.join(self.dir, 'in.fa')
+        size = make_fasta(path, 10000, seed=1)
+        self.assertEqual(os.path.getsize(path), size)
+        self.assertGreaterEqual(size, 10000)
+        records = template_records(path)
+        self.assertEqual(len(records[0]), len(template_records(os.path.join(ehive_root_dir(), 't', 'input_fasta.fa'))[0]))
+
+    def test_run_benchmarks(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('numpy is not installed')
+        results = run_benchmarks(['20K'], k=5, perl=False, work_dir=self.dir)
+        python = results['sizes']['20K']['python']
+        self.assertNotIn('error', python)
+        self.assertGreater(python['peak_rss_kb'], 0)
+        self.assertGreater(python['mb_per_second'], 0)
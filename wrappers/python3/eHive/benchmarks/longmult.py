@@ -0,0 +1,154 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-job overhead versus compute time in the LongMult example.
+
+The three analyses of the pipeline (DigitFactory, PartMultiply and
+AddTogether) are run in sequence through testRunnable, with random
+operands of increasing sizes, and with both implementations of the digit
+arithmetic ("python": the reference string-based functions, "numpy": the
+vectorised ones). For each analysis, the benchmark reports the number of
+jobs, the wall time of the jobs, the time spent in run() (the compute),
+and the difference (the overhead of the job life-cycle in the wrapper).
+
+    python3 -m eHive.benchmarks.longmult --digits 10 --digits 1000 --digits 100000
+
+The recursive rec_multiply() cannot handle numbers of more than ~900
+digits. Such runs are reported with the error instead of the figures.
+"""
+
+import argparse
+import contextlib
+import random
+import sys
+import unittest
+
+from . import write_results
+from ..tests import testRunnable, CallbackEvents, DataflowEvent, FailureEvent
+
+
+DEFAULT_DIGITS = [10, 100, 500, 2000, 20000]
+
+IMPLEMENTATIONS = ['python', 'numpy']
+
+ANALYSES = ['eHive.examples.LongMult.DigitFactory', 'eHive.examples.LongMult.PartMultiply', 'eHive.examples.LongMult.AddTogether']
+
+
+def random_number(n_digits, rng):
+    """Decimal string of n_digits digits, without leading zero"""
+    return str(rng.randint(1, 9)) + ''.join(rng.choice('0123456789') for _ in range(n_digits - 1))
+
+
+class JobFailed(Exception):
+    pass
+
+
+def run_job(module_name, parameters, repeats, timings):
+    """Runs a job and returns its dataflows. Adds its timings to the
+    "timings" dictionary of the analysis"""
+    events = []
+    def new_run():
+        # Only the events of the last run are kept
+        del events[:]
+        return [CallbackEvents(events.append)]
+    # AddTogether prints the partial products, which must not mix with the results
+    with contextlib.redirect_stdout(sys.stderr):
+        statistics = testRunnable(unittest.TestCase(), module_name, parameters, new_run, {'repeat': repeats})
+    failures = [e for e in events if isinstance(e, FailureEvent)]
+    if failures:
+        raise JobFailed('{0}: {1}'.format(failures[0].exception.__name__, failures[0].args[0] if failures[0].args else ''))
+    timings['jobs'] += 1
+    timings['wall_seconds'] += statistics['total']['wall_seconds']['p50']
+    timings['compute_seconds'] += statistics['run']['wall_seconds']['p50'] if 'run' in statistics else 0.
+    return [e for e in events if isinstance(e, DataflowEvent)]
+
+
+def run_pipeline(a_multiplier, b_multiplier, implementation, repeats=1):
+    """Runs the whole pipeline and returns the product and the timings per analysis"""
+    timings = {name.rsplit('.', 1)[1]: {'jobs': 0, 'wall_seconds': 0., 'compute_seconds': 0.} for name in ANALYSES}
+    common = {'a_multiplier': a_multiplier, 'b_multiplier': b_multiplier, 'implementation': implementation, 'take_time': 0}
+
+    fan = []
+    for event in run_job(ANALYSES[0], common, repeats, timings['DigitFactory']):
+        if event.branch_name_or_code == 2:
+            fan.extend(event.output_ids)
+
+    partial_product = {}
+    for output_id in fan:
+        events = run_job(ANALYSES[1], dict(common, **output_id), repeats, timings['PartMultiply'])
+        partial_product[output_id['digit']] = events[0].output_ids['partial_product']
+
+    events = run_job(ANALYSES[2], dict(common, partial_product=partial_product), repeats, timings['AddTogether'])
+    for t in timings.values():
+        t['overhead_seconds'] = t['wall_seconds'] - t['compute_seconds']
+        t['overhead_per_job_seconds'] = t['overhead_seconds'] / t['jobs'] if t['jobs'] else None
+    return (events[0].output_ids['result'], timings)
+
+
+def run_benchmarks(digits=DEFAULT_DIGITS, implementations=IMPLEMENTATIONS, repeats=3, seed=1):
+    """Runs the pipeline on operands of the given numbers of digits"""
+    rng = random.Random(seed)
+    results = {}
+    for n_digits in digits:
+        a = random_number(n_digits, rng)
+        b = random_number(n_digits, rng)
+        size_results = results[str(n_digits)] = {}
+        products = set()
+        for implementation in implementations:
+            try:
+                (product, timings) = run_pipeline(a, b, implementation, repeats)
+            except JobFailed as e:
+                size_results[implementation] = {'error': str(e)}
+                continue
+            products.add(product)
+            size_results[implementation] = timings
+        size_results['same_result'] = len(products) <= 1
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the overhead of the jobs of the LongMult pipeline versus their compute time')
+    parser.add_argument('-o', '--output', default='-', help='Output file ("-" for the standard output)')
+    parser.add_argument('--digits', type=int, action='append', help='Number of digits of the operands. Can be repeated (default: {0})'.format(' '.join(str(d) for d in DEFAULT_DIGITS)))
+    parser.add_argument('--implementation', action='append', choices=IMPLEMENTATIONS, help='Implementation of the arithmetic. Can be repeated (default: all)')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of times each job is run (the median is reported)')
+    args = parser.parse_args()
+    results = run_benchmarks(args.digits or DEFAULT_DIGITS, args.implementation or IMPLEMENTATIONS, args.repeats)
+    write_results('longmult', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
+
+
+class LongMultBenchmarkTestCase(unittest.TestCase):
+
+    def test_run_pipeline(self):
+        (product, timings) = run_pipeline('9650', '327', 'python')
+        self.assertEqual(product, str(9650 * 327))
+        self.assertEqual(timings['PartMultiply']['jobs'], 3)
+        self.assertGreaterEqual(timings['AddTogether']['wall_seconds'], timings['AddTogether']['compute_seconds'])
+
+    def test_run_benchmarks(self):
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest('numpy is not installed')
+        results = run_benchmarks([30, 1200], repeats=1)
+        self.assertTrue(results['30']['same_result'])
+        self.assertEqual(results['30']['numpy']['DigitFactory']['jobs'], 1)
+        self.assertIn('RecursionError', results['1200']['python']['error'])
+        self.assertGreater(results['1200']['numpy']['AddTogether']['compute_seconds'], 0)
@@ -0,0 +1,196 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cost of the parameter substitution (eHive.params.ParamContainer).
+
+Synthetic parameter sets cover the typical shapes of job parameters:
+ - wide: many independent scalar parameters
+ - deep: a long chain of references (#p199# -> #p198# -> ... -> 0)
+ - expr: many #expr()expr# that combine other parameters
+ - large_literals: large lists and dictionaries that have to be traversed
+ - repeated: a few parameters looked up many times
+
+For each of them the benchmark measures the time to materialise all the
+parameters from a fresh container, to run a sequence of get_param() calls,
+and to substitute template strings, as well as the peak memory allocated
+during the materialisation.
+
+    python3 -m eHive.benchmarks.params -o baseline.json
+    python3 -m eHive.benchmarks.params --baseline baseline.json --threshold 0.25
+
+The second command exits with a non-zero status if any timing or memory
+figure is more than 25% worse than in the baseline (plus a small absolute
+tolerance that absorbs the noise of the shortest measures).
+"""
+
+import argparse
+import collections
+import sys
+import time
+import tracemalloc
+import unittest
+
+from . import find_regressions, load_results, write_results
+from ..params import ParamContainer
+
+
+# Figures compared against the baseline, with their absolute tolerance
+REGRESSION_TOLERANCES = {'min_seconds': 0.002, 'peak_memory_kb': 64}
+
+# Each level of reference costs a few Python frames
+MAX_CHAIN_DEPTH = 200
+
+Scenario = collections.namedtuple('Scenario', ['params', 'lookups', 'templates'])
+
+
+def make_scenarios(scale=1.):
+    """Returns the synthetic parameter sets, with their size multiplied by scale"""
+    def n(x):
+        return max(1, int(x * scale))
+    scenarios = collections.OrderedDict()
+
+    n_wide = n(10000)
+    wide = {}
+    for i in range(n_wide):
+        wide['p{0}'.format(i)] = i if i % 2 else 'value {0}'.format(i)
+    scenarios['wide'] = Scenario(wide, list(wide.keys()), [' '.join('#p{0}#'.format(i) for i in range(min(n_wide, 100)))])
+
+    depth = min(MAX_CHAIN_DEPTH, n(MAX_CHAIN_DEPTH))
+    deep = {'p0': 0}
+    for i in range(1, depth):
+        deep['p{0}'.format(i)] = '#p{0}#'.format(i - 1)
+    scenarios['deep'] = Scenario(deep, ['p{0}'.format(depth - 1)], ['top: #p{0}#, middle: #p{1}#'.format(depth - 1, depth // 2)])
+
+    expr = {'a': 3, 'b': 4, 'l': list(range(10))}
+    for i in range(n(2000)):
+        expr['e{0}'.format(i)] = '#expr( #a# * #b# + {0} )expr#'.format(i) if i % 2 else '#expr( sum(#l#) + #a# )expr#'
+    scenarios['expr'] = Scenario(expr, list(expr.keys()), ['#expr( #a# + #b# )expr# and #expr( len(#l#) )expr#'] * n(100))
+
+    scenarios['large_literals'] = Scenario({
+        'big_list': list(range(n(100000))),
+        'big_dict': {'k{0}'.format(i): i for i in range(n(20000))},
+        'nested': [{'x': i, 'y': [i, str(i)]} for i in range(n(10000))],
+    }, ['big_list', 'big_dict', 'nested'], ['#big_list#'])
+
+    repeated = {'a': 1, 'b': '#a#', 'c': '#expr( #b# + 1 )expr#', 'name': 'job_#c#'}
+    scenarios['repeated'] = Scenario(repeated, ['name', 'c', 'b', 'a'] * n(25000), ['#name#/#a#'] * n(1000))
+
+    return scenarios
+
+
+def time_function(f, repeats):
+    """Returns the minimum and median durations of repeats runs of f()"""
+    durations = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        f()
+        durations.append(time.perf_counter() - t)
+    durations.sort()
+    return {'min_seconds': durations[0], 'median_seconds': durations[len(durations) // 2]}
+
+
+def materialise(params):
+    """Substitutes all the parameters of a fresh container"""
+    container = ParamContainer(params)
+    for name in params:
+        container.get_param(name)
+    return container
+
+
+def bench_scenario(scenario, repeats):
+    def get_params():
+        container = ParamContainer(scenario.params)
+        for name in scenario.lookups:
+            container.get_param(name)
+    container = materialise(scenario.params)
+    def substitute_strings():
+        for template in scenario.templates:
+            container.substitute_string(template)
+
+    results = {
+        'n_params': len(scenario.params),
+        'materialise': time_function(lambda: materialise(scenario.params), repeats),
+        'get_param': dict(time_function(get_params, repeats), n_calls=len(scenario.lookups)),
+        'substitute_string': dict(time_function(substitute_strings, repeats), n_calls=len(scenario.templates)),
+    }
+
+    # Measured separately as tracemalloc slows the allocations down
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.clear_traces()
+    start = tracemalloc.get_traced_memory()[0]
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    container = materialise(scenario.params)
+    peak = tracemalloc.get_traced_memory()[1]
+    if not already_tracing:
+        tracemalloc.stop()
+    results['peak_memory_kb'] = max(0, peak - start) // 1024
+    return results
+
+
+def run_benchmarks(scale=1., repeats=5):
+    """Runs the benchmark on all the scenarios"""
+    return {name: bench_scenario(scenario, repeats) for (name, scenario) in make_scenarios(scale).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the parameter substitution of the Python wrapper')
+    parser.add_argument('-o', '--output', default='-', help='Output file ("-" for the standard output)')
+    parser.add_argument('--scale', type=float, default=1., help='Multiplier of the size of the parameter sets')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of times each measure is repeated')
+    parser.add_argument('--baseline', help='Results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Tolerated slow-down / memory increase relative to the baseline')
+    args = parser.parse_args()
+    results = run_benchmarks(args.scale, args.repeats)
+    write_results('params', results, args.output)
+    if args.baseline:
+        regressions = find_regressions(results, load_results(args.baseline), args.threshold, REGRESSION_TOLERANCES)
+        for (path, old, new) in regressions:
+            print("Regression: {0} went from {1:.6g} to {2:.6g} ({3:+.1%})".format(path, old, new, new / old - 1 if old else float('inf')), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+
+
+class ParamsBenchmarkTestCase(unittest.TestCase):
+
+    def test_scenarios(self):
+        # The scenarios must be valid parameter sets
+        for (name, scenario) in make_scenarios(0.01).items():
+            container = materialise(scenario.params)
+            for template in scenario.templates:
+                self.assertNotIn('#', container.substitute_string(template), name)
+        self.assertEqual(materialise(make_scenarios(1).get('deep').params).get_param('p199'), 0)
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(scale=0.01, repeats=1)
+        self.assertEqual(sorted(results.keys()), ['deep', 'expr', 'large_literals', 'repeated', 'wide'])
+        self.assertEqual(results['wide']['n_params'], 100)
+        self.assertEqual(results['repeated']['get_param']['n_calls'], 1000)
+        self.assertGreater(results['large_literals']['peak_memory_kb'], 0)
+        self.assertGreater(results['expr']['materialise']['min_seconds'], 0)
+
+    def test_find_regressions(self):
+        baseline = {'wide': {'materialise': {'min_seconds': 1., 'median_seconds': 1.}, 'peak_memory_kb': 100}, 'gone': {'min_seconds': 1.}}
+        results = {'wide': {'materialise': {'min_seconds': 1.2, 'median_seconds': 3.}, 'peak_memory_kb': 200}, 'new': {'min_seconds': 1.}}
+        self.assertEqual(find_regressions(results, baseline, 0.25, REGRESSION_TOLERANCES), [('wide/peak_memory_kb', 100, 200)])
+        self.assertEqual(find_regressions(results, baseline, 0.1, REGRESSION_TOLERANCES), [('wide/materialise/min_seconds', 1., 1.2), ('wide/peak_memory_kb', 100, 200)])
+        self.assertEqual(find_regressions(results, baseline, 0.1, {'min_seconds': 1, 'peak_memory_kb': 500}), [])
@@ -0,0 +1,211 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput and latency of the GuestProcess protocol, as implemented by
+BaseRunnable.
+
+The Runnables are driven by the Python stand-in of GuestProcess
+(eHive.guest) over real pipes. Both sides run in the same process (in two
+threads), so the figures are mostly useful to compare two versions of the
+wrapper on the same machine. The benchmarks are:
+ - handshake: cost of starting a Runnable (VERSION and PARAM_DEFAULTS)
+ - job_overhead: jobs per second for Runnables that have 0 to 3 (empty)
+   life-cycle methods
+ - warning_rate / dataflow_rate: events per second, and the round-trip
+   latency of each event
+ - payload: time to send a payload of increasing size, both from
+   GuestProcess (as a job parameter) and to GuestProcess (as a dataflow)
+"""
+
+import argparse
+import itertools
+import time
+import unittest
+
+from . import summarize, write_results
+from ..guest import GuestProcessStandIn, make_job_config
+from ..process import BaseRunnable
+
+
+STEP_NAMES = ['fetch_input', 'run', 'write_output']
+
+DEFAULT_PAYLOAD_SIZES = [1 << 10, 10 << 10, 100 << 10, 1 << 20, 10 << 20, 100 << 20]
+
+
+def steps_runnable(n_steps):
+    """Returns a Runnable class that has the first n_steps life-cycle methods, all empty"""
+    def noop(self):
+        pass
+    return type('Steps{0}Runnable'.format(n_steps), (BaseRunnable,), {s: noop for s in STEP_NAMES[:n_steps]})
+
+
+class ChattyRunnable(BaseRunnable):
+    """Runnable that only sends events"""
+
+    def param_defaults(self):
+        return {
+            'n_warnings': 0,
+            'n_dataflows': 0,
+            'payload_size': 0,
+        }
+
+    def run(self):
+        payload = 'x' * self.param('payload_size')
+        for _ in range(self.param('n_warnings')):
+            self.warning(payload or 'benchmark')
+        for i in range(self.param('n_dataflows')):
+            self.dataflow({'i': i, 'payload': payload}, 2)
+
+
+class TimedStandIn(GuestProcessStandIn):
+    """GuestProcess stand-in that records when messages come and go"""
+
+    def __init__(self, jobs):
+        super().__init__(jobs, keep_events=False)
+        self.run_start = None
+        self.handshake_end = None
+        self.last_send = None
+        self.last_interval = None
+        # event -> time between the previous message sent by the stand-in and the event
+        self.intervals = {}
+        self.job_latencies = []
+
+    def run(self, runnable_class, debug=0):
+        self.run_start = self.last_send = time.perf_counter()
+        super().run(runnable_class, debug)
+
+    def send(self, message):
+        super().send(message)
+        self.last_send = time.perf_counter()
+
+    def read(self):
+        msg = super().read()
+        self.last_interval = time.perf_counter() - self.last_send
+        return msg
+
+    def handshake(self):
+        super().handshake()
+        self.handshake_end = time.perf_counter()
+
+    def serve_job(self, config):
+        t = time.perf_counter()
+        super().serve_job(config)
+        self.job_latencies.append(time.perf_counter() - t)
+
+    def respond(self, event, content):
+        self.intervals.setdefault(event, []).append(self.last_interval)
+        return super().respond(event, content)
+
+
+def bench_handshake(repeats):
+    """Time to start a Runnable and complete the handshake"""
+    durations = []
+    for _ in range(repeats):
+        standin = TimedStandIn([])
+        standin.run(steps_runnable(0))
+        durations.append(standin.handshake_end - standin.run_start)
+    return {'seconds': summarize(durations)}
+
+
+def bench_job_overhead(n_jobs, max_steps=len(STEP_NAMES)):
+    """Jobs per second of Runnables that do nothing"""
+    results = {}
+    for n_steps in range(max_steps + 1):
+        standin = TimedStandIn(make_job_config({}, dbID=i) for i in range(1, n_jobs + 1))
+        standin.run(steps_runnable(n_steps))
+        elapsed = time.perf_counter() - standin.handshake_end
+        results['{0}_steps'.format(n_steps)] = {
+            'jobs': n_jobs,
+            'jobs_per_second': n_jobs / elapsed,
+            'messages_per_job': sum(standin.event_counts.values()) / n_jobs,
+            'job_seconds': summarize(standin.job_latencies),
+        }
+    return results
+
+
+def bench_event_rate(event, n_events):
+    """Events per second, and round-trip latency, when a Runnable sends many events in a row"""
+    param_name = {'WARNING': 'n_warnings', 'DATAFLOW': 'n_dataflows'}[event]
+    standin = TimedStandIn([make_job_config({param_name: n_events})])
+    standin.run(ChattyRunnable)
+    intervals = standin.intervals[event]
+    return {
+        'events': n_events,
+        'events_per_second': n_events / sum(intervals),
+        'roundtrip_seconds': summarize(intervals),
+    }
+
+
+def bench_payload(sizes, max_bytes_per_size):
+    """Time to transfer a payload of each size in both directions.
+    Each size is repeated until max_bytes_per_size bytes have been sent (at least once)"""
+    results = {}
+    for size in sizes:
+        repeats = max(1, max_bytes_per_size // size)
+        inbound = TimedStandIn(make_job_config({'payload': 'x' * size}, input_id='{}') for _ in range(repeats))
+        inbound.run(steps_runnable(0))
+        outbound = TimedStandIn(make_job_config({'payload_size': size, 'n_dataflows': 1}) for _ in range(repeats))
+        outbound.run(ChattyRunnable)
+        results[str(size)] = {
+            'repeats': repeats,
+            # The parameters are sent back to GuestProcess in JOB_END, so the payload travels 3 times
+            'parameter': {'job_seconds': summarize(inbound.job_latencies), 'megabytes_per_second': 3 * size * repeats / sum(inbound.job_latencies) / 1e6},
+            'dataflow': {'roundtrip_seconds': summarize(outbound.intervals['DATAFLOW']), 'megabytes_per_second': size * repeats / sum(outbound.intervals['DATAFLOW']) / 1e6},
+        }
+    return results
+
+
+def run_benchmarks(scale=1., payload_sizes=DEFAULT_PAYLOAD_SIZES):
+    """Runs all the benchmarks. scale multiplies the number of iterations"""
+    def n(x):
+        return max(1, int(x * scale))
+    return {
+        'handshake': bench_handshake(n(100)),
+        'job_overhead': bench_job_overhead(n(2000)),
+        'warning_rate': bench_event_rate('WARNING', n(20000)),
+        'dataflow_rate': bench_event_rate('DATAFLOW', n(20000)),
+        'payload': bench_payload(payload_sizes, n(32 << 20)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the GuestProcess protocol of the Python wrapper')
+    parser.add_argument('-o', '--output', default='-', help='Output file ("-" for the standard output)')
+    parser.add_argument('--scale', type=float, default=1., help='Multiplier of the number of iterations')
+    parser.add_argument('--max-payload-size', type=int, default=DEFAULT_PAYLOAD_SIZES[-1], help='Size (in bytes) of the largest payload')
+    args = parser.parse_args()
+    results = run_benchmarks(args.scale, [s for s in DEFAULT_PAYLOAD_SIZES if s <= args.max_payload_size])
+    write_results('protocol', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
+
+
+class ProtocolBenchmarkTestCase(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(scale=0.001, payload_sizes=[1 << 10, 1 << 16])
+        self.assertEqual(results['handshake']['seconds']['n'], 1)
+        self.assertEqual(sorted(results['job_overhead'].keys()), ['0_steps', '1_steps', '2_steps', '3_steps'])
+        # JOB_STATUS_UPDATE for each step and JOB_END
+        self.assertEqual([results['job_overhead']['{0}_steps'.format(i)]['messages_per_job'] for i in range(4)], [1, 2, 3, 4])
+        self.assertEqual(results['warning_rate']['roundtrip_seconds']['n'], 20)
+        self.assertEqual(results['dataflow_rate']['events'], 20)
+        self.assertGreater(results['dataflow_rate']['events_per_second'], 0)
+        self.assertEqual(sorted(results['payload'].keys()), ['1024', '65536'])
+        self.assertEqual(results['payload']['65536']['repeats'], 1)
+        self.assertEqual(results['payload']['1024']['dataflow']['roundtrip_seconds']['n'], 32)
@@ -0,0 +1,316 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bundles of pre-compiled Runnables, to import them from node-local disk.
+
+`wrapper bundle <output_dir> <zip|dir>` compiles to bytecode the packages
+of all the Runnables of the index (see eHive.runnable_index), the eHive
+package itself, and the dependencies the Runnables declare in their
+`bundle_dependencies` class attribute (or that are listed in the
+environment variable EHIVE_PYTHON_BUNDLE_EXTRA, comma-separated). The
+bundle is named after a digest of its content so that several versions
+can coexist. `wrapper build` also makes a bundle when
+EHIVE_PYTHON_BUNDLE_DIR is set.
+
+When the environment variable EHIVE_PYTHON_BUNDLE points at a bundle
+(e.g. copied to a local disk), the `run` mode imports the bundled modules
+from it. Every module is checked against the modification time and size
+of its source file, and imported from the source if it has changed.
+Modules keep their original __file__, so that data files are still found
+next to the sources.
+"""
+
+import hashlib
+import importlib.abc
+import importlib.util
+import json
+import marshal
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def package_modules(name):
+    """Returns the list of (module_name, source_path, is_package) of a
+    module, or of all the modules of a package"""
+    spec = importlib.util.find_spec(name)
+    if spec is None or not spec.has_location or not spec.origin or not spec.origin.endswith('.py'):
+        # Built-in, extension or namespace modules cannot be bundled
+        return []
+    if not spec.submodule_search_locations:
+        return [(name, spec.origin, False)]
+    modules = []
+    root = os.path.dirname(spec.origin)
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        if not os.path.exists(os.path.join(dirpath, '__init__.py')):
+            dirnames[:] = []
+            continue
+        dirnames[:] = sorted(d for d in dirnames if d.isidentifier())
+        relative = os.path.relpath(dirpath, root)
+        prefix = name if relative == '.' else name + '.' + relative.replace(os.sep, '.')
+        for filename in sorted(filenames):
+            if not filename.endswith('.py'):
+                continue
+            if filename == '__init__.py':
+                modules.append((prefix, os.path.join(dirpath, filename), True))
+            elif filename[:-3].isidentifier():
+                modules.append((prefix + '.' + filename[:-3], os.path.join(dirpath, filename), False))
+    return modules
+
+
+def compile_to_pyc(source_path):
+    """Returns the content of the .pyc file of a source file, with the
+    standard header (magic number, flags, mtime, size)"""
+    with open(source_path, 'rb') as fh:
+        source = fh.read()
+    code = compile(source, source_path, 'exec', dont_inherit=True)
+    st = os.stat(source_path)
+    header = importlib.util.MAGIC_NUMBER + (0).to_bytes(4, 'little') + (int(st.st_mtime) & 0xFFFFFFFF).to_bytes(4, 'little') + (st.st_size & 0xFFFFFFFF).to_bytes(4, 'little')
+    return header + marshal.dumps(code)
+
+
+def build_bundle(output_dir, package_names, bundle_format='zip'):
+    """Compiles all the modules of the packages and writes them, with a
+    manifest, in a new bundle in output_dir. Returns the path of the bundle"""
+    modules = {}
+    for name in package_names:
+        for (module_name, source_path, is_package) in package_modules(name):
+            modules[module_name] = (source_path, is_package)
+
+    manifest = {'magic': importlib.util.MAGIC_NUMBER.hex(), 'cache_tag': sys.implementation.cache_tag, 'modules': {}}
+    contents = {}
+    digest = hashlib.sha1(manifest['magic'].encode())
+    for (module_name, (source_path, is_package)) in sorted(modules.items()):
+        try:
+            pyc = compile_to_pyc(source_path)
+        except (OSError, SyntaxError, ValueError) as e:
+            print("Cannot compile {0}: {1}".format(source_path, e), file=sys.stderr)
+            continue
+        relpath = module_name.replace('.', '/') + ('/__init__.pyc' if is_package else '.pyc')
+        st = os.stat(source_path)
+        manifest['modules'][module_name] = {'source': source_path, 'mtime': st.st_mtime, 'size': st.st_size, 'pyc': relpath, 'is_package': is_package}
+        contents[relpath] = pyc
+        # marshal's output is not reproducible, so the digest is made from the sources' attributes
+        digest.update(json.dumps([module_name, manifest['modules'][module_name]], sort_keys=True).encode())
+
+    os.makedirs(output_dir, exist_ok=True)
+    name = 'ehive_python_bundle_' + digest.hexdigest()[:16]
+    manifest['version'] = name
+    manifest_bytes = json.dumps(manifest, indent=1, sort_keys=True).encode()
+    if bundle_format == 'zip':
+        path = os.path.join(output_dir, name + '.zip')
+        (fd, tmp_path) = tempfile.mkstemp(dir=output_dir, prefix='.tmp.')
+        with os.fdopen(fd, 'wb') as fh, zipfile.ZipFile(fh, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for (relpath, pyc) in sorted(contents.items()):
+                zf.writestr(relpath, pyc)
+            zf.writestr(MANIFEST_NAME, manifest_bytes)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    elif bundle_format == 'dir':
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            # Same digest, same content
+            return path
+        tmp_path = tempfile.mkdtemp(dir=output_dir, prefix='.tmp.')
+        for (relpath, pyc) in contents.items():
+            os.makedirs(os.path.join(tmp_path, os.path.dirname(relpath)), exist_ok=True)
+            with open(os.path.join(tmp_path, relpath), 'wb') as fh:
+                fh.write(pyc)
+        with open(os.path.join(tmp_path, MANIFEST_NAME), 'wb') as fh:
+            fh.write(manifest_bytes)
+        os.chmod(tmp_path, 0o755)
+        os.rename(tmp_path, path)
+    else:
+        raise ValueError("Unknown bundle format '{0}'. Expecting 'zip' or 'dir'".format(bundle_format))
+    return path
+
+
+def runnable_packages(index):
+    """Names of the packages to bundle for the Runnables of the index: their
+    top-level packages, their declared dependencies, and eHive"""
+    from .utils import find_module
+    names = {'eHive'}
+    names.update(n.strip() for n in os.environ.get('EHIVE_PYTHON_BUNDLE_EXTRA', '').split(',') if n.strip())
+    for module_name in index.runnables:
+        names.add(module_name.split('.')[0])
+        try:
+            names.update(getattr(find_module(module_name), 'bundle_dependencies', []))
+        except ImportError:
+            pass
+    return sorted(names)
+
+
+class Bundle:
+    """Read access to a bundle (zip file or directory)"""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.isdir(path):
+            self.zip = None
+            with open(os.path.join(path, MANIFEST_NAME), 'rb') as fh:
+                self.manifest = json.loads(fh.read().decode())
+        else:
+            self.zip = zipfile.ZipFile(path)
+            self.manifest = json.loads(self.zip.read(MANIFEST_NAME).decode())
+        self.modules = self.manifest['modules']
+        # How many modules have been imported from the bundle / from their (modified) sources
+        self.hits = 0
+        self.stale = 0
+
+    def is_compatible(self):
+        """Whether the bytecode can be run by this interpreter"""
+        return self.manifest['magic'] == importlib.util.MAGIC_NUMBER.hex()
+
+    def read_code(self, entry):
+        if self.zip is None:
+            with open(os.path.join(self.path, entry['pyc']), 'rb') as fh:
+                data = fh.read()
+        else:
+            data = self.zip.read(entry['pyc'])
+        if data[:4] != importlib.util.MAGIC_NUMBER:
+            raise ImportError("Bad magic number in {0}:{1}".format(self.path, entry['pyc']))
+        return marshal.loads(data[16:])
+
+
+class BundleLoader(importlib.abc.Loader):
+    """Executes the bytecode of a module stored in a bundle"""
+
+    def __init__(self, bundle, entry):
+        self.bundle = bundle
+        self.entry = entry
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        exec(self.bundle.read_code(self.entry), module.__dict__)
+
+
+class BundleFinder(importlib.abc.MetaPathFinder):
+    """Finds the modules of a bundle whose sources have not changed"""
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+
+    def find_spec(self, fullname, path=None, target=None):
+        entry = self.bundle.modules.get(fullname)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(entry['source'])
+            up_to_date = (st.st_mtime == entry['mtime'] and st.st_size == entry['size'])
+        except OSError:
+            # The source has been removed: the bundle is the only copy left but it is not trusted
+            up_to_date = False
+        if not up_to_date:
+            self.bundle.stale += 1
+            return None
+        self.bundle.hits += 1
+        locations = [os.path.dirname(entry['source'])] if entry['is_package'] else None
+        return importlib.util.spec_from_file_location(fullname, entry['source'], loader=BundleLoader(self.bundle, entry), submodule_search_locations=locations)
+
+
+def install(path):
+    """Makes the modules of the bundle importable, with the highest priority.
+    Returns the Bundle, or None if it cannot be used"""
+    try:
+        bundle = Bundle(path)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print("Cannot read the bundle {0}: {1}".format(path, e), file=sys.stderr)
+        return None
+    if not bundle.is_compatible():
+        print("The bundle {0} has been built for another version of Python ({1})".format(path, bundle.manifest['cache_tag']), file=sys.stderr)
+        return None
+    sys.meta_path.insert(0, BundleFinder(bundle))
+    return bundle
+
+
+def install_from_environment():
+    path = os.environ.get('EHIVE_PYTHON_BUNDLE')
+    return install(path) if path else None
+
+
+class BundleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.dir, 'src')
+        package_dir = os.path.join(self.src_dir, 'ehive_bundle_test_pkg')
+        os.makedirs(os.path.join(package_dir, 'sub'))
+        for (relpath, content) in [('__init__.py', 'X = 1\n'), ('Runnable.py', 'VALUE = "original"\n'), ('sub/__init__.py', ''), ('sub/helper.py', 'from .. import X\nY = X + 1\n')]:
+            with open(os.path.join(package_dir, relpath), 'w') as fh:
+                fh.write(content)
+        self.runnable_path = os.path.join(package_dir, 'Runnable.py')
+        sys.path.insert(0, self.src_dir)
+        self.meta_path = list(sys.meta_path)
+
+    def tearDown(self):
+        sys.path.remove(self.src_dir)
+        sys.meta_path[:] = self.meta_path
+        for name in list(sys.modules):
+            if name.startswith('ehive_bundle_test_pkg'):
+                del sys.modules[name]
+        shutil.rmtree(self.dir)
+
+    def check_bundle(self, bundle_format):
+        path = build_bundle(os.path.join(self.dir, 'bundles'), ['ehive_bundle_test_pkg'], bundle_format)
+        self.assertTrue(os.path.basename(path).startswith('ehive_python_bundle_'))
+        # Same content -> same name
+        self.assertEqual(build_bundle(os.path.join(self.dir, 'bundles'), ['ehive_bundle_test_pkg'], bundle_format), path)
+
+        # Change the source but keep its mtime and size: the bundled version is used
+        st = os.stat(self.runnable_path)
+        with open(self.runnable_path, 'w') as fh:
+            fh.write('VALUE = "modified"\n')
+        os.utime(self.runnable_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        bundle = install(path)
+        import ehive_bundle_test_pkg.Runnable
+        import ehive_bundle_test_pkg.sub.helper
+        self.assertEqual(ehive_bundle_test_pkg.Runnable.VALUE, 'original')
+        self.assertEqual(ehive_bundle_test_pkg.sub.helper.Y, 2)
+        self.assertEqual(ehive_bundle_test_pkg.Runnable.__file__, self.runnable_path)
+        self.assertIsInstance(ehive_bundle_test_pkg.Runnable.__spec__.loader, BundleLoader)
+        self.assertEqual((bundle.hits, bundle.stale), (4, 0))
+
+        # A new mtime: the source is used
+        del sys.modules['ehive_bundle_test_pkg.Runnable']
+        os.utime(self.runnable_path, (st.st_atime + 10, st.st_mtime + 10))
+        import ehive_bundle_test_pkg.Runnable
+        self.assertEqual(ehive_bundle_test_pkg.Runnable.VALUE, 'modified')
+        self.assertEqual(bundle.stale, 1)
+
+    def test_zip_bundle(self):
+        self.check_bundle('zip')
+
+    def test_dir_bundle(self):
+        self.check_bundle('dir')
+
+    def test_incompatible_bundle(self):
+        path = build_bundle(os.path.join(self.dir, 'bundles'), ['ehive_bundle_test_pkg'], 'dir')
+        with open(os.path.join(path, MANIFEST_NAME), 'r') as fh:
+            manifest = json.load(fh)
+        manifest['magic'] = '00000000'
+        with open(os.path.join(path, MANIFEST_NAME), 'w') as fh:
+            json.dump(manifest, fh)
+        self.assertIsNone(install(path))
+        self.assertEqual(sys.meta_path, self.meta_path)
@@ -0,0 +1,129 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Storage of job checkpoints, so that retried jobs can resume their work.
+
+Checkpoints are pickled and written atomically in a directory, one file
+per job. The directory is given by the environment variable
+EHIVE_PYTHON_CHECKPOINT_DIR and must be on a filesystem shared by all the
+workers: a job that hits MEMLIMIT or RUNLIMIT is retried by another worker,
+possibly on another host. There is no default, as the worker's temporary
+directory is deleted when the worker exits. BaseRunnable.checkpoint() and
+restore_checkpoint() raise CheckpointException when the variable is not set.
+"""
+
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+
+class CheckpointException(Exception):
+    """Raised when checkpoints are used but EHIVE_PYTHON_CHECKPOINT_DIR is not set"""
+    pass
+
+
+class CheckpointStore:
+    """Directory holding the latest checkpoint of each job"""
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def from_environment(cls):
+        """Returns a CheckpointStore configured from the environment, or None"""
+        path = os.environ.get('EHIVE_PYTHON_CHECKPOINT_DIR')
+        return cls(path) if path else None
+
+    def path_for(self, job):
+        """Path of the checkpoint file of a job. The URL of the hive database
+        and the input_id are included in the name to tell apart the jobs of
+        different pipelines (or copies of a pipeline) that have the same dbID.
+        The URL of a pipeline re-initialised with -hive_force_init does not
+        change, so BaseRunnable discards the checkpoint on the first attempt
+        of every job"""
+        job_digest = hashlib.sha1('{0}\n{1}'.format(job.hive_pipeline_url, job.input_id).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.path, 'job_{0}_{1}.pickle'.format(job.dbID, job_digest))
+
+    def save(self, job, state):
+        """Atomically replaces the checkpoint of the job with "state" """
+        os.makedirs(self.path, exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=self.path, prefix='.tmp.')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(state, fh, protocol=pickle.HIGHEST_PROTOCOL)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.replace(tmp_path, self.path_for(job))
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    def load(self, job):
+        """Returns the last state saved for the job, or None. Checkpoints
+        are ignored on the first attempt of a job as they can only be stale"""
+        if not job.retry_count:
+            return None
+        try:
+            with open(self.path_for(job), 'rb') as fh:
+                return pickle.load(fh)
+        except FileNotFoundError:
+            return None
+
+    def discard(self, job):
+        """Removes the checkpoint of the job, if any"""
+        try:
+            os.unlink(self.path_for(job))
+        except FileNotFoundError:
+            pass
+
+
+class CheckpointStoreTestCase(unittest.TestCase):
+
+    class FakeJob:
+        def __init__(self, dbID, input_id, retry_count, hive_pipeline_url='sqlite:///hive.db'):
+            self.dbID = dbID
+            self.input_id = input_id
+            self.retry_count = retry_count
+            self.hive_pipeline_url = hive_pipeline_url
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = CheckpointStore(os.path.join(self.dir, 'checkpoints'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_and_load(self):
+        job = self.FakeJob(3, "{'a' => 1}", 0)
+        self.store.save(job, {'stage': 2, 'done': [1, 2]})
+        self.assertIsNone(self.store.load(job), 'Checkpoints are ignored on the first attempt')
+        job.retry_count = 1
+        self.assertEqual(self.store.load(job), {'stage': 2, 'done': [1, 2]})
+        self.store.save(job, {'stage': 3})
+        self.assertEqual(self.store.load(job), {'stage': 3})
+        self.assertIsNone(self.store.load(self.FakeJob(3, "{'a' => 2}", 1)), 'Another job with the same dbID')
+        self.assertIsNone(self.store.load(self.FakeJob(3, "{'a' => 1}", 1, 'sqlite:///copy.db')), 'The same job in a copy of the pipeline')
+        self.assertEqual(os.listdir(self.store.path), [os.path.basename(self.store.path_for(job))])
+
+    def test_discard(self):
+        job = self.FakeJob(3, '{}', 1)
+        self.store.discard(job)
+        self.store.save(job, 'state')
+        self.store.discard(job)
+        self.assertIsNone(self.store.load(job))
@@ -0,0 +1,47 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import eHive
+
+
+class CalcOverallPercentage(eHive.BaseRunnable):
+    """Computes the overall %GC from the counts of all the CountATGC jobs,
+    gathered in the 'at_count' and 'gc_count' list Accumulators"""
+
+    def run(self):
+        at_sum = sum(self.param_required('at_count'))
+        gc_sum = sum(self.param_required('gc_count'))
+        percentage = gc_sum / (at_sum + gc_sum) if at_sum + gc_sum else 0
+        self.param('result', percentage)
+        self.warning('percentage is {0}'.format(percentage))
+
+
+    def write_output(self):
+        self.dataflow( { 'result': self.param('result') }, 1)
+
+
+class CalcOverallPercentageTestCase(unittest.TestCase):
+
+    def test_percentage(self):
+        eHive.testRunnable(self, CalcOverallPercentage, {'at_count': [7, 3], 'gc_count': [8, 2]}, [
+            eHive.WarningEvent('percentage is 0.5', False),
+            eHive.DataflowEvent({'result': 0.5}, 1),
+        ])
+        eHive.testRunnable(self, CalcOverallPercentage, {'at_count': [], 'gc_count': []}, [
+            eHive.WarningEvent('percentage is 0', False),
+            eHive.DataflowEvent({'result': 0}, 1),
+        ])
@@ -0,0 +1,180 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Python version of Bio::EnsEMBL::Hive::Examples::GC::RunnableDB::CountATGC.
+
+The sequences are read from a memory-mapped file: either a whole chunk
+file ('chunk_name'), or the byte ranges of 'inputfile' given in
+'chunk_ranges' by eHive.runnables.FastaFactory with write_chunks=0. The
+header lines are skipped, and the sequence data is counted in blocks of
+'block_size' bytes with a NumPy lookup table (or bytes.count() if NumPy
+is not installed), 'max_parallel' blocks at a time.
+
+Unlike the Perl version, which only reads the first sequence of the
+chunk, all the sequences are counted.
+"""
+
+import concurrent.futures
+import mmap
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import eHive
+
+
+class CountATGC(eHive.BaseRunnable):
+    """Counts the A/T and G/C bases of a chunk of a FASTA file"""
+
+    def param_defaults(self):
+        return {
+            'take_time'     : 0,
+            'chunk_name'    : None,
+            'chunk_ranges'  : None,
+            'block_size'    : 1 << 22,
+            'max_parallel'  : 1,
+        }
+
+
+    def fetch_input(self):
+        """Opens the file here, so that the job fails early if it cannot be read"""
+        if self.param('chunk_ranges') is not None:
+            path = self.param_required('inputfile')
+        else:
+            path = self.param_required('chunk_name')
+        self._fh = open(path, 'rb')
+        size = os.fstat(self._fh.fileno()).st_size
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        ranges = self.param('chunk_ranges')
+        self._ranges = [(offset, offset + length) for (offset, length) in ranges] if ranges is not None else [(0, size)]
+
+
+    def run(self):
+        blocks = []
+        for (start, end) in self._ranges:
+            blocks.extend(split_blocks(iter_sequence_segments(self._mm, start, end), self.param('block_size')))
+        counter = BlockCounter(self._mm)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.param('max_parallel'))) as executor:
+            counts = list(executor.map(counter.count, blocks))
+        del counter
+        self.param('at_count', sum(c[0] for c in counts))
+        self.param('gc_count', sum(c[1] for c in counts))
+        time.sleep( self.param('take_time') )
+
+
+    def write_output(self):
+        self.dataflow( {
+            'at_count' : self.param('at_count'),
+            'gc_count' : self.param('gc_count'),
+        }, 1)
+
+
+    def post_cleanup(self):
+        if hasattr(self, '_mm'):
+            if isinstance(self._mm, mmap.mmap):
+                self._mm.close()
+            self._fh.close()
+            del self._mm
+            del self._fh
+
+
+def iter_sequence_segments(mm, start, end):
+    """Yields the (start, end) byte offsets of the sequence lines found
+    between start and end, i.e. without the header lines"""
+    pos = start
+    while pos < end:
+        if mm[pos:pos + 1] == b'>':
+            eol = mm.find(b'\n', pos, end)
+            if eol < 0:
+                return
+            pos = eol + 1
+            continue
+        next_header = mm.find(b'\n>', pos, end)
+        segment_end = end if next_header < 0 else next_header + 1
+        yield (pos, segment_end)
+        pos = segment_end
+
+
+def split_blocks(segments, block_size):
+    """Cuts the segments into blocks of at most block_size bytes"""
+    for (start, end) in segments:
+        for block_start in range(start, end, block_size):
+            yield (block_start, min(block_start + block_size, end))
+
+
+class BlockCounter:
+    """Counts the A/T and G/C bases of byte ranges of a memory-mapped file.
+    The NumPy operations release the GIL, so blocks can be counted in
+    parallel threads"""
+
+    def __init__(self, mm):
+        self.mm = mm
+        if numpy is not None and len(mm):
+            self.array = numpy.frombuffer(mm, dtype=numpy.uint8)
+            self.table = numpy.zeros(256, dtype=numpy.uint8)
+            for base in b'ATat':
+                self.table[base] = 1
+            for base in b'GCgc':
+                self.table[base] = 2
+        else:
+            self.array = None
+
+    def count(self, block):
+        (start, end) = block
+        if self.array is None:
+            data = self.mm[start:end]
+            return (sum(data.count(base) for base in [b'A', b'T', b'a', b't']), sum(data.count(base) for base in [b'G', b'C', b'g', b'c']))
+        classes = self.table.take(self.array[start:end])
+        return (int(numpy.count_nonzero(classes == 1)), int(numpy.count_nonzero(classes == 2)))
+
+
+class CountATGCTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'in.fa')
+        with open(self.path, 'w') as fh:
+            fh.write('>GATTACA one\nAATTGGCC\nNNac\n>CCC two\n\n>three\nggg\ntt\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_segments(self):
+        with open(self.path, 'rb') as fh:
+            data = fh.read()
+        self.assertEqual([data[s:e] for (s, e) in iter_sequence_segments(data, 0, len(data))], [b'AATTGGCC\nNNac\n', b'\n', b'ggg\ntt\n'])
+        self.assertEqual(list(split_blocks([(0, 10), (12, 14)], 4)), [(0, 4), (4, 8), (8, 10), (12, 14)])
+
+    def test_count(self):
+        global numpy
+        expected = [eHive.DataflowEvent({'at_count': 7, 'gc_count': 8}, 1)]
+        for block_size in [1, 3, 1000]:
+            eHive.testRunnable(self, CountATGC, {'chunk_name': self.path, 'block_size': block_size, 'max_parallel': 3}, expected)
+        # The second and third records only, as given by FastaFactory with write_chunks=0
+        eHive.testRunnable(self, CountATGC, {'inputfile': self.path, 'chunk_ranges': [[27, 10], [37, 14]]}, [eHive.DataflowEvent({'at_count': 2, 'gc_count': 3}, 1)])
+        saved_numpy = numpy
+        numpy = None
+        try:
+            eHive.testRunnable(self, CountATGC, {'chunk_name': self.path, 'block_size': 3}, expected)
+        finally:
+            numpy = saved_numpy
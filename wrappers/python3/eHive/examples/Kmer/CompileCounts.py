@@ -0,0 +1,89 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Python version of Bio::EnsEMBL::Hive::Examples::Kmer::RunnableDB::CompileCountsHoH.
+
+The "all_counts" Accumulator is a hash of compact counts (as dataflown by
+eHive.examples.Kmer.CountKmers) indexed by chunk file name. They are
+merged with a single sort of all the codes, and the total count of every
+k-mer is dataflown on branch 4 (e.g. to the final_result table),
+"dataflow_chunk_size" rows at a time.
+"""
+
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import eHive
+
+from .CountKmers import decode_kmers, merge_counts
+
+
+class CompileCounts(eHive.BaseRunnable):
+    """Adds up the k-mer counts of all the CountKmers jobs"""
+
+    def param_defaults(self):
+        return {
+            'all_counts'            : {},
+            'dataflow_chunk_size'   : 1000,
+        }
+
+
+    def run(self):
+        if numpy is None:
+            raise ImportError('CompileCounts requires numpy')
+        all_counts = list(self.param('all_counts').values())
+        ks = set(c['k'] for c in all_counts)
+        if len(ks) > 1:
+            raise ValueError('The counts have been made with different values of k: {0}'.format(sorted(ks)))
+        (codes, counts) = merge_counts([c['codes'] for c in all_counts], [c['counts'] for c in all_counts])
+        self.param('sum_of_counts', (ks.pop() if ks else None, codes, counts))
+
+
+    def write_output(self):
+        (k, codes, counts) = self.param('sum_of_counts')
+        filename = self.param('inputfile')
+        chunk_size = self.param('dataflow_chunk_size')
+        for start in range(0, len(codes), chunk_size):
+            kmers = decode_kmers(codes[start:start + chunk_size], k)
+            self.dataflow([{'filename': filename, 'kmer': kmer, 'count': count} for (kmer, count) in zip(kmers, counts[start:start + chunk_size].tolist())], 4)
+
+
+@unittest.skipUnless(numpy, 'numpy is not installed')
+class CompileCountsTestCase(unittest.TestCase):
+
+    def test_compile(self):
+        # AA=0, AC=1, CA=4, TT=15
+        all_counts = {
+            'chunk1.fa': {'k': 2, 'codes': [0, 1, 15], 'counts': [3, 1, 2]},
+            'chunk2.fa': {'k': 2, 'codes': [1, 4], 'counts': [5, 1]},
+            'chunk3.fa': {'k': 2, 'codes': [], 'counts': []},
+        }
+        eHive.testRunnable(self, CompileCounts, {'all_counts': all_counts, 'inputfile': 'in.fa', 'dataflow_chunk_size': 3}, [
+            eHive.DataflowEvent([
+                {'filename': 'in.fa', 'kmer': 'AA', 'count': 3},
+                {'filename': 'in.fa', 'kmer': 'AC', 'count': 6},
+                {'filename': 'in.fa', 'kmer': 'CA', 'count': 1},
+            ], 4),
+            eHive.DataflowEvent([{'filename': 'in.fa', 'kmer': 'TT', 'count': 2}], 4),
+        ])
+        all_counts['chunk3.fa']['k'] = 3
+        eHive.testRunnable(self, CompileCounts, {'all_counts': all_counts, 'inputfile': 'in.fa'}, [
+            eHive.FailureEvent(ValueError, ('The counts have been made with different values of k: [2, 3]',)),
+        ])
@@ -0,0 +1,278 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Python version of Bio::EnsEMBL::Hive::Examples::Kmer::RunnableDB::CountKmers.
+
+The file is read in blocks of "block_size" bytes, which are translated
+into 2-bit codes with NumPy (all the records of a block at once), and each k-mer becomes an integer (the 2k bits of
+its bases). They are counted with numpy.bincount() when the 4^k possible
+k-mers fit in a small array, and with numpy.unique() otherwise.
+
+The counts are dataflown in compact form on branch 3:
+{'sequence_file': ..., 'counts': {'k': k, 'codes': [...], 'counts': [...]}}
+with the codes sorted, to be stored in an Accumulator and merged by
+eHive.examples.Kmer.CompileCounts. Unlike the Perl version, k-mers are
+case-insensitive and those containing anything else than A, C, G or T
+are not counted. k is limited to 32.
+"""
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import eHive
+from eHive.tests import CallbackEvents
+
+
+# Largest k that fits in a 64-bit code
+MAX_K = 32
+
+# Above 4^k = DENSE_MAX_CODES, the counts are kept sparse
+DENSE_MAX_CODES = 1 << 22
+
+# Number of sparse partial counts accumulated before merging them
+SPARSE_MERGE_THRESHOLD = 1 << 24
+
+# Codes of the bytes: A, C, G, T -> 0..3, line breaks are skipped, anything else is invalid
+INVALID = 4
+SKIP = 5
+
+
+class CountKmers(eHive.BaseRunnable):
+    """Counts the k-mers of all the sequences of a FASTA file"""
+
+    def param_defaults(self):
+        return {
+            'block_size' : 4 << 20,
+        }
+
+
+    def run(self):
+        if numpy is None:
+            raise ImportError('CountKmers requires numpy')
+        sequence_file = self.param_required('sequence_file')
+        k = int(self.param_required('k'))
+        block_size = self.param('block_size')
+        encoder = FastaEncoder()
+        counter = KmerCounter(k)
+        opener = gzip.open if sequence_file.endswith('.gz') else open
+        with opener(sequence_file, 'rb') as fh:
+            while True:
+                block = fh.read(block_size)
+                if not block:
+                    break
+                counter.add(encoder.encode(block))
+        (codes, counts) = counter.result()
+        self.param('kmer_counts', compact_counts(k, codes, counts))
+
+
+    def write_output(self):
+        self.dataflow( {'counts': self.param('kmer_counts'), 'sequence_file': self.param('sequence_file')}, 3)
+
+
+def byte_table():
+    """Lookup table from the bytes of the file to the 2-bit codes"""
+    table = numpy.full(256, INVALID, dtype=numpy.uint8)
+    for (i, base) in enumerate(b'ACGT'):
+        table[base] = i
+        table[base + 32] = i
+    table[ord('\n')] = SKIP
+    table[ord('\r')] = SKIP
+    return table
+
+
+class FastaEncoder:
+    """Translates successive blocks of a FASTA file into arrays of 2-bit
+    codes. Header lines become INVALID codes, so that no k-mer spans two
+    records, and line breaks are removed"""
+
+    def __init__(self):
+        self.table = byte_table()
+        self.in_header = False
+        self.at_line_start = True
+
+    def encode(self, block):
+        raw = numpy.frombuffer(block, dtype=numpy.uint8)
+        bases = self.table[raw]
+        newlines = numpy.flatnonzero(raw == 0x0a)
+        # Header lines start with '>' right after a line break
+        line_starts = numpy.concatenate(([0] if self.at_line_start else [], newlines[newlines < len(raw) - 1] + 1)).astype(numpy.int64)
+        header_starts = line_starts[raw[line_starts] == 0x3e]
+        if self.in_header:
+            header_starts = numpy.concatenate(([0], header_starts))
+        header_ends = numpy.searchsorted(newlines, header_starts)
+        header_ends = numpy.append(newlines, len(raw))[header_ends]
+        delta = numpy.zeros(len(raw) + 1, dtype=numpy.int32)
+        numpy.add.at(delta, header_starts, 1)
+        numpy.add.at(delta, header_ends, -1)
+        bases[numpy.cumsum(delta[:-1], dtype=numpy.int32) > 0] = INVALID
+        self.in_header = bool(len(header_starts)) and header_ends[-1] == len(raw)
+        self.at_line_start = raw[-1] == 0x0a
+        return bases[bases != SKIP]
+
+
+class KmerCounter:
+    """Counts the k-mers of sequences given in successive blocks. The last
+    k-1 bases of a block are prepended to the next one so that the k-mers
+    that span two blocks are counted"""
+
+    def __init__(self, k):
+        if not 1 <= k <= MAX_K:
+            raise ValueError('k must be between 1 and {0}'.format(MAX_K))
+        self.k = k
+        self.tail = numpy.zeros(0, dtype=numpy.uint8)
+        self.dense = numpy.zeros(4 ** k, dtype=numpy.int64) if 4 ** k <= DENSE_MAX_CODES else None
+        self.partials = []
+        self.partials_size = 0
+
+    def add(self, bases):
+        if len(self.tail):
+            bases = numpy.concatenate((self.tail, bases))
+        self.tail = bases[max(0, len(bases) - self.k + 1):]
+        codes = encode_kmers(bases, self.k)
+        if not len(codes):
+            return
+        if self.dense is not None:
+            self.dense += numpy.bincount(codes, minlength=len(self.dense))
+        else:
+            self.partials.append(numpy.unique(codes, return_counts=True))
+            self.partials_size += len(self.partials[-1][0])
+            if self.partials_size > SPARSE_MERGE_THRESHOLD:
+                self.partials = [merge_counts(*zip(*self.partials))]
+                self.partials_size = len(self.partials[0][0])
+
+    def result(self):
+        """Returns the sorted codes of the k-mers seen, and their counts"""
+        if self.dense is not None:
+            codes = numpy.flatnonzero(self.dense).astype(numpy.uint64)
+            return (codes, self.dense[codes.astype(numpy.int64)])
+        if not self.partials:
+            return (numpy.zeros(0, dtype=numpy.uint64), numpy.zeros(0, dtype=numpy.int64))
+        return merge_counts(*zip(*self.partials))
+
+
+def encode_kmers(bases, k):
+    """Returns the codes of all the k-mers of an array of 2-bit codes,
+    skipping the k-mers that contain an invalid base. The codes (32-bit
+    integers up to k=16, 64-bit above) are assembled from the codes of
+    shorter k-mers whose lengths are the powers of 2 that make up k, in
+    log2(k) passes"""
+    n = len(bases) - k + 1
+    if n <= 0:
+        return numpy.zeros(0, dtype=numpy.uint32 if k <= 16 else numpy.uint64)
+    invalid = numpy.concatenate(([0], numpy.cumsum(bases == INVALID, dtype=numpy.int32)))
+    valid_windows = (invalid[k:] - invalid[:-k]) == 0
+    dtype = numpy.uint32 if k <= 16 else numpy.uint64
+    # block[i] is the code of bases[i:i+width], codes[i] the code of bases[i:i+codes_width]
+    block = (bases & 3).astype(dtype)
+    width = 1
+    codes = None
+    codes_width = 0
+    remaining = k
+    while True:
+        if remaining & 1:
+            if codes is None:
+                codes = block
+            else:
+                codes = (codes[:len(block) - codes_width] << dtype(2 * width)) | block[codes_width:]
+            codes_width += width
+        remaining >>= 1
+        if not remaining:
+            break
+        block = (block[:-width] << dtype(2 * width)) | block[width:]
+        width *= 2
+    return codes[:n][valid_windows]
+
+
+def merge_counts(codes_list, counts_list):
+    """Adds up several (codes, counts) arrays. Returns the sorted codes and their total counts"""
+    codes = numpy.concatenate([numpy.asarray(c, dtype=numpy.uint64) for c in codes_list])
+    counts = numpy.concatenate([numpy.asarray(c, dtype=numpy.int64) for c in counts_list])
+    if not len(codes):
+        return (codes, counts)
+    order = numpy.argsort(codes, kind='stable')
+    codes = codes[order]
+    starts = numpy.flatnonzero(numpy.concatenate(([True], codes[1:] != codes[:-1])))
+    return (codes[starts], numpy.add.reduceat(counts[order], starts))
+
+
+def compact_counts(k, codes, counts):
+    """JSON-friendly form of the counts"""
+    return {'k': k, 'codes': codes.tolist(), 'counts': counts.tolist()}
+
+
+def decode_kmers(codes, k):
+    """Returns the sequences of the k-mers of an array of codes"""
+    codes = numpy.asarray(codes, dtype=numpy.uint64)
+    shifts = numpy.arange(2 * (k - 1), -1, -2, dtype=numpy.uint64)
+    letters = numpy.frombuffer(b'ACGT', dtype=numpy.uint8)[(codes[:, None] >> shifts) & numpy.uint64(3)]
+    flat = letters.tobytes().decode('ascii')
+    return [flat[i:i + k] for i in range(0, len(flat), k)]
+
+
+@unittest.skipUnless(numpy, 'numpy is not installed')
+class CountKmersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def count_like_perl(self, records, k):
+        counts = {}
+        for seq in records:
+            seq = seq.upper()
+            for i in range(len(seq) - k + 1):
+                kmer = seq[i:i + k]
+                if set(kmer) <= set('ACGT'):
+                    counts[kmer] = counts.get(kmer, 0) + 1
+        return counts
+
+    def test_fasta_encoder(self):
+        fasta = b'>s1 ACGT\nACGT\nAC\n>s2\nGG\n'
+        for block_size in [1, 3, 7, 100]:
+            encoder = FastaEncoder()
+            bases = numpy.concatenate([encoder.encode(fasta[i:i + block_size]) for i in range(0, len(fasta), block_size)])
+            self.assertEqual(''.join('ACGT-'[b] for b in bases), '--------ACGTAC---GG', block_size)
+
+    def test_count(self):
+        records = ['ACGTACGTNNACGTtgca', 'GATTACA' * 20, 'AC']
+        path = os.path.join(self.dir, 'seq.fa.gz')
+        with gzip.open(path, 'wt') as fh:
+            for (i, seq) in enumerate(records):
+                fh.write('>seq{0}\n'.format(i))
+                for j in range(0, len(seq), 7):
+                    fh.write(seq[j:j + 7] + '\n')
+        for k in [1, 3, 12, 32]:
+            expected = self.count_like_perl(records, k)
+            for block_size in [5, 1 << 20]:
+                events = []
+                eHive.testRunnable(self, CountKmers, {'sequence_file': path, 'k': k, 'block_size': block_size}, [CallbackEvents(events.append)])
+                compact = events[0].output_ids['counts']
+                self.assertEqual(compact['codes'], sorted(compact['codes']))
+                self.assertEqual(dict(zip(decode_kmers(compact['codes'], k), compact['counts'])), expected, (k, block_size))
+
+    def test_merge_counts(self):
+        (codes, counts) = merge_counts([[5, 1], [1, 7], []], [[2, 3], [4, 1], []])
+        self.assertEqual((codes.tolist(), counts.tolist()), ([1, 5, 7], [7, 2, 1]))
@@ -18,13 +18,19 @@ import eHive
 
 import time
 
+from .digits import check_implementation, numpy_add_together
+
 class AddTogether(eHive.BaseRunnable):
     """Runnable that adds up all the partial-multiplications from PartMultiply"""
 
+    # The result only depends on the parameters
+    memoizable = True
+
     def param_defaults(self):
         return {
             'take_time' : 0,
-            'partial_product' : {}
+            'partial_product' : {},
+            'implementation' : 'python',
         }
 
 
@@ -40,7 +46,10 @@ class AddTogether(eHive.BaseRunnable):
     def run(self):
         b_multiplier = self.param_required('b_multiplier')
         partial_product = self.param('partial_product')
-        self.param('result', add_together(b_multiplier, partial_product))
+        if check_implementation(self.param('implementation')) == 'numpy':
+            self.param('result', numpy_add_together(b_multiplier, partial_product))
+        else:
+            self.param('result', add_together(b_multiplier, partial_product))
         time.sleep( self.param('take_time') )
 
     def write_output(self):
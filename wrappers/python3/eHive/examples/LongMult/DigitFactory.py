@@ -21,6 +21,9 @@ import time
 class DigitFactory(eHive.BaseRunnable):
     """Factory that creates 1 job per digit found in the decimal representation of 'b_multiplier'"""
 
+    # The result only depends on the parameters
+    memoizable = True
+
     def param_defaults(self):
         return {
             'take_time' : 0
@@ -18,19 +18,28 @@ import eHive
 
 import time
 
+from .digits import check_implementation, numpy_multiply
+
 class PartMultiply(eHive.BaseRunnable):
     """Runnable to multiply a number by a digit"""
 
+    # The result only depends on the parameters
+    memoizable = True
+
     def param_defaults(self):
         return {
-            'take_time' : 0
+            'take_time' : 0,
+            'implementation' : 'python',
         }
 
 
     def run(self):
         a_multiplier = self.param_required('a_multiplier')
         digit = int(self.param_required('digit'))
-        self.param('partial_product', rec_multiply(str(a_multiplier), digit, 0))
+        if check_implementation(self.param('implementation')) == 'numpy':
+            self.param('partial_product', numpy_multiply(a_multiplier, digit))
+        else:
+            self.param('partial_product', rec_multiply(str(a_multiplier), digit, 0))
         time.sleep( self.param('take_time') )
 
 
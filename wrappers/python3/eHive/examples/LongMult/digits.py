@@ -0,0 +1,158 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+NumPy implementations of the digit arithmetic of the LongMult example.
+
+Numbers are arrays of digits, least significant first. They give the same
+results as rec_multiply() and add_together(), which remain the reference
+implementations, but run in a few vectorised passes instead of one Python
+operation per digit.
+"""
+
+import random
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Below this number of digits, numpy.convolve() is faster than the FFTs
+FFT_MIN_DIGITS = 500
+
+# Values of the "implementation" parameter of PartMultiply and AddTogether
+IMPLEMENTATIONS = ['python', 'numpy']
+
+
+def check_implementation(implementation):
+    """Returns the "implementation" parameter after checking it is known
+    and can be used"""
+    if implementation not in IMPLEMENTATIONS:
+        raise ValueError("Unknown implementation '{0}'. Should be one of: {1}".format(implementation, ', '.join(IMPLEMENTATIONS)))
+    if implementation == 'numpy' and numpy is None:
+        raise ImportError("The 'numpy' implementation requires numpy")
+    return implementation
+
+
+def to_digits(number):
+    """Array of the digits of a decimal string, least significant first"""
+    raw = numpy.frombuffer(str(number).encode('ascii'), dtype=numpy.uint8)
+    digits = raw.astype(numpy.int64) - ord('0')
+    if ((digits < 0) | (digits > 9)).any():
+        raise ValueError("invalid literal for int() with base 10: '{0}'".format(number))
+    return digits[::-1]
+
+
+def from_digits(digits):
+    """Decimal string of an array of digits, least significant first"""
+    return (digits[::-1].astype(numpy.uint8) + ord('0')).tobytes().decode('ascii')
+
+
+def propagate_carries(columns):
+    """Turns an array of column sums (least significant first) into
+    digits. The last column must be large enough to receive the final
+    carry"""
+    columns = numpy.array(columns, dtype=numpy.int64)
+    # Bring all the columns down to 18 or less, so that carries are 0 or 1
+    while len(columns) and columns.max() > 18:
+        carries = columns[:-1] // 10
+        columns %= 10
+        columns[1:] += carries
+    # Then resolve the chains of carries at once: a column receives a
+    # carry if the nearest column below it that is not a 9 is >= 10
+    positions = numpy.arange(len(columns))
+    not_nine = columns != 9
+    last_not_nine = numpy.maximum.accumulate(numpy.where(not_nine, positions, -1))
+    carry_in = numpy.zeros(len(columns), dtype=numpy.int64)
+    below = last_not_nine[:-1]
+    carry_in[1:] = (below >= 0) & (columns[numpy.maximum(below, 0)] >= 10)
+    return (columns + carry_in) % 10
+
+
+def numpy_multiply(a_multiplier, digit):
+    """Same as rec_multiply(a_multiplier, digit, 0)"""
+    a_multiplier = str(a_multiplier)
+    if a_multiplier == '':
+        return ''
+    columns = numpy.append(to_digits(a_multiplier) * digit, 0)
+    digits = propagate_carries(columns)
+    if not digits[-1]:
+        digits = digits[:-1]
+    return from_digits(digits)
+
+
+def numpy_add_together(b_multiplier, partial_product):
+    """Same as add_together(b_multiplier, partial_product). For every
+    distinct digit of b_multiplier, its partial product is convolved with
+    the positions of the digit. Large numbers are convolved through FFTs,
+    all the digits at once"""
+    b_multiplier = str(b_multiplier)
+    b_digits = to_digits(b_multiplier)
+    columns = numpy.zeros(1 + len(b_multiplier) + len(str(partial_product['1'])), dtype=numpy.int64)
+    terms = [((b_digits == int(b_digit)).astype(numpy.int64), to_digits(partial_product[b_digit])) for b_digit in set(b_multiplier)]
+    if min(len(b_multiplier), len(columns) - len(b_multiplier)) < FFT_MIN_DIGITS:
+        for (positions, product) in terms:
+            shifted = numpy.convolve(positions, product)
+            columns[:len(shifted)] += shifted
+    elif terms:
+        length = max(len(positions) + len(product) - 1 for (positions, product) in terms)
+        fft_size = 1 << (length - 1).bit_length()
+        spectrum = sum(numpy.fft.rfft(positions, fft_size) * numpy.fft.rfft(product, fft_size) for (positions, product) in terms)
+        # The column sums are integers much smaller than 2^52, so rounding is exact
+        columns[:length] += numpy.rint(numpy.fft.irfft(spectrum, fft_size)[:length]).astype(numpy.int64)
+    return from_digits(propagate_carries(columns)).lstrip('0')
+
+
+class ImplementationTestCase(unittest.TestCase):
+
+    def test_check_implementation(self):
+        import eHive
+        from .PartMultiply import PartMultiply
+        self.assertEqual(check_implementation('python'), 'python')
+        eHive.testRunnable(self, PartMultiply, {'a_multiplier': 12, 'digit': 3, 'implementation': 'fortran'}, [
+            eHive.FailureEvent(ValueError, ("Unknown implementation 'fortran'. Should be one of: python, numpy",)),
+        ])
+        global numpy
+        (saved_numpy, numpy) = (numpy, None)
+        try:
+            self.assertRaises(ImportError, check_implementation, 'numpy')
+        finally:
+            numpy = saved_numpy
+
+
+@unittest.skipUnless(numpy, 'numpy is not installed')
+class DigitsTestCase(unittest.TestCase):
+
+    def test_propagate_carries(self):
+        self.assertEqual(from_digits(propagate_carries([10, 9, 9, 9, 0])), '10000')
+        self.assertEqual(from_digits(propagate_carries([123, 45, 0, 0])), '0573')
+        self.assertEqual(from_digits(propagate_carries([9, 9, 10, 0])), '1099')
+
+    def test_like_python(self):
+        from .AddTogether import add_together
+        from .PartMultiply import rec_multiply
+        rng = random.Random(1)
+        numbers = ['0', '7', '10', '0012', '999999', '123456789'] + [str(rng.randrange(10 ** 200)) for _ in range(5)] + ['9' * 900, str(rng.randrange(10 ** 800))]
+        for a in numbers:
+            for digit in range(10):
+                self.assertEqual(numpy_multiply(a, digit), rec_multiply(a, digit, 0), (a, digit))
+        for (a, b) in zip(numbers, reversed(numbers)):
+            partial_product = {str(d): rec_multiply(a, d, 0) for d in range(2, 10)}
+            partial_product.update({'0': '0', '1': a})
+            self.assertEqual(numpy_add_together(b, partial_product), add_together(b, partial_product), (a, b))
+            self.assertEqual(numpy_add_together(int(b), partial_product), add_together(int(b), partial_product), (a, b))
+        self.assertRaises(ValueError, numpy_multiply, '12a', 3)
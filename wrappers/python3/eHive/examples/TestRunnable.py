@@ -96,3 +96,82 @@ class TestRunnableTestCase(unittest.TestCase):
                 eHive.CompleteEarlyEvent('Nothing to do'),
             ],
         )
+
+    def test_performance_budgets(self):
+        events = [
+            eHive.WarningEvent('Fetch the world !', is_error=False),
+            eHive.WarningEvent('Run the world !', is_error=False),
+            eHive.WarningEvent('Write to the world !', is_error=False),
+            eHive.DataflowEvent({'gamma': 115}, branch_name_or_code=2),
+        ]
+        statistics = eHive.testRunnable(self, TestRunnable, {}, events, {
+            'max_wall_seconds': {'total': 60, 'run': 30},
+            'max_cpu_seconds': 60,
+            'max_peak_rss_delta_mb': 10000,
+            'max_tracemalloc_peak_mb': 10000,
+            'trace_malloc': True,
+            'max_events': {'write_output': 2},
+            'repeat': 3,
+            'warm_up': 1,
+        })
+        self.assertEqual(list(statistics.keys()), ['fetch_input', 'run', 'write_output', 'total'])
+        self.assertEqual(statistics['run']['wall_seconds']['n'], 3)
+        self.assertEqual(statistics['total']['events']['max'], 4)
+        with self.assertRaisesRegex(AssertionError, 'events of "total" is over budget'):
+            eHive.testRunnable(self, TestRunnable, {}, events, {'max_events': 3})
+        with self.assertRaisesRegex(AssertionError, 'this step has not run'):
+            eHive.testRunnable(self, TestRunnable, {}, events, {'max_wall_seconds': {'pre_cleanup': 1}})
+        with self.assertRaisesRegex(AssertionError, 'tracemalloc_peak_mb, which has not been measured'):
+            eHive.testRunnable(self, TestRunnable, {}, events, {'max_tracemalloc_peak_mb': 1})
+
+    def test_large_fan_out(self):
+        class FanOut(eHive.BaseRunnable):
+            def run(self):
+                n = self.param('n')
+                # Branch 2 in reverse order, interleaved with branch 3
+                for i in range(n):
+                    self.dataflow({'i': n - 1 - i}, 2)
+                    self.dataflow({'j': i}, 3)
+                self.warning('done')
+
+        n = 20000
+        # Exact order, given as a generator
+        def exact_events():
+            for i in range(n):
+                yield eHive.DataflowEvent({'i': n - 1 - i}, 2)
+                yield eHive.DataflowEvent({'j': i}, 3)
+            yield eHive.WarningEvent('done', False)
+        eHive.testRunnable(self, FanOut, {'n': n}, exact_events())
+
+        # Order not known
+        events = [eHive.DataflowEvent({'i': i}, 2) for i in range(n)] + [eHive.DataflowEvent({'j': i}, 3) for i in range(n)]
+        eHive.testRunnable(self, FanOut, {'n': n}, [eHive.UnorderedEvents(events), eHive.WarningEvent('done', False)])
+
+        # Counts, predicates and samples
+        eHive.testRunnable(self, FanOut, {'n': n}, [
+            eHive.CountEvents(2 * n, predicate=lambda e: e.branch_name_or_code in (2, 3)),
+            eHive.CountEvents(0, eHive.FailureEvent),
+            eHive.WarningEvent('done', False),
+        ])
+        eHive.testRunnable(self, FanOut, {'n': 3}, [
+            eHive.CountEvents(6, expected=lambda i: eHive.DataflowEvent({'i': 2 - i // 2}, 2), sample_every=2),
+            eHive.CountEvents(1, eHive.WarningEvent),
+        ])
+
+        # One matcher per branch
+        eHive.testRunnable(self, FanOut, {'n': n}, [
+            eHive.InterleavedEvents(
+                eHive.OrderedEvents(lambda: (eHive.DataflowEvent({'i': n - 1 - i}, 2) for i in range(n)), branch_name_or_code=2),
+                eHive.CountEvents(n, branch_name_or_code=3),
+            ),
+            eHive.WarningEvent('done', False),
+        ])
+
+        with self.assertRaisesRegex(AssertionError, 'Only 2 DataflowEvent on branch 2 have been emitted out of 3'):
+            eHive.testRunnable(self, FanOut, {'n': 2}, [eHive.InterleavedEvents(eHive.CountEvents(3, branch_name_or_code=2), eHive.CountEvents(2, branch_name_or_code=3))])
+        with self.assertRaisesRegex(AssertionError, 'Event #1 of the sequence'):
+            eHive.testRunnable(self, FanOut, {'n': 2}, [eHive.OrderedEvents([eHive.DataflowEvent({'i': 1}, 2), eHive.DataflowEvent({'j': 1}, 3)])])
+        with self.assertRaisesRegex(AssertionError, '1 unordered events have not been emitted'):
+            eHive.testRunnable(self, FanOut, {'n': 1}, [eHive.UnorderedEvents([eHive.DataflowEvent({'j': 5}, 3), eHive.DataflowEvent({'i': 0}, 2)])])
+        with self.assertRaisesRegex(AssertionError, '2 events have not been emitted'):
+            eHive.testRunnable(self, FanOut, {'n': 0}, [eHive.WarningEvent('done', False), eHive.CountEvents(0), eHive.CountEvents(1), eHive.WarningEvent('done', False)])
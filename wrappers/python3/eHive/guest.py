@@ -0,0 +1,190 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Python stand-in for the Perl GuestProcess.
+
+It speaks the same JSON protocol as GuestProcess, over real pipes, and
+can therefore run BaseRunnable subclasses without Perl, a database or a
+worker. It is used to replay recorded sessions and to benchmark the
+wrapper itself.
+"""
+
+import collections
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from . import process
+
+
+def make_job_config(parameters, dbID=1, retry_count=0, input_id=None, execute_writes=True, debug=0, analysis_name=None, hive_pipeline_url=None):
+    """Returns the message GuestProcess sends to start a job"""
+    return {
+        'input_job': {
+            'parameters': parameters,
+            'input_id': input_id if input_id is not None else json.dumps(parameters),
+            'dbID': dbID,
+            'retry_count': retry_count,
+        },
+        'execute_writes': 1 if execute_writes else 0,
+        'debug': debug,
+        'worker_log_dir': None,
+        'analysis_name': analysis_name,
+        'hive_pipeline_url': hive_pipeline_url,
+    }
+
+
+class GuestProcessStandInException(Exception):
+    """Raised when the Runnable does not follow the protocol"""
+    pass
+
+
+class GuestProcessStandIn:
+    """Serves a sequence of jobs to a Runnable and answers its events.
+    The Runnable runs in the calling thread, the stand-in in another one."""
+
+    def __init__(self, jobs, keep_events=True):
+        """jobs is an iterable of job configurations (see make_job_config)"""
+        self.jobs = jobs
+        self.keep_events = keep_events
+        self.param_defaults = None
+        # One list of (event, content) per job, and the content of the JOB_END events
+        self.job_events = []
+        self.job_results = []
+        self.event_counts = collections.Counter()
+        self.error = None
+        self.temp_dir = None
+        self.dbID_counter = itertools.count(1)
+        # Branches that have dataflow rules. None means all of them
+        self.connected_branches = None
+
+    def run(self, runnable_class, debug=0):
+        """Runs the Runnable until all the jobs have been processed"""
+        (p2c_read, p2c_write) = os.pipe()
+        (c2p_read, c2p_write) = os.pipe()
+        thread = threading.Thread(target=self.serve, args=(c2p_read, p2c_write), daemon=True)
+        thread.start()
+        try:
+            # The Runnable closes its end of the pipes when it returns
+            runnable_class(p2c_read, c2p_write, debug)
+        finally:
+            thread.join()
+            if self.temp_dir is not None:
+                shutil.rmtree(self.temp_dir, ignore_errors=True)
+        if self.error is not None:
+            raise self.error
+
+    def serve(self, read_fileno, write_fileno):
+        """Body of the stand-in thread"""
+        with os.fdopen(read_fileno, mode='rb') as read_pipe, os.fdopen(write_fileno, mode='wb', buffering=0) as write_pipe:
+            self.read_pipe = read_pipe
+            self.write_pipe = write_pipe
+            try:
+                self.handshake()
+                for config in self.jobs:
+                    self.serve_job(config)
+                self.send({})
+            except Exception as e:
+                self.error = e
+
+    def send(self, message):
+        self.write_pipe.write(bytes(json.dumps(message) + "\n", 'utf-8'))
+
+    def read(self):
+        l = self.read_pipe.readline()
+        if not l:
+            raise GuestProcessStandInException("The Runnable has closed the pipe")
+        return json.loads(l.decode())
+
+    def send_response(self, response):
+        self.send({'response': response})
+
+    def handshake(self):
+        msg = self.read()
+        if msg.get('event') != 'VERSION' or msg['content'] != process.__version__:
+            raise GuestProcessStandInException("Unexpected version message: {0}".format(msg))
+        self.send_response('OK')
+        msg = self.read()
+        if msg.get('event') != 'PARAM_DEFAULTS':
+            raise GuestProcessStandInException("Expected PARAM_DEFAULTS, got {0}".format(msg))
+        self.param_defaults = msg['content']
+        self.send_response('OK')
+
+    def serve_job(self, config):
+        """Sends the job and answers all the events until JOB_END"""
+        if self.param_defaults:
+            # Like GuestProcess, the defaults of the Runnable have the lowest priority
+            parameters = dict(self.param_defaults)
+            parameters.update(config['input_job']['parameters'])
+            config = dict(config, input_job=dict(config['input_job'], parameters=parameters))
+        self.send(config)
+        if self.read().get('response') != 'OK':
+            raise GuestProcessStandInException("The Runnable did not accept the job")
+        events = []
+        while True:
+            msg = self.read()
+            (event, content) = (msg['event'], msg['content'])
+            self.event_counts[event] += 1
+            if self.keep_events:
+                events.append((event, content))
+            self.send_response(self.respond(event, content))
+            if event == 'JOB_END':
+                self.job_results.append(content)
+                if self.keep_events:
+                    self.job_events.append(events)
+                return
+
+    def respond(self, event, content):
+        """Returns the response to an event, like GuestProcess would"""
+        if event in ('JOB_STATUS_UPDATE', 'WARNING', 'JOB_END'):
+            return 'OK'
+        if event == 'DATAFLOW':
+            output_ids = content['output_ids']
+            n = len(output_ids) if isinstance(output_ids, list) else 1
+            return [next(self.dbID_counter) for _ in range(n)]
+        if event == 'BRANCH_CONNECTED':
+            return 1 if self.connected_branches is None or content['branch_name_or_code'] in self.connected_branches else 0
+        if event == 'WORKER_TEMP_DIRECTORY':
+            if self.temp_dir is None:
+                self.temp_dir = tempfile.mkdtemp(prefix='ehive_standin_')
+            return self.temp_dir
+        raise GuestProcessStandInException("Unknown event '{0}' coming from the child".format(event))
+
+
+class GuestProcessStandInTestCase(unittest.TestCase):
+
+    def test_jobs(self):
+        from .examples.LongMult.DigitFactory import DigitFactory
+        standin = GuestProcessStandIn([
+            make_job_config({'b_multiplier': 9650, 'take_time': 0}, dbID=1),
+            make_job_config({'b_multiplier': 10, 'take_time': 0}, dbID=2, execute_writes=False),
+            make_job_config({'take_time': 0}, dbID=3),
+        ])
+        standin.run(DigitFactory)
+        self.assertEqual(standin.param_defaults, {'take_time': 0})
+        self.assertEqual([r['complete'] for r in standin.job_results], [True, True, False])
+        events = [[e for (e, _) in job] for job in standin.job_events]
+        self.assertEqual(events[0], ['JOB_STATUS_UPDATE', 'JOB_STATUS_UPDATE', 'JOB_STATUS_UPDATE', 'DATAFLOW', 'WARNING', 'JOB_END'])
+        self.assertEqual(events[1], ['JOB_STATUS_UPDATE', 'JOB_STATUS_UPDATE', 'JOB_END'])
+        self.assertEqual(events[2], ['JOB_STATUS_UPDATE', 'WARNING', 'JOB_END'])
+        dataflow = standin.job_events[0][3][1]
+        self.assertEqual(dataflow['branch_name_or_code'], 2)
+        self.assertEqual(sorted(d['digit'] for d in dataflow['output_ids']), ['5', '6', '9'])
+        self.assertEqual(standin.event_counts['JOB_END'], 3)
@@ -0,0 +1,261 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Content-addressed memoization of job results.
+
+A job is identified by a digest of its Runnable (name and version) and of
+its canonicalised substituted parameters. When a job with the same digest
+has already succeeded, BaseRunnable replays the recorded events (warnings
+and dataflows) and final parameters instead of running the job again.
+
+The store is a directory (possibly shared between hosts) with one JSON
+file per digest, written atomically. It is only used when the environment
+variable EHIVE_PYTHON_MEMO_DIR is set. EHIVE_PYTHON_MEMO_MAX_AGE (in
+seconds) is the time after which a record is too old to be used, counted
+from its creation. EHIVE_PYTHON_MEMO_MAX_ENTRIES is the number of records
+kept, the least recently used ones being evicted first. The modification
+time of the files is their creation time and their access time the last
+time they were used.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from . import params
+
+
+@functools.lru_cache(maxsize=None)
+def runnable_version(runnable_class):
+    """Returns a string identifying the version of the Runnable: its
+    module's __version__ if defined, otherwise a digest of its source file"""
+    module = sys.modules.get(runnable_class.__module__)
+    version = getattr(module, '__version__', None)
+    if version is not None:
+        return str(version)
+    try:
+        with open(inspect.getsourcefile(runnable_class), 'rb') as fh:
+            return hashlib.sha1(fh.read()).hexdigest()
+    except (TypeError, OSError):
+        return 'unknown'
+
+
+def canonical_params(container):
+    """Substitutes all the parameters of the ParamContainer and returns a
+    dictionary that can be serialised in a canonical way. The substituted
+    values stay in the container, so that the job sees the same values
+    (e.g. of #expr()#) as the digest. Parameters that fail the substitution
+    are represented by their unsubstituted value"""
+    canonical = {}
+    for name in container.unsubstituted_param_hash:
+        try:
+            canonical[name] = ['s', container.get_param(name)]
+        except Exception:
+            canonical[name] = ['u', container.unsubstituted_param_hash[name]]
+    return canonical
+
+
+def job_digest(runnable_class, container):
+    """Returns the hexadecimal digest that identifies a job, given its
+    ParamContainer"""
+    key = {
+        'runnable': runnable_class.__module__ + '.' + runnable_class.__qualname__,
+        'version': runnable_version(runnable_class),
+        'params': canonical_params(container),
+    }
+    j = json.dumps(key, sort_keys=True, separators=(',', ':'), default=repr)
+    return hashlib.sha256(j.encode('utf-8')).hexdigest()
+
+
+class MemoStore:
+    """Directory of job results, indexed by Runnable name and digest"""
+
+    def __init__(self, path, max_entries=None, max_age=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+    @classmethod
+    def from_environment(cls):
+        """Returns a MemoStore configured from the environment, or None if
+        memoization has not been enabled"""
+        path = os.environ.get('EHIVE_PYTHON_MEMO_DIR')
+        if not path:
+            return None
+        max_entries = os.environ.get('EHIVE_PYTHON_MEMO_MAX_ENTRIES')
+        max_age = os.environ.get('EHIVE_PYTHON_MEMO_MAX_AGE')
+        return cls(path,
+                   int(max_entries) if max_entries else None,
+                   float(max_age) if max_age else None)
+
+    def __entry_path(self, runnable_name, digest):
+        return os.path.join(self.path, runnable_name, digest[:2], digest + '.json')
+
+    def lookup(self, runnable_name, digest):
+        """Returns the record stored under this digest (or None). Expired
+        records are ignored and the others are marked as recently used"""
+        entry_path = self.__entry_path(runnable_name, digest)
+        try:
+            with open(entry_path, 'r') as fh:
+                record = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        now = time.time()
+        if self.max_age is not None and now - record.get('created', 0) > self.max_age:
+            return None
+        try:
+            # Keep the creation time
+            os.utime(entry_path, (now, os.stat(entry_path).st_mtime))
+        except OSError:
+            pass
+        return record
+
+    def store(self, runnable_name, digest, record):
+        """Atomically writes the record, then applies the eviction policy"""
+        record = dict(record, created=time.time())
+        entry_path = self.__entry_path(runnable_name, digest)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(entry_path), prefix='.tmp.')
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(record, fh)
+            os.replace(tmp_path, entry_path)
+        except:
+            os.unlink(tmp_path)
+            raise
+        if self.max_entries is not None or self.max_age is not None:
+            self.evict()
+
+    def entries(self):
+        """Iterates over the (path, creation time, last-used time) of all the stored records"""
+        for (dirpath, _, filenames) in os.walk(self.path):
+            for f in filenames:
+                if f.endswith('.json') and not f.startswith('.'):
+                    entry_path = os.path.join(dirpath, f)
+                    try:
+                        st = os.stat(entry_path)
+                        yield (entry_path, st.st_mtime, st.st_atime)
+                    except OSError:
+                        # Removed by another process
+                        pass
+
+    def evict(self, max_entries=None, max_age=None):
+        """Removes the records created more than max_age seconds ago, and
+        then the least recently used ones so that at most max_entries remain.
+        Returns the number of records removed"""
+        max_entries = self.max_entries if max_entries is None else max_entries
+        max_age = self.max_age if max_age is None else max_age
+        entries = sorted(self.entries(), key=lambda e: e[2], reverse=True)
+        to_remove = []
+        if max_age is not None:
+            limit = time.time() - max_age
+            to_remove.extend(e for e in entries if e[1] < limit)
+            entries = [e for e in entries if e[1] >= limit]
+        if max_entries is not None:
+            to_remove.extend(entries[max_entries:])
+        n = 0
+        for (entry_path, _, _) in to_remove:
+            try:
+                os.unlink(entry_path)
+                n += 1
+            except OSError:
+                pass
+        return n
+
+    def invalidate(self, runnable_name=None):
+        """Removes all the records of a Runnable, or the whole store if
+        runnable_name is None"""
+        if runnable_name is not None:
+            shutil.rmtree(os.path.join(self.path, runnable_name), ignore_errors=True)
+        elif os.path.isdir(self.path):
+            # Keep the top directory, which may be a mount-point
+            for name in os.listdir(self.path):
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+class MemoStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = MemoStore(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_digest(self):
+        from .process import BaseRunnable
+        def digest(unsubstituted_params):
+            return job_digest(BaseRunnable, params.ParamContainer(unsubstituted_params))
+        d1 = digest({'a': 1, 'b': '#a#', 'c': '#missing#'})
+        d2 = digest({'c': '#missing#', 'b': '#a#', 'a': 1})
+        d3 = digest({'a': 1, 'b': 1, 'c': '#missing#'})
+        self.assertEqual(d1, d2, 'Digests do not depend on the order of the parameters')
+        self.assertEqual(d1, d3, 'Digests are computed on substituted parameters')
+        self.assertNotEqual(d1, digest({'a': 2, 'b': '#a#', 'c': '#missing#'}))
+        # The values the digest is computed on are the ones the job sees
+        container = params.ParamContainer({'a': 1, 'b': '#expr(#a# + 1)expr#'})
+        job_digest(BaseRunnable, container)
+        self.assertEqual(container.param_hash, {'a': 1, 'b': 2})
+
+    def test_store_and_lookup(self):
+        self.assertIsNone(self.store.lookup('R', 'abcdef'))
+        self.store.store('R', 'abcdef', {'events': [1, 2]})
+        self.assertEqual(self.store.lookup('R', 'abcdef')['events'], [1, 2])
+        self.assertIsNone(self.store.lookup('S', 'abcdef'))
+
+    def test_eviction(self):
+        now = time.time()
+        for i in range(5):
+            self.store.store('R', 'digest%d' % i, {})
+            # Make digest0 the least recently used one, and digest2 and digest3 old ones
+            os.utime(self.store._MemoStore__entry_path('R', 'digest%d' % i), (now-100+i, now-7200 if i in (2, 3) else now))
+        self.assertEqual(self.store.evict(max_entries=4), 1)
+        self.assertIsNone(self.store.lookup('R', 'digest0'))
+        # This marks digest3 as recently used, but it is still old
+        self.assertIsNotNone(self.store.lookup('R', 'digest3'))
+        self.assertEqual(self.store.evict(max_age=3600), 2)
+        self.assertEqual(sorted(os.path.basename(e[0]) for e in self.store.entries()), ['digest1.json', 'digest4.json'])
+
+    def test_max_age(self):
+        store = MemoStore(self.dir, max_age=3600)
+        store.store('R', 'abcdef', {})
+        self.assertIsNotNone(store.lookup('R', 'abcdef'))
+        # Using a record does not make it younger
+        entry_path = store._MemoStore__entry_path('R', 'abcdef')
+        with open(entry_path, 'r') as fh:
+            record = json.load(fh)
+        record['created'] -= 7200
+        with open(entry_path, 'w') as fh:
+            json.dump(record, fh)
+        os.utime(entry_path, (time.time(), record['created']))
+        self.assertIsNone(store.lookup('R', 'abcdef'))
+        self.assertEqual(store.evict(), 1)
+
+    def test_invalidation(self):
+        self.store.store('R', 'abcdef', {})
+        self.store.store('S', 'abcdef', {})
+        self.store.invalidate('R')
+        self.assertIsNone(self.store.lookup('R', 'abcdef'))
+        self.assertIsNotNone(self.store.lookup('S', 'abcdef'))
+        self.store.invalidate()
+        self.assertIsNone(self.store.lookup('S', 'abcdef'))
@@ -0,0 +1,289 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process metrics of the Python wrapper, in the Prometheus / OpenMetrics
+text format.
+
+Metrics are collected when the environment variable
+EHIVE_PYTHON_METRICS_DIR is set, and exported atomically to a file in that
+directory that node_exporter's textfile collector can scrape. Files are
+rewritten at most every EHIVE_PYTHON_METRICS_INTERVAL seconds (default 15)
+and removed when the worker exits. EHIVE_PYTHON_METRICS_PORT additionally
+serves the metrics over HTTP on localhost, on the first free port from
+that number upwards, so that several workers can run on the same host.
+"""
+
+import bisect
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+
+# Buckets (in seconds) of the histograms
+STEP_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 3600)
+ROUNDTRIP_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+
+# Number of ports tried from EHIVE_PYTHON_METRICS_PORT upwards
+HTTP_PORT_RANGE = 32
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(n, escape_label_value(v)) for (n, v) in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, with optional labels"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        # Replaced by the lock of the registry (see Registry.register)
+        self.lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for (label_values, value) in sorted(self.values.items()):
+            yield (self.name + '_total', format_labels(self.label_names, label_values), value)
+
+
+class Histogram:
+    """Histogram of observations, with optional labels"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=STEP_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label_values -> [bucket counts (non cumulative) + overflow, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_values=()):
+        with self.lock:
+            h = self.values.get(label_values)
+            if h is None:
+                h = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.]
+            h[0][bisect.bisect_left(self.buckets, value)] += 1
+            h[1] += value
+
+    def samples(self):
+        for (label_values, (counts, total)) in sorted(self.values.items()):
+            cumulative = 0
+            for (bound, n) in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield (self.name + '_bucket', format_labels(self.label_names, label_values, [('le', format_value(float(bound)))]), cumulative)
+            yield (self.name + '_sum', format_labels(self.label_names, label_values), total)
+            yield (self.name + '_count', format_labels(self.label_names, label_values), cumulative)
+
+
+class Registry:
+    """Collection of metrics that can be rendered in the text format. The
+    metrics share the lock of the registry, so that they can be rendered
+    from another thread (see serve_http) while they are being updated"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        metric.lock = self.lock
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append('# HELP {0} {1}'.format(metric.name, metric.documentation))
+                lines.append('# TYPE {0} {1}'.format(metric.name, metric.type_name))
+                for (name, labels, value) in metric.samples():
+                    lines.append('{0}{1} {2}'.format(name, labels, format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+class WrapperMetrics:
+    """The metrics collected by BaseRunnable"""
+
+    def __init__(self):
+        self.registry = Registry()
+        r = self.registry
+        self.jobs = r.register(Counter('ehive_python_jobs', 'Number of jobs run, per analysis and final status', ['analysis', 'status']))
+        self.step_duration = r.register(Histogram('ehive_python_step_duration_seconds', 'Duration of the life-cycle steps', ['analysis', 'step'], STEP_BUCKETS))
+        self.roundtrip = r.register(Histogram('ehive_python_message_roundtrip_seconds', 'Time between sending an event to GuestProcess and receiving its response', ['event'], ROUNDTRIP_BUCKETS))
+        self.bytes_sent = r.register(Counter('ehive_python_sent_bytes', 'Number of bytes sent to GuestProcess'))
+        self.bytes_received = r.register(Counter('ehive_python_received_bytes', 'Number of bytes received from GuestProcess'))
+        self.dataflow_rows = r.register(Counter('ehive_python_dataflow_rows', 'Number of output_ids dataflown, per analysis and branch', ['analysis', 'branch']))
+
+
+class TextfileExporter:
+    """Periodically writes the metrics to a file, atomically"""
+
+    def __init__(self, registry, directory, interval=15):
+        self.registry = registry
+        self.interval = interval
+        self.path = os.path.join(directory, 'ehive_python_{0}_{1}.prom'.format(socket.gethostname(), os.getpid()))
+        self.last_export = None
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, force=False):
+        """Writes the file unless it has been written recently"""
+        now = time.monotonic()
+        if not force and self.last_export is not None and now - self.last_export < self.interval:
+            return
+        self.last_export = now
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.tmp.')
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(self.registry.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def serve_http(registry, port, port_range=HTTP_PORT_RANGE):
+    """Serves the metrics on http://localhost:port/metrics in a daemon
+    thread, using the next ports if port is taken. Returns the server, or
+    None if no port was free"""
+    import http.server
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+    for p in range(port, port + port_range):
+        try:
+            server = http.server.HTTPServer(('127.0.0.1', p), MetricsHandler)
+            break
+        except OSError:
+            continue
+    else:
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def from_environment():
+    """Returns (WrapperMetrics, TextfileExporter) configured from the
+    environment, or (None, None) if the metrics are disabled"""
+    directory = os.environ.get('EHIVE_PYTHON_METRICS_DIR')
+    port = os.environ.get('EHIVE_PYTHON_METRICS_PORT')
+    if not directory and not port:
+        return (None, None)
+    metrics = WrapperMetrics()
+    exporter = None
+    if directory:
+        exporter = TextfileExporter(metrics.registry, directory, float(os.environ.get('EHIVE_PYTHON_METRICS_INTERVAL', 15)))
+    if port and serve_http(metrics.registry, int(port)) is None:
+        # The metrics are not worth killing the worker for
+        print("Cannot serve the metrics: ports {0} to {1} are all in use".format(int(port), int(port) + HTTP_PORT_RANGE - 1), file=sys.stderr)
+    return (metrics, exporter)
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_render(self):
+        registry = Registry()
+        c = registry.register(Counter('jobs', 'Number of jobs', ['analysis']))
+        h = registry.register(Histogram('duration_seconds', 'Duration', ['step'], (.1, 1)))
+        c.inc(('a"b',))
+        c.inc(('a"b',), 2)
+        h.observe(.05, ('run',))
+        h.observe(.5, ('run',))
+        h.observe(5, ('run',))
+        self.assertEqual(registry.render(), "\n".join([
+            '# HELP jobs Number of jobs',
+            '# TYPE jobs counter',
+            'jobs_total{analysis="a\\"b"} 3',
+            '# HELP duration_seconds Duration',
+            '# TYPE duration_seconds histogram',
+            'duration_seconds_bucket{step="run",le="0.1"} 1',
+            'duration_seconds_bucket{step="run",le="1.0"} 2',
+            'duration_seconds_bucket{step="run",le="+Inf"} 3',
+            'duration_seconds_sum{step="run"} 5.55',
+            'duration_seconds_count{step="run"} 3',
+        ]) + "\n")
+
+    def test_textfile(self):
+        d = tempfile.mkdtemp()
+        try:
+            metrics = WrapperMetrics()
+            exporter = TextfileExporter(metrics.registry, d, interval=3600)
+            metrics.bytes_sent.inc(amount=10)
+            exporter.export()
+            metrics.bytes_sent.inc(amount=10)
+            exporter.export()
+            with open(exporter.path, 'r') as fh:
+                self.assertIn('ehive_python_sent_bytes_total 10\n', fh.read(), 'Second export throttled')
+            exporter.export(force=True)
+            with open(exporter.path, 'r') as fh:
+                self.assertIn('ehive_python_sent_bytes_total 20\n', fh.read())
+            exporter.remove()
+            self.assertEqual(os.listdir(d), [])
+        finally:
+            os.rmdir(d)
+
+    def test_http(self):
+        import urllib.request
+        registry = Registry()
+        registry.register(Counter('jobs', 'Number of jobs')).inc()
+        first = serve_http(registry, 0)
+        port = first.server_address[1]
+        # The port is taken: the next one is used
+        second = serve_http(registry, port)
+        try:
+            self.assertNotEqual(second.server_address[1], port)
+            with urllib.request.urlopen('http://127.0.0.1:{0}/metrics'.format(second.server_address[1])) as response:
+                self.assertIn('jobs_total 1\n', response.read().decode('utf-8'))
+            self.assertIsNone(serve_http(registry, port, port_range=1))
+        finally:
+            for server in (first, second):
+                server.shutdown()
+                server.server_close()
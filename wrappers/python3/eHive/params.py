@@ -146,7 +146,7 @@ class ParamContainer:
             if structure[:6] == '#expr(' and structure[-6:] == ')expr#' and structure.count('#expr(', 6, -6) == 0 and structure.count(')expr#', 6, -6) == 0:
                 return self.subst_one_hashpair(structure[1:-1], True)
 
-            if structure[0] == '#' and structure[-1] == '#' and structure.count('#', 1, -1) == 0:
+            if structure[:1] == '#' and structure[-1:] == '#' and structure.count('#', 1, -1) == 0:
                 if len(structure) <= 2:
                     return structure
                 return self.subst_one_hashpair(structure[1:-1], False)
@@ -259,6 +259,7 @@ class ParamContainerTestSubstitutions(unittest.TestCase):
         TestParamEntry('beta', 5, 5),
         TestParamEntry('delta', '#expr( #alpha#*#beta# )expr#', 10),
         TestParamEntry('epsilon', 'alpha#beta', 'alpha#beta'),  # Single hash -> no substitution
+        TestParamEntry('empty', '', ''),
 
         TestParamEntry('gamma', [10, 20, 33, 15], [10, 20, 33, 15]),
         TestParamEntry('gamma_prime', '#expr( #gamma# )expr#', [10, 20, 33, 15]),
@@ -0,0 +1,104 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+CPU profiling of the steps of a job (fetch_input, run, write_output, etc).
+
+BaseRunnable profiles jobs when the debug level is 3 or more, or when the
+parameter "hive_profile" is set. The profiles are dumped in the pstats
+format (readable with the pstats module, snakeviz, gprof2dot, etc) and
+summarised in the log_message table.
+"""
+
+import collections
+import contextlib
+import cProfile
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+
+class StepProfiler:
+    """Collects one cProfile profile per step of a job"""
+
+    def __init__(self):
+        self.profiles = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def profile(self, step):
+        """Context manager that profiles the code run within it as "step" """
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield prof
+        finally:
+            prof.disable()
+            self.profiles[step] = prof
+
+    def stats(self, step=None):
+        """Returns a pstats.Stats object for a step, or all of them combined"""
+        profiles = [self.profiles[step]] if step else list(self.profiles.values())
+        stats = pstats.Stats(profiles[0])
+        for prof in profiles[1:]:
+            stats.add(prof)
+        return stats
+
+    def dump(self, path):
+        """Writes the combined profile of all the steps in the pstats format"""
+        if self.profiles:
+            self.stats().dump_stats(path)
+
+    def summary(self, top_n=10):
+        """Returns a text summary of the top_n functions with the highest
+        own time in each step"""
+        lines = []
+        for step in self.profiles:
+            stats = self.stats(step)
+            lines.append('{0}: {1:.3f}s'.format(step, stats.total_tt))
+            hot = sorted(stats.stats.items(), key=lambda kv: kv[1][2], reverse=True)[:top_n]
+            for ((filename, lineno, funcname), (_, ncalls, tottime, cumtime, _)) in hot:
+                lines.append('  {0:9.3f}s {1:9.3f}s {2:>8} {3}'.format(tottime, cumtime, ncalls, pstats.func_std_string((filename, lineno, funcname))))
+        return "\n".join(lines)
+
+
+class StepProfilerTestCase(unittest.TestCase):
+
+    @staticmethod
+    def busy_function():
+        return sum(i*i for i in range(20000))
+
+    def test_profiler(self):
+        profiler = StepProfiler()
+        with profiler.profile('fetch_input'):
+            pass
+        with self.assertRaises(ZeroDivisionError):
+            with profiler.profile('run'):
+                self.busy_function()
+                1/0
+        self.assertEqual(list(profiler.profiles.keys()), ['fetch_input', 'run'])
+        summary = profiler.summary(5)
+        self.assertTrue(summary.startswith('fetch_input: '))
+        self.assertIn('busy_function', summary)
+
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d, 'job.pstats')
+            profiler.dump(path)
+            stats = pstats.Stats(path)
+            self.assertTrue(any(k[2] == 'busy_function' for k in stats.stats))
+        finally:
+            shutil.rmtree(d)
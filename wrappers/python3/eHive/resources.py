@@ -0,0 +1,147 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measurement of the resources (CPU, memory, I/O) used by each step of a job.
+
+The measures come from getrusage() and /proc/self/io (when available), and
+optionally from tracemalloc. They are reported to GuestProcess in the
+JOB_END message under the "resource_usage" key.
+"""
+
+import collections
+import contextlib
+import resource
+import time
+import tracemalloc
+import unittest
+
+
+# Counters that are summed over the steps
+ADDITIVE_COUNTERS = ['wall_seconds', 'user_cpu_seconds', 'sys_cpu_seconds', 'children_user_cpu_seconds', 'children_sys_cpu_seconds',
+                     'major_faults', 'minor_faults', 'block_input_ops', 'block_output_ops', 'read_bytes', 'write_bytes', 'peak_rss_delta_kb']
+
+
+def read_proc_io():
+    """Returns the storage-layer I/O counters of the process, if the kernel exposes them"""
+    counters = {}
+    try:
+        with open('/proc/self/io', 'r') as fh:
+            for line in fh:
+                (key, _, value) = line.partition(':')
+                if key in ('read_bytes', 'write_bytes'):
+                    counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+
+def snapshot():
+    """Returns the current values of all the counters"""
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    ru_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    s = {
+        'wall_seconds': time.monotonic(),
+        'user_cpu_seconds': ru.ru_utime,
+        'sys_cpu_seconds': ru.ru_stime,
+        'children_user_cpu_seconds': ru_children.ru_utime,
+        'children_sys_cpu_seconds': ru_children.ru_stime,
+        'major_faults': ru.ru_majflt,
+        'minor_faults': ru.ru_minflt,
+        'block_input_ops': ru.ru_inblock,
+        'block_output_ops': ru.ru_oublock,
+        'peak_rss_kb': ru.ru_maxrss,    # kilobytes on Linux
+    }
+    s.update(read_proc_io())
+    return s
+
+
+class ResourceMeter:
+    """Accumulates the resource usage of the steps of a job"""
+
+    def __init__(self, trace_malloc=False):
+        self.trace_malloc = trace_malloc
+        self.steps = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def measure(self, step):
+        """Context manager that records the resources used within it as "step" """
+        started_tracemalloc = False
+        if self.trace_malloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracemalloc = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                # Python 3.9+
+                tracemalloc.reset_peak()
+        before = snapshot()
+        try:
+            yield
+        finally:
+            after = snapshot()
+            usage = {}
+            for (k, v) in after.items():
+                if k == 'peak_rss_kb':
+                    usage[k] = v
+                    usage['peak_rss_delta_kb'] = v - before[k]
+                elif k in before:
+                    usage[k] = round(v - before[k], 6) if isinstance(v, float) else v - before[k]
+            if self.trace_malloc:
+                usage['tracemalloc_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+                if started_tracemalloc:
+                    tracemalloc.stop()
+            self.steps[step] = usage
+
+    def total(self):
+        """Returns the resource usage of all the steps combined"""
+        total = {}
+        for usage in self.steps.values():
+            for (k, v) in usage.items():
+                if k in ADDITIVE_COUNTERS:
+                    total[k] = round(total.get(k, 0) + v, 6)
+                else:
+                    total[k] = max(total.get(k, 0), v)
+        return total
+
+    def as_dict(self):
+        """Structure sent in the JOB_END message"""
+        return {'steps': dict(self.steps), 'total': self.total()}
+
+
+class ResourceMeterTestCase(unittest.TestCase):
+
+    def test_measures(self):
+        meter = ResourceMeter()
+        with meter.measure('fetch_input'):
+            pass
+        with meter.measure('run'):
+            sum(i*i for i in range(100000))
+        self.assertEqual(list(meter.steps.keys()), ['fetch_input', 'run'])
+        run = meter.steps['run']
+        for k in ['wall_seconds', 'user_cpu_seconds', 'sys_cpu_seconds', 'major_faults', 'block_input_ops', 'peak_rss_kb', 'peak_rss_delta_kb']:
+            self.assertIn(k, run)
+        self.assertGreater(run['wall_seconds'], 0)
+        self.assertGreater(run['peak_rss_kb'], 0)
+        total = meter.as_dict()['total']
+        self.assertAlmostEqual(total['wall_seconds'], meter.steps['fetch_input']['wall_seconds'] + run['wall_seconds'], places=5)
+        self.assertEqual(total['peak_rss_kb'], max(s['peak_rss_kb'] for s in meter.steps.values()))
+
+    def test_tracemalloc(self):
+        meter = ResourceMeter(trace_malloc=True)
+        with meter.measure('run'):
+            x = bytearray(4 * 1024 * 1024)
+            del x
+        self.assertGreaterEqual(meter.steps['run']['tracemalloc_peak_kb'], 4096)
+        self.assertFalse(tracemalloc.is_tracing())
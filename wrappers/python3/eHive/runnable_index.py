@@ -0,0 +1,233 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Index of the Runnables that are known to be loadable, to answer
+`wrapper check_exists` without importing them.
+
+The index records the file and the modification time of every Runnable
+that has been found. A Runnable whose file has not changed since is
+assumed to be loadable. The index is only valid for the sys.path it has
+been built with. It is stored in the file named by the environment
+variable EHIVE_PYTHON_RUNNABLE_INDEX, or in the user's cache directory
+(one file per installation of the wrapper). It is only written by
+`wrapper build`, so that checks never write to a shared installation.
+"""
+
+import hashlib
+import importlib.machinery
+import json
+import os
+import site
+import sys
+import tempfile
+import unittest
+
+from .process import BaseRunnable
+from .utils import find_module
+
+
+INDEX_FORMAT_VERSION = 1
+
+
+def default_index_path():
+    """EHIVE_PYTHON_RUNNABLE_INDEX, or a file in the user's cache directory
+    named after the location of the wrapper"""
+    if os.environ.get('EHIVE_PYTHON_RUNNABLE_INDEX'):
+        return os.environ['EHIVE_PYTHON_RUNNABLE_INDEX']
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    wrapper_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha1(wrapper_dir.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'ehive', 'runnable_index_{0}.json'.format(digest))
+
+
+class RunnableIndex:
+    """Maps module names to the file and class of the Runnable"""
+
+    def __init__(self, path=None):
+        self.path = path or default_index_path()
+        self.runnables = {}
+        self.load()
+
+    def signature(self):
+        """What the index depends on"""
+        return {'format': INDEX_FORMAT_VERSION, 'python': sys.version, 'sys_path': sys.path}
+
+    def load(self):
+        """Reads the index. A missing, corrupted or stale index is ignored"""
+        try:
+            with open(self.path, 'r') as fh:
+                content = json.load(fh)
+        except (OSError, ValueError):
+            return
+        if isinstance(content, dict) and content.get('signature') == json.loads(json.dumps(self.signature())):
+            self.runnables = content.get('runnables', {})
+
+    def save(self):
+        """Writes the index atomically. Returns False if the file cannot be written"""
+        content = {'signature': self.signature(), 'runnables': self.runnables}
+        try:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', prefix='.tmp.')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(content, fh, indent=1, sort_keys=True)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            return False
+        return True
+
+    def lookup(self, module_name):
+        """Returns the entry of module_name if its file has not changed since it was indexed"""
+        entry = self.runnables.get(module_name)
+        if entry is None:
+            return None
+        try:
+            if os.stat(entry['path']).st_mtime != entry['mtime']:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def add(self, module_name, runnable_class):
+        """Records a Runnable that has just been successfully loaded"""
+        path = sys.modules[runnable_class.__module__].__file__
+        self.runnables[module_name] = {'path': path, 'class': runnable_class.__name__, 'mtime': os.stat(path).st_mtime}
+
+    def check_exists(self, module_name):
+        """Returns None if the Runnable exists, or the error message of find_module"""
+        if self.lookup(module_name) is not None:
+            return None
+        try:
+            runnable_class = find_module(module_name)
+        except ImportError as e:
+            self.runnables.pop(module_name, None)
+            return str(e)
+        self.add(module_name, runnable_class)
+        return None
+
+    def build(self, directories=None):
+        """Rebuilds the index from all the Runnables found in the packages of
+        the directories (by default the ones of sys.path that are not part of
+        the Python installation). Returns the number of Runnables found"""
+        self.runnables = {}
+        for directory in (directories if directories is not None else user_code_directories()):
+            for module_name in candidate_modules(directory):
+                try:
+                    runnable_class = find_module(module_name)
+                except Exception:
+                    # Not a Runnable or not loadable: check_exists will report the error
+                    continue
+                if issubclass(runnable_class, BaseRunnable):
+                    self.add(module_name, runnable_class)
+        return len(self.runnables)
+
+
+def user_code_directories():
+    """The directories of sys.path that do not belong to the Python installation"""
+    excluded = {os.path.realpath(p) for p in [sys.prefix, sys.base_prefix, sys.exec_prefix]}
+    excluded.update(os.path.realpath(p) for p in site.getsitepackages() + [site.getusersitepackages()])
+    directories = []
+    for p in sys.path:
+        rp = os.path.realpath(p or '.')
+        if os.path.isdir(rp) and not any(rp == e or rp.startswith(e + os.sep) for e in excluded) and rp not in directories:
+            directories.append(rp)
+    return directories
+
+
+def candidate_modules(directory):
+    """Names of the modules of the packages found in directory that may
+    contain a Runnable, i.e. a class named like the module"""
+    suffixes = tuple(importlib.machinery.SOURCE_SUFFIXES)
+    for (dirpath, dirnames, filenames) in os.walk(directory):
+        relative = os.path.relpath(dirpath, directory)
+        if relative != '.':
+            if not os.path.exists(os.path.join(dirpath, '__init__.py')):
+                # Only descend into regular packages
+                dirnames[:] = []
+                continue
+        else:
+            # Top-level modules are not considered: only packages
+            filenames = []
+        dirnames[:] = [d for d in dirnames if d.isidentifier()]
+        prefix = '' if relative == '.' else relative.replace(os.sep, '.') + '.'
+        for filename in filenames:
+            if not filename.endswith(suffixes) or filename.startswith('__init__.'):
+                continue
+            name = filename.rsplit('.', 1)[0]
+            try:
+                with open(os.path.join(dirpath, filename), 'r', errors='replace') as fh:
+                    if 'class ' + name not in fh.read():
+                        continue
+            except OSError:
+                continue
+            yield prefix + name
+
+
+class RunnableIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.dir, 'index.json')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def test_check_exists(self):
+        index = RunnableIndex(self.index_path)
+        self.assertIsNone(index.check_exists('eHive.examples.LongMult.DigitFactory'))
+        self.assertIn('Cannot import', index.check_exists('eHive.examples.LongMult.NotThere'))
+        self.assertTrue(index.save())
+
+        index = RunnableIndex(self.index_path)
+        entry = index.lookup('eHive.examples.LongMult.DigitFactory')
+        self.assertEqual(entry['class'], 'DigitFactory')
+        self.assertTrue(entry['path'].endswith('DigitFactory.py'))
+        # A modified file invalidates the entry
+        entry['mtime'] -= 1
+        self.assertIsNone(index.lookup('eHive.examples.LongMult.DigitFactory'))
+
+    def test_stale_index(self):
+        with open(self.index_path, 'w') as fh:
+            json.dump({'signature': {'format': INDEX_FORMAT_VERSION, 'python': sys.version, 'sys_path': ['/elsewhere']}, 'runnables': {'a.B': {}}}, fh)
+        self.assertEqual(RunnableIndex(self.index_path).runnables, {})
+
+    def test_index_path(self):
+        environ = dict(os.environ)
+        try:
+            os.environ.pop('EHIVE_PYTHON_RUNNABLE_INDEX', None)
+            os.environ['XDG_CACHE_HOME'] = self.dir
+            self.assertTrue(default_index_path().startswith(os.path.join(self.dir, 'ehive', 'runnable_index_')))
+            self.assertTrue(RunnableIndex().save())
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        # Not being able to save the index is not an error
+        with open(os.path.join(self.dir, 'file'), 'w'):
+            pass
+        self.assertFalse(RunnableIndex(os.path.join(self.dir, 'file', 'index.json')).save())
+
+    def test_build(self):
+        index = RunnableIndex(self.index_path)
+        python_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        n = index.build([python_dir])
+        self.assertGreaterEqual(n, 4)
+        for name in ['eHive.examples.LongMult.DigitFactory', 'eHive.examples.LongMult.AddTogether', 'eHive.examples.TestRunnable']:
+            self.assertIsNotNone(index.lookup(name), name)
+        # Not Runnables
+        self.assertNotIn('eHive.process', index.runnables)
+        self.assertIn(python_dir, user_code_directories())
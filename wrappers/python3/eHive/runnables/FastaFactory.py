@@ -0,0 +1,290 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Version of Bio::EnsEMBL::Hive::RunnableDB::FastaFactory that never parses
+the sequences.
+
+The input file is memory-mapped and the records are found by searching
+for the "\\n>" separators. Records are grouped into chunks following the
+same rules as the Perl FastaFactory (max_chunk_length, max_chunk_size,
+seq_filter) and the chunks are written by copying the byte ranges of the
+input file with os.sendfile(), so the sequences are kept exactly as they
+are in the input (line width included) and never go through Python.
+
+With 'write_chunks' set to 0, no file is written and each job receives
+the list of [offset, length] byte ranges of its records in 'chunk_ranges'
+instead, to be read directly from 'inputfile'.
+
+Only FASTA is supported. Compressed (.gz) input files are decompressed in
+the worker's temporary directory first.
+"""
+
+import contextlib
+import gzip
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import eHive
+
+
+# Size of the blocks in which newlines are counted, to bound the memory used
+COUNT_BLOCK_SIZE = 1 << 24
+
+
+class FastaFactory(eHive.BaseRunnable):
+    """Splits a FASTA file into chunks and creates one job per chunk"""
+
+    def param_defaults(self):
+        return {
+            'max_chunk_length'  : 100000,
+            'max_chunk_size'    : 0,
+            'output_prefix'     : 'my_chunk_',
+            'output_suffix'     : '.fasta',
+            'seq_filter'        : None,
+            'hash_directories'  : 0,
+            'output_dir'        : '',
+            'write_chunks'      : 1,
+        }
+
+
+    def fetch_input(self):
+        inputfile = self.param_required('inputfile')
+        if not os.access(inputfile, os.R_OK):
+            raise OSError("Cannot read '{0}'".format(inputfile))
+        if inputfile.endswith(('.gz', '.Z')):
+            if not self.param('write_chunks'):
+                raise ValueError("'write_chunks' cannot be 0 with compressed input files")
+            path = os.path.join(self.worker_temp_directory(), os.path.basename(inputfile) + '.uncompressed')
+            with gzip.open(inputfile, 'rb') as fin, open(path, 'wb') as fout:
+                shutil.copyfileobj(fin, fout, COUNT_BLOCK_SIZE)
+            self._uncompressed_file = path
+            inputfile = path
+        self._inputfile = inputfile
+
+
+    def write_output(self):
+        max_chunk_length = self.param('max_chunk_length')
+        max_chunk_size = self.param('max_chunk_size')
+        seq_filter = re.compile(self.param('seq_filter')) if self.param('seq_filter') is not None else None
+
+        chunk_number = 1
+        chunk_length = 0
+        chunk_size = 0
+        chunk_ranges = []
+
+        with open(self._inputfile, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                return
+            with contextlib.closing(mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)) as mm:
+                for (start, end, seq_id, length) in iter_fasta_records(mm):
+                    if seq_filter is not None and seq_filter.search(seq_id):
+                        continue
+                    if chunk_ranges and chunk_ranges[-1][1] == start:
+                        # Contiguous records are copied at once
+                        chunk_ranges[-1][1] = end
+                    else:
+                        chunk_ranges.append([start, end])
+                    chunk_length += length
+                    chunk_size += 1
+                    if (max_chunk_length and chunk_length > max_chunk_length) or (max_chunk_size and chunk_size > max_chunk_size):
+                        self._flush_chunk(fh, mm, chunk_number, chunk_length, chunk_size, chunk_ranges)
+                        chunk_number += 1
+                        chunk_length = 0
+                        chunk_size = 0
+                        chunk_ranges = []
+                if chunk_size:
+                    self._flush_chunk(fh, mm, chunk_number, chunk_length, chunk_size, chunk_ranges)
+
+
+    def post_cleanup(self):
+        if hasattr(self, '_uncompressed_file'):
+            os.remove(self._uncompressed_file)
+            del self._uncompressed_file
+
+
+    def _chunk_name(self, chunk_number):
+        """Same naming scheme as the Perl FastaFactory"""
+        chunk_name = self.param('output_prefix') + str(chunk_number) + self.param('output_suffix')
+        partial_dirs = []
+        if self.param('output_dir'):
+            partial_dirs.append(self.param('output_dir'))
+        # Even with hash_directories, the first file is in output_dir
+        if self.param('hash_directories') and chunk_number > 1:
+            hash_dir = dir_revhash(chunk_number)
+            if hash_dir:
+                partial_dirs.append(hash_dir)
+        if not partial_dirs:
+            return chunk_name
+        dir_tree = os.path.join(*partial_dirs)
+        os.makedirs(dir_tree, exist_ok=True)
+        return os.path.normpath(os.path.join(dir_tree, chunk_name))
+
+
+    def _flush_chunk(self, fh, mm, chunk_number, chunk_length, chunk_size, chunk_ranges):
+        output_id = {
+            'chunk_number'  : chunk_number,
+            'chunk_length'  : chunk_length,
+            'chunk_size'    : chunk_size,
+        }
+        if self.param('write_chunks'):
+            chunk_name = self._chunk_name(chunk_number)
+            write_ranges(fh, mm, chunk_name, chunk_ranges)
+            output_id['chunk_name'] = chunk_name
+        else:
+            output_id['inputfile'] = self.param('inputfile')
+            output_id['chunk_ranges'] = [[start, end - start] for (start, end) in chunk_ranges]
+        self.dataflow(output_id, 2)
+
+
+def dir_revhash(n):
+    """Same as Bio::EnsEMBL::Hive::Utils::dir_revhash"""
+    return '/'.join(reversed(str(n)[1:]))
+
+
+def count_residues(mm, start, end):
+    """Number of characters between start and end that are not line breaks"""
+    n_breaks = 0
+    for block_start in range(start, end, COUNT_BLOCK_SIZE):
+        block = mm[block_start:min(block_start + COUNT_BLOCK_SIZE, end)]
+        n_breaks += block.count(b'\n') + block.count(b'\r')
+    return end - start - n_breaks
+
+
+def iter_fasta_records(mm):
+    """Yields (start, end, id, length) for each record of a memory-mapped
+    FASTA file. start and end are byte offsets, the record including its
+    header line and its trailing line break"""
+    size = len(mm)
+    start = 0 if mm[0:1] == b'>' else mm.find(b'\n>')
+    if start < 0:
+        return
+    if start > 0:
+        # Skip what comes before the first header
+        start += 1
+    while start < size:
+        header_end = mm.find(b'\n', start)
+        if header_end < 0:
+            header_end = size
+        end = mm.find(b'\n>', header_end)
+        end = size if end < 0 else end + 1
+        header = mm[start + 1:header_end].decode('ascii', 'replace').strip()
+        seq_id = header.split(None, 1)[0] if header else ''
+        yield (start, end, seq_id, count_residues(mm, header_end, end))
+        start = end
+
+
+def write_ranges(fh, mm, path, ranges):
+    """Copies the byte ranges of the file to a new file, with os.sendfile()
+    when possible. A line break is added if the file would not end with one"""
+    with open(path, 'wb') as out:
+        out_fd = out.fileno()
+        for (start, end) in ranges:
+            offset = start
+            try:
+                while offset < end:
+                    sent = os.sendfile(out_fd, fh.fileno(), offset, end - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+            except (AttributeError, OSError):
+                # No sendfile on this platform / filesystem: copy from the map
+                pass
+            if offset < end:
+                out.write(memoryview(mm)[offset:end])
+        if ranges and mm[ranges[-1][1] - 1:ranges[-1][1]] != b'\n':
+            out.write(b'\n')
+
+
+class FastaFactoryTestCase(unittest.TestCase):
+
+    # The file used by the tests of the Perl FastaFactory
+    inputfile = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 't', 'input_fasta.fa')
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.original_dir = os.getcwd()
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        shutil.rmtree(self.dir)
+
+    def chunk(self, number, length, size, name):
+        return {'chunk_number': number, 'chunk_length': length, 'chunk_size': size, 'chunk_name': name}
+
+    @unittest.skipUnless(os.path.exists(inputfile), 'Needs the eHive test files')
+    def test_like_perl(self):
+        # Same expectations as t/05.runnabledb/fastafactory.t
+        eHive.testRunnable(self, FastaFactory, {'inputfile': self.inputfile, 'max_chunk_length': 20000, 'output_prefix': './test1_', 'output_suffix': '.fa'}, [
+            eHive.DataflowEvent(self.chunk(1, 3360, 3, './test1_1.fa'), 2),
+        ])
+        with open(self.inputfile, 'rb') as fh, open('test1_1.fa', 'rb') as fc:
+            self.assertEqual(fh.read(), fc.read())
+
+        eHive.testRunnable(self, FastaFactory, {'inputfile': self.inputfile, 'max_chunk_length': 200, 'output_prefix': './test2_', 'output_suffix': '.fa'}, [
+            eHive.DataflowEvent(self.chunk(1, 640, 1, './test2_1.fa'), 2),
+            eHive.DataflowEvent(self.chunk(2, 1280, 1, './test2_2.fa'), 2),
+            eHive.DataflowEvent(self.chunk(3, 1440, 1, './test2_3.fa'), 2),
+        ])
+        self.assertEqual([os.path.getsize('test2_{0}.fa'.format(i)) for i in (1, 2, 3)], [662, 1313, 1475])
+
+        eHive.testRunnable(self, FastaFactory, {'inputfile': self.inputfile, 'max_chunk_length': 1000, 'output_prefix': './test3_', 'output_suffix': '.fa', 'output_dir': 'inside'}, [
+            eHive.DataflowEvent(self.chunk(1, 1920, 2, 'inside/test3_1.fa'), 2),
+            eHive.DataflowEvent(self.chunk(2, 1440, 1, 'inside/test3_2.fa'), 2),
+        ])
+
+        # One record per line of sequence, written to hashed directories
+        with open(self.inputfile, 'r') as fh, open('test_input.fa', 'w') as fo:
+            for (i, line) in enumerate(fh, 1):
+                if not line.startswith('>'):
+                    fo.write('>seq{0}\n{1}'.format(i, line))
+        eHive.testRunnable(self, FastaFactory, {'inputfile': 'test_input.fa', 'max_chunk_length': 300, 'output_prefix': 'test4_', 'output_suffix': '.fa', 'output_dir': 'in4', 'hash_directories': 1}, [
+            eHive.CountEvents(10, predicate=lambda e: e.output_ids['chunk_name'].startswith('in4/')),
+        ])
+        sizes = [402, 386, 408, 408, 408, 368, 408, 408, 408]
+        self.assertEqual([os.path.getsize('in4/test4_{0}.fa'.format(i)) for i in range(1, 10)], sizes)
+        self.assertEqual(os.path.getsize('in4/0/test4_10.fa'), 204)
+
+        # Compressed input
+        with open(self.inputfile, 'rb') as fh, gzip.open('input.fa.gz', 'wb') as fo:
+            fo.write(fh.read())
+        eHive.testRunnable(self, FastaFactory, {'inputfile': 'input.fa.gz', 'max_chunk_length': 20000, 'output_prefix': './test5_', 'output_suffix': '.fa'}, [
+            eHive.DataflowEvent(self.chunk(1, 3360, 3, './test5_1.fa'), 2),
+        ])
+        self.assertEqual(os.path.getsize('test5_1.fa'), os.path.getsize(self.inputfile))
+
+    def test_ranges(self):
+        with open('input.fa', 'w') as fh:
+            fh.write("# comment\n>a desc\nACGT\nAC\n>b\nAAAA\n>c\nCC\n>d\nGGG")
+        eHive.testRunnable(self, FastaFactory, {'inputfile': 'input.fa', 'max_chunk_size': 1, 'seq_filter': '^b', 'write_chunks': 0}, [
+            eHive.DataflowEvent({'chunk_number': 1, 'chunk_length': 8, 'chunk_size': 2, 'inputfile': 'input.fa', 'chunk_ranges': [[10, 16], [34, 6]]}, 2),
+            eHive.DataflowEvent({'chunk_number': 2, 'chunk_length': 3, 'chunk_size': 1, 'inputfile': 'input.fa', 'chunk_ranges': [[40, 6]]}, 2),
+        ])
+        # The missing line break is added at the end of the last chunk
+        eHive.testRunnable(self, FastaFactory, {'inputfile': 'input.fa', 'max_chunk_length': 5}, [
+            eHive.DataflowEvent(self.chunk(1, 6, 1, 'my_chunk_1.fasta'), 2),
+            eHive.DataflowEvent(self.chunk(2, 6, 2, 'my_chunk_2.fasta'), 2),
+            eHive.DataflowEvent(self.chunk(3, 3, 1, 'my_chunk_3.fasta'), 2),
+        ])
+        with open('my_chunk_3.fasta', 'r') as fh:
+            self.assertEqual(fh.read(), ">d\nGGG\n")
+        # Empty file
+        open('empty.fa', 'w').close()
+        eHive.testRunnable(self, FastaFactory, {'inputfile': 'empty.fa'}, [])
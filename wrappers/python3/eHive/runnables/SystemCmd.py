@@ -0,0 +1,444 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Python version of Bio::EnsEMBL::Hive::RunnableDB::SystemCmd.
+
+With 'cmd', it runs a single command and handles its exit status like the
+Perl SystemCmd: return_codes_2_branches, branch -2 for timeouts, branch
+-1 for Java heap space errors, and dataflow_file.
+
+With 'cmds', it runs a list of commands, at most 'max_parallel' at a time.
+Commands that exit with a code listed in return_codes_2_branches (use the
+key "-2" for timeouts) dataflow {cmd_index, flat_cmd, return_code} on
+the corresponding branch. Any other failure fails the job, and no
+dataflow happens.
+
+The output of the commands is streamed: it is appended to 'stdout_file'
+and 'stderr_file' if given (suffixed with the index of the command with
+'cmds'), copied to the worker's own output if 'tee_output' is set, and
+only the last 'output_buffer_size' bytes of each stream are kept in
+memory for the 'stdout' and 'stderr' parameters. The resource usage of
+every command (from wait4()) is stored in 'rusage' ('command_results'
+with 'cmds').
+"""
+
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import selectors
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import eHive
+
+
+# Characters that need a shell when the command is given as a list (see Bio::EnsEMBL::Hive::Utils::join_command_args)
+SHELL_CHARACTERS = {'<', '>', '>>', '2>', '2>&1', '|', '&&', '||', ';'}
+
+# How often a command that has closed its output is checked for its timeout
+WAIT_POLL_SECONDS = .05
+
+
+def join_command_args(args):
+    """Returns (join_needed, flat_cmd) like Bio::EnsEMBL::Hive::Utils::join_command_args"""
+    if isinstance(args, str):
+        return (False, args)
+    join_needed = any(a in SHELL_CHARACTERS for a in args)
+    new_args = []
+    for a in args:
+        a = str(a)
+        if a in SHELL_CHARACTERS or (a and all(c.isalnum() and ord(c) < 128 or c in '_/-' for c in a)):
+            new_args.append(a)
+        else:
+            new_args.append("'" + a.replace("'", "'\\''") + "'")
+    return (join_needed, ' '.join(new_args))
+
+
+class RingBuffer:
+    """Keeps the last max_bytes bytes written to it"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.chunks = collections.deque()
+        self.size = 0
+        self.truncated = False
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            excess = self.size - self.max_bytes
+            first = self.chunks[0]
+            if len(first) <= excess:
+                self.chunks.popleft()
+                self.size -= len(first)
+            else:
+                self.chunks[0] = first[excess:]
+                self.size -= excess
+            self.truncated = True
+
+    def getvalue(self):
+        return b''.join(self.chunks).decode('utf-8', 'replace')
+
+
+class TextTee:
+    """Copies bytes to a text stream, through its binary buffer if it has
+    one (e.g. sys.stdout) or decoded otherwise (e.g. io.StringIO when
+    sys.stdout has been redirected)"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = None if hasattr(stream, 'buffer') else codecs.getincrementaldecoder('utf-8')('replace')
+
+    def write(self, data):
+        if self.decoder is None:
+            self.stream.flush()
+            self.stream.buffer.write(data)
+        else:
+            self.stream.write(self.decoder.decode(data))
+
+
+def run_command(cmd, use_bash_pipefail=False, use_bash_errexit=False, timeout=None, stdout_path=None, stderr_path=None, buffer_size=1 << 20, tee=False):
+    """Runs a command, streaming its output, and returns a dictionary with
+    its exit status (return_value as in Perl: the wait status, -1 if the
+    command could not be started, -2 if it timed out), the tails of its
+    output and its resource usage"""
+    (join_needed, flat_cmd) = join_command_args(cmd)
+    if use_bash_pipefail or use_bash_errexit:
+        args = ['bash'] + (['-o', 'pipefail'] if use_bash_pipefail else []) + (['-o', 'errexit'] if use_bash_errexit else []) + ['-c', flat_cmd]
+        shell = False
+    elif join_needed or isinstance(cmd, str):
+        (args, shell) = (flat_cmd, True)
+    else:
+        (args, shell) = ([str(a) for a in cmd], False)
+
+    result = {'flat_cmd': flat_cmd, 'return_value': 0, 'return_code': None, 'signal': None, 'timed_out': False}
+    buffers = {'stdout': RingBuffer(buffer_size), 'stderr': RingBuffer(buffer_size)}
+    # Like Capture::Tiny::tee in Perl, the output can be copied to the worker's own output
+    tees = {'stdout': TextTee(sys.stdout), 'stderr': TextTee(sys.stderr)} if tee else {}
+    files = {}
+    start = time.monotonic()
+    try:
+        if stdout_path:
+            files['stdout'] = open(stdout_path, 'ab')
+        if stderr_path:
+            files['stderr'] = open(stderr_path, 'ab')
+        try:
+            # With a timeout, the command gets its own process group so that it can be killed with all its children
+            proc = subprocess.Popen(args, shell=shell, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=timeout is not None)
+        except OSError as e:
+            result.update(return_value=-1, stdout='', stderr=str(e), runtime_msec=0, rusage={})
+            return result
+
+        deadline = start + timeout if timeout is not None else None
+        with selectors.DefaultSelector() as selector:
+            selector.register(proc.stdout, selectors.EVENT_READ, 'stdout')
+            selector.register(proc.stderr, selectors.EVENT_READ, 'stderr')
+            while selector.get_map():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    result['timed_out'] = True
+                    os.killpg(proc.pid, signal.SIGKILL)
+                    deadline = None
+                    continue
+                for (key, _) in selector.select(remaining):
+                    data = os.read(key.fileobj.fileno(), 1 << 16)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                        continue
+                    stream = key.data
+                    buffers[stream].write(data)
+                    if stream in files:
+                        files[stream].write(data)
+                    if stream in tees:
+                        tees[stream].write(data)
+
+        # The command may still be running after having closed its output
+        while True:
+            (pid, status, ru) = os.wait4(proc.pid, 0 if deadline is None else os.WNOHANG)
+            if pid:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                result['timed_out'] = True
+                os.killpg(proc.pid, signal.SIGKILL)
+                deadline = None
+                continue
+            time.sleep(min(remaining, WAIT_POLL_SECONDS))
+        proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    finally:
+        for fh in files.values():
+            fh.close()
+
+    if proc.returncode < 0:
+        result['signal'] = -proc.returncode
+    else:
+        result['return_code'] = proc.returncode
+    result['return_value'] = -2 if result['timed_out'] else status
+    result['stdout'] = buffers['stdout'].getvalue()
+    result['stderr'] = buffers['stderr'].getvalue()
+    result['runtime_msec'] = int((time.monotonic() - start) * 1000)
+    result['rusage'] = {
+        'wall_seconds': round(time.monotonic() - start, 6),
+        'user_cpu_seconds': ru.ru_utime,
+        'sys_cpu_seconds': ru.ru_stime,
+        'peak_rss_kb': ru.ru_maxrss,
+        'major_faults': ru.ru_majflt,
+        'minor_faults': ru.ru_minflt,
+        'block_input_ops': ru.ru_inblock,
+        'block_output_ops': ru.ru_oublock,
+    }
+    return result
+
+
+class SystemCmd(eHive.BaseRunnable):
+    """Runs one command ('cmd') or several ones ('cmds') and takes actions based on their exit status"""
+
+    # How long to wait after a command has been killed, in case the worker is about to be killed too (MEMLIMIT / RUNLIMIT)
+    KILLED_GRACE_SECONDS = 30
+
+    def param_defaults(self):
+        return {
+            'return_codes_2_branches'   : {},
+            'use_bash_pipefail'         : 0,
+            'use_bash_errexit'          : 0,
+            'dataflow_file'             : None,
+            'dataflow_branch'           : None,
+            'timeout'                   : None,
+            'max_parallel'              : 1,
+            'stdout_file'               : None,
+            'stderr_file'               : None,
+            'output_buffer_size'        : 1 << 20,
+            'tee_output'                : 1,
+        }
+
+
+    def run(self):
+        options = {
+            'use_bash_pipefail' : bool(self.param('use_bash_pipefail')),
+            'use_bash_errexit'  : bool(self.param('use_bash_errexit')),
+            # Parameters coming from Perl may be strings
+            'timeout'           : None if self.param('timeout') is None else float(self.param('timeout')),
+            'buffer_size'       : int(self.param('output_buffer_size')),
+            'tee'               : bool(self.param('tee_output')),
+        }
+        if self.param_is_defined('cmds'):
+            cmds = self.param('cmds')
+            def run_one(i):
+                return run_command(cmds[i],
+                                   stdout_path=self.param('stdout_file') and '{0}.{1}'.format(self.param('stdout_file'), i),
+                                   stderr_path=self.param('stderr_file') and '{0}.{1}'.format(self.param('stderr_file'), i),
+                                   **options)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(self.param('max_parallel')))) as executor:
+                self.param('command_results', list(executor.map(run_one, range(len(cmds)))))
+        else:
+            result = run_command(self.param_required('cmd'), stdout_path=self.param('stdout_file'), stderr_path=self.param('stderr_file'), **options)
+            # To be used in write_output()
+            for key in ['return_value', 'stderr', 'flat_cmd', 'stdout', 'runtime_msec', 'rusage']:
+                self.param(key, result[key])
+
+
+    def write_output(self):
+        if self.param_is_defined('command_results'):
+            self._write_output_of_commands(self.param('command_results'))
+            return
+
+        return_value = self.param('return_value')
+        if not return_value:
+            if self.param('dataflow_file'):
+                self.dataflow_output_ids_from_json(self.param('dataflow_file'), self.param('dataflow_branch'))
+            return
+
+        stderr = self.param('stderr')
+        flat_cmd = self.param('flat_cmd')
+        if return_value == -1:
+            raise OSError("Could not start '{0}': {1}".format(flat_cmd, stderr))
+        elif return_value == -2:
+            self._complete_early_if_branch_connected("The command was aborted because it exceeded the allowed runtime. Flowing to the -2 branch.", -2)
+            raise eHive.JobFailedException("The command was aborted because it exceeded the allowed runtime, but there are no dataflow-rules on branch -2.")
+        elif return_value & 255:
+            time.sleep(self.KILLED_GRACE_SECONDS)
+            raise eHive.JobFailedException("'{0}' was killed with code={1}\nstderr is: {2}".format(flat_cmd, return_value, stderr))
+        else:
+            return_code = return_value >> 8
+            branch = self._branch_of_return_code(return_code)
+            if branch is not None:
+                self._complete_early("The command exited with code {0}, which is mapped to a dataflow on branch #{1}.".format(return_code, branch), branch)
+            if 'Exception in thread ' in stderr and 'java.lang.OutOfMemoryError: Java heap space' in stderr:
+                self._complete_early_if_branch_connected("Java heap space is out of memory. A job has been dataflown to the -1 branch.", -1)
+                raise eHive.JobFailedException(stderr)
+            raise eHive.JobFailedException("'{0}' resulted in an error code={1}\nstderr is: {2}".format(flat_cmd, return_code, stderr))
+
+
+    def _write_output_of_commands(self, results):
+        """All the commands must have succeeded, or have a return code mapped to a branch"""
+        dataflows = []
+        for (i, result) in enumerate(results):
+            if result['return_value'] == 0:
+                continue
+            code = -2 if result['timed_out'] else result['return_code']
+            branch = self._branch_of_return_code(code) if code is not None else None
+            if branch is None:
+                if result['return_value'] == -1:
+                    raise OSError("Could not start '{0}': {1}".format(result['flat_cmd'], result['stderr']))
+                if result['signal']:
+                    raise eHive.JobFailedException("'{0}' was killed with signal {1}\nstderr is: {2}".format(result['flat_cmd'], result['signal'], result['stderr']))
+                raise eHive.JobFailedException("'{0}' resulted in an error code={1}\nstderr is: {2}".format(result['flat_cmd'], code, result['stderr']))
+            dataflows.append(({'cmd_index': i, 'flat_cmd': result['flat_cmd'], 'return_code': code}, branch))
+        for (output_id, branch) in dataflows:
+            self.dataflow(output_id, branch)
+        if self.param('dataflow_file'):
+            self.dataflow_output_ids_from_json(self.param('dataflow_file'), self.param('dataflow_branch'))
+
+
+    def _branch_of_return_code(self, return_code):
+        return_codes_2_branches = self.param('return_codes_2_branches') or {}
+        # Keys are strings when the hash comes from Perl / JSON
+        for key in (return_code, str(return_code)):
+            if key in return_codes_2_branches:
+                return return_codes_2_branches[key]
+        return None
+
+
+    def _complete_early(self, message, branch):
+        """Like Process::complete_early() in Perl: flows the job's parameters to the branch and ends the job successfully"""
+        self.dataflow(None, branch)
+        self.input_job.autoflow = False
+        raise eHive.CompleteEarlyException(message)
+
+
+    def _complete_early_if_branch_connected(self, message, branch):
+        """Like complete_early_if_branch_connected() in Perl: only completes
+        early if the analysis has dataflow rules on the branch"""
+        if self.is_branch_connected(branch):
+            self._complete_early(message, branch)
+
+
+    def dataflow_output_ids_from_json(self, filename, default_branch=None):
+        """Dataflows every line of the file: a JSON object, optionally preceded by a branch number"""
+        output_job_ids = []
+        with open(filename, 'r') as fh:
+            for line in fh:
+                line = line.rstrip('\n')
+                branch = default_branch if default_branch is not None else 1
+                (head, _, tail) = line.partition(' ')
+                if tail and head.lstrip('-').isdigit():
+                    (branch, line) = (int(head), tail.strip())
+                output_job_ids.extend(self.dataflow(json.loads(line), branch) or [])
+        return output_job_ids
+
+
+class SystemCmdTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_join_command_args(self):
+        self.assertEqual(join_command_args('ls -l'), (False, 'ls -l'))
+        self.assertEqual(join_command_args(['ls', '-l', 'a b', "it's"]), (False, "ls -l 'a b' 'it'\\''s'"))
+        self.assertEqual(join_command_args(['cat', 'x', '|', 'wc', '-l']), (True, 'cat x | wc -l'))
+
+    def test_ring_buffer(self):
+        b = RingBuffer(5)
+        for data in [b'abc', b'defg', b'h']:
+            b.write(data)
+        self.assertEqual(b.getvalue(), 'defgh')
+        self.assertTrue(b.truncated)
+
+    def test_run_command(self):
+        out = os.path.join(self.dir, 'out')
+        result = run_command(['python3', '-c', 'import sys; print("x" * 100000); print("err", file=sys.stderr)'], stdout_path=out, buffer_size=10)
+        self.assertEqual(result['return_value'], 0)
+        self.assertEqual(result['stdout'], 'x' * 9 + '\n')
+        self.assertEqual(result['stderr'], 'err\n')
+        self.assertEqual(os.path.getsize(out), 100001)
+        self.assertGreater(result['rusage']['peak_rss_kb'], 0)
+
+        result = run_command('exit 3')
+        self.assertEqual((result['return_value'], result['return_code']), (3 << 8, 3))
+        result = run_command('false | true', use_bash_pipefail=True)
+        self.assertEqual(result['return_code'], 1)
+        result = run_command('sleep 10; echo done', timeout=0.2)
+        self.assertEqual(result['return_value'], -2)
+        self.assertLess(result['runtime_msec'], 5000)
+        # The timeout applies after the command has closed its output too
+        result = run_command('exec >/dev/null 2>&1; sleep 8', timeout=0.5)
+        self.assertEqual(result['return_value'], -2)
+        self.assertTrue(result['timed_out'])
+        self.assertLess(result['runtime_msec'], 5000)
+        result = run_command(['/nonexistent/command'])
+        self.assertEqual(result['return_value'], -1)
+        # Redirected outputs have no binary buffer
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            result = run_command(['printf', 'caf\\303\\251'], tee=True)
+        self.assertEqual(out.getvalue(), 'caf\u00e9')
+        result = run_command('kill -9 $$')
+        self.assertEqual((result['return_value'], result['signal']), (9, 9))
+
+    def test_SystemCmd(self):
+        eHive.testRunnable(self, SystemCmd, {'cmd': 'echo hello', 'tee_output': 0}, [])
+        eHive.testRunnable(self, SystemCmd, {'cmd': 'exit 4', 'return_codes_2_branches': {'4': 3}}, [
+            eHive.DataflowEvent(None, 3),
+            eHive.CompleteEarlyEvent('The command exited with code 4, which is mapped to a dataflow on branch #3.'),
+        ], {'test_autoflow': False})
+        eHive.testRunnable(self, SystemCmd, {'cmd': ['sh', '-c', 'echo oops >&2; exit 5']}, [
+            eHive.FailureEvent(eHive.JobFailedException, ("'sh -c 'echo oops >&2; exit 5'' resulted in an error code=5\nstderr is: oops\n",)),
+        ])
+        eHive.testRunnable(self, SystemCmd, {'cmd': 'sleep 5', 'timeout': 0.1}, [
+            eHive.DataflowEvent(None, -2),
+            eHive.CompleteEarlyEvent('The command was aborted because it exceeded the allowed runtime. Flowing to the -2 branch.'),
+        ], {'connected_branches': [-2]})
+        eHive.testRunnable(self, SystemCmd, {'cmd': 'sleep 5', 'timeout': 0.1}, [
+            eHive.FailureEvent(eHive.JobFailedException, ('The command was aborted because it exceeded the allowed runtime, but there are no dataflow-rules on branch -2.',)),
+        ], {'connected_branches': []})
+        dataflow_file = os.path.join(self.dir, 'dataflow.json')
+        with open(dataflow_file, 'w') as fh:
+            fh.write('{"a": 1}\n3 {"b": 2}\n')
+        eHive.testRunnable(self, SystemCmd, {'cmd': 'true', 'dataflow_file': dataflow_file, 'dataflow_branch': 2}, [
+            eHive.DataflowEvent({'a': 1}, 2),
+            eHive.DataflowEvent({'b': 2}, 3),
+        ])
+
+    def test_cmds(self):
+        start = time.monotonic()
+        eHive.testRunnable(self, SystemCmd, {
+            'cmds': ['sleep 0.3', 'sleep 0.3; exit 2', ['sleep', '0.3'], 'sleep 0.3; exit 3'],
+            'max_parallel': 4,
+            'return_codes_2_branches': {'2': 4, '3': 5},
+            'stdout_file': os.path.join(self.dir, 'out'),
+        }, [
+            eHive.DataflowEvent({'cmd_index': 1, 'flat_cmd': 'sleep 0.3; exit 2', 'return_code': 2}, 4),
+            eHive.DataflowEvent({'cmd_index': 3, 'flat_cmd': 'sleep 0.3; exit 3', 'return_code': 3}, 5),
+        ])
+        self.assertLess(time.monotonic() - start, 1.1, 'The commands ran concurrently')
+        self.assertEqual(sorted(os.listdir(self.dir)), ['out.0', 'out.1', 'out.2', 'out.3'])
+        # Unmapped failures fail the job before any dataflow happens
+        eHive.testRunnable(self, SystemCmd, {'cmds': ['exit 2', 'exit 3'], 'return_codes_2_branches': {'2': 4}, 'max_parallel': 2}, [
+            eHive.FailureEvent(eHive.JobFailedException, ("'exit 3' resulted in an error code=3\nstderr is: ",)),
+        ])
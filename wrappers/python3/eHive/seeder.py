@@ -0,0 +1,249 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Bulk version of seed_pipeline.pl for SQLite hive databases.
+
+    wrapper seed sqlite:///my_hive.db --analyses-pattern part_multiply --input-file input_ids.txt
+
+reads one input_id per line (a stringified hash such as {"a" => 1}, or
+JSON), and creates the jobs batch_size at a time, each batch in a single
+transaction: the input_ids are loaded into a temporary table, and a single
+INSERT ... SELECT creates the jobs that do not exist yet, in the order of
+the file. The statistics of the analysis are then updated once per batch
+(unless the database has triggers). Because duplicates are skipped, an
+interrupted seeding can simply be run again.
+
+The jobs can be created as the fans of a semaphore: either a new funnel
+job (--funnel-logic-name and --funnel-input-id; if the funnel job exists
+already, its semaphore is reused as the Perl code does), or an existing
+semaphore (--semaphore-id). The semaphore is increased by the number of
+jobs actually created. It is also held by one extra count while the
+seeding runs, so that the funnel cannot be released by workers that
+complete the first fans before the last ones are created.
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import unittest
+
+from .stringify import stringify, destringify
+from .worker import HiveDatabase, HiveDatabaseTestMixin, Pipeline, WorkerException
+
+
+DEFAULT_BATCH_SIZE = 100000
+
+
+class SeedException(Exception):
+    """Raised when the analysis, the semaphore or an input_id is invalid"""
+    pass
+
+
+def parse_input_id(line):
+    """The hash of a stringified (or JSON) input_id"""
+    input_id = destringify(line)
+    if input_id is None:
+        try:
+            input_id = json.loads(line)
+        except ValueError:
+            raise SeedException("'{0}' cannot be parsed".format(line)) from None
+    if not isinstance(input_id, dict):
+        raise SeedException("'{0}' is not a hash".format(line))
+    return input_id
+
+
+def read_input_ids(fh):
+    """Yields the input_ids of a file, stringified the way eHive does so
+    that alternative "spellings" of the same hash are detected as
+    duplicates. Blank lines and lines starting with # are skipped"""
+    for (line_number, line) in enumerate(fh, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield stringify(parse_input_id(line))
+        except SeedException as e:
+            raise SeedException('Line {0}: {1}'.format(line_number, e)) from None
+
+
+class JobSeeder:
+    """Creates jobs of an analysis in bulk. seed() can be called several
+    times on the same seeder"""
+
+    def __init__(self, url, analyses_pattern, batch_size=DEFAULT_BATCH_SIZE):
+        self.hive_db = HiveDatabase(url)
+        self.pipeline = Pipeline(self.hive_db)
+        self.analysis = self.find_analysis(analyses_pattern)
+        self.batch_size = batch_size
+        self.hive_db.execute('CREATE TEMP TABLE IF NOT EXISTS seed_input_id (input_id TEXT NOT NULL UNIQUE)')
+
+    def find_analysis(self, analyses_pattern):
+        analyses = self.pipeline.match_analyses(analyses_pattern)
+        if len(analyses) != 1:
+            raise SeedException("{0} analyses match the pattern '{1}', instead of 1".format(len(analyses), analyses_pattern))
+        return analyses[0]
+
+    def prepare_funnel(self, logic_name, input_id):
+        """Creates the funnel job (or finds the existing one) and returns its
+        semaphore, held by one count (see release_semaphore)"""
+        funnel_analysis = self.find_analysis(logic_name)
+        input_id = stringify(parse_input_id(input_id))
+        with self.hive_db.transaction():
+            stored_input_id = self.hive_db.store_input_id(input_id)
+            cursor = self.hive_db.execute("INSERT OR IGNORE INTO job (analysis_id, input_id, status) VALUES (?, ?, 'SEMAPHORED')", (funnel_analysis.analysis_id, stored_input_id))
+            if cursor.rowcount:
+                self.hive_db.count_new_jobs(funnel_analysis.analysis_id, 'SEMAPHORED', 1)
+                return self.hive_db.execute('INSERT INTO semaphore (local_jobs_counter, remote_jobs_counter, dependent_job_id) VALUES (1, 0, ?)', (cursor.lastrowid,)).lastrowid
+            (funnel_job_id, semaphore_id) = self.hive_db.leech_funnel_semaphore(funnel_analysis.analysis_id, stored_input_id, '', '')
+            self.hive_db.increase_semaphore(semaphore_id, 1)
+            self.hive_db.log_message('Discovered and using an existing funnel job_id={0}'.format(funnel_job_id), 'INFO')
+        return semaphore_id
+
+    def prepare_semaphore(self, semaphore_id):
+        """Holds an existing semaphore by one count (see release_semaphore)"""
+        with self.hive_db.transaction():
+            row = self.hive_db.fetchone('SELECT local_jobs_counter + remote_jobs_counter FROM semaphore WHERE semaphore_id=?', (semaphore_id,))
+            if row is None:
+                raise SeedException('There is no semaphore {0}'.format(semaphore_id))
+            if row[0] <= 0:
+                raise SeedException('The semaphore {0} has already been released'.format(semaphore_id))
+            self.hive_db.increase_semaphore(semaphore_id, 1)
+        return semaphore_id
+
+    def release_semaphore(self, semaphore_id):
+        """Removes the count added by prepare_funnel / prepare_semaphore, which
+        releases the funnel if no fans were created or they all have completed"""
+        with self.hive_db.transaction():
+            self.hive_db.decrease_semaphore(semaphore_id, 1)
+
+    def store_batch(self, input_ids, semaphore_id):
+        """Creates the jobs of a batch of stringified input_ids in a single
+        transaction. Returns the number of jobs created"""
+        with self.hive_db.transaction():
+            self.hive_db.execute('DELETE FROM seed_input_id')
+            rows = [(self.hive_db.store_input_id(i),) for i in input_ids]
+            self.hive_db.dbh.executemany('INSERT OR IGNORE INTO seed_input_id (input_id) VALUES (?)', rows)
+            n_jobs = self.hive_db.execute('''INSERT INTO job (analysis_id, input_id, status, controlled_semaphore_id)
+                                             SELECT ?, s.input_id, 'READY', ? FROM seed_input_id s
+                                             WHERE NOT EXISTS (SELECT 1 FROM job j WHERE j.input_id=s.input_id AND j.param_id_stack='' AND j.accu_id_stack='' AND j.analysis_id=?)
+                                             ORDER BY s.rowid''', (self.analysis.analysis_id, semaphore_id, self.analysis.analysis_id)).rowcount
+            self.hive_db.count_new_jobs(self.analysis.analysis_id, 'READY', n_jobs)
+            if semaphore_id is not None:
+                self.hive_db.increase_semaphore(semaphore_id, n_jobs)
+        return n_jobs
+
+    def seed(self, input_ids, funnel_logic_name=None, funnel_input_id=None, semaphore_id=None):
+        """Creates the jobs of the (stringified) input_ids, optionally as the
+        fans of a funnel or of an existing semaphore. Returns the numbers of
+        input_ids read and of jobs created"""
+        if funnel_logic_name is not None:
+            semaphore_id = self.prepare_funnel(funnel_logic_name, funnel_input_id or '{}')
+        elif semaphore_id is not None:
+            self.prepare_semaphore(semaphore_id)
+        (n_read, n_stored) = (0, 0)
+        input_ids = iter(input_ids)
+        try:
+            while True:
+                batch = list(itertools.islice(input_ids, self.batch_size))
+                if not batch:
+                    break
+                n_read += len(batch)
+                n_stored += self.store_batch(batch, semaphore_id)
+        finally:
+            if semaphore_id is not None:
+                self.release_semaphore(semaphore_id)
+        return {'read': n_read, 'stored': n_stored, 'duplicates': n_read - n_stored, 'semaphore_id': semaphore_id}
+
+
+def main(argv):
+    """Entry point of "wrapper seed". Returns the exit status"""
+    parser = argparse.ArgumentParser(prog='wrapper seed', description='Creates jobs in bulk in a SQLite hive database, skipping the existing ones')
+    parser.add_argument('url', help='URL of the hive database, e.g. sqlite:///my_hive.db')
+    parser.add_argument('--analyses-pattern', required=True, help='logic_name or analysis_id of the analysis to seed')
+    parser.add_argument('--input-file', default='-', help='File with one input_id per line, either stringified or in JSON ("-" for the standard input)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Number of input_ids inserted per transaction')
+    parser.add_argument('--funnel-logic-name', help='Make the new jobs the fans of a funnel job of this analysis')
+    parser.add_argument('--funnel-input-id', default='{}', help='input_id of the funnel job')
+    parser.add_argument('--semaphore-id', type=int, help='Make the new jobs the fans of this existing semaphore')
+    args = parser.parse_args(argv)
+    if args.funnel_logic_name is not None and args.semaphore_id is not None:
+        parser.error('--funnel-logic-name and --semaphore-id are mutually exclusive')
+
+    fh = sys.stdin if args.input_file == '-' else open(args.input_file)
+    try:
+        seeder = JobSeeder(args.url, args.analyses_pattern, args.batch_size)
+        counts = seeder.seed(read_input_ids(fh), args.funnel_logic_name, args.funnel_input_id, args.semaphore_id)
+    except (SeedException, WorkerException) as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+    print('{0} jobs created in {1} ({2} input_ids read, {3} duplicates){4}'.format(
+        counts['stored'], seeder.analysis.logic_name, counts['read'], counts['duplicates'],
+        ', controlling semaphore {0}'.format(counts['semaphore_id']) if counts['semaphore_id'] is not None else ''), file=sys.stderr)
+    return 0
+
+
+class SeederTestCase(HiveDatabaseTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.fan_id = self.add_analysis('fan', 'eHive.examples.TestRunnable')
+        self.funnel_id = self.add_analysis('funnel', 'Bio::EnsEMBL::Hive::RunnableDB::Dummy', language=None)
+
+    def stats(self, analysis_id):
+        return self.dbc.fetchall('SELECT status, total_job_count, ready_job_count, semaphored_job_count FROM analysis_stats WHERE analysis_id=?', (analysis_id,))[0]
+
+    def test_read_input_ids(self):
+        lines = ['{"b" => 2, a => 1}', '', '# comment', '{"a": 1, "b": 2}', " { 'c' => [1,2] } "]
+        self.assertEqual(list(read_input_ids(lines)), ['{"a" => 1,"b" => 2}', '{"a" => 1,"b" => 2}', '{"c" => [1,2]}'])
+        self.assertRaisesRegex(SeedException, 'Line 2: .* is not a hash', list, read_input_ids(['{}', '[1]']))
+        self.assertRaisesRegex(SeedException, 'Line 1: .* cannot be parsed', list, read_input_ids(['{a:1}']))
+
+    def test_seed(self):
+        self.add_job(self.fan_id, {'alpha': 1})
+        seeder = JobSeeder(self.url, 'fan', batch_size=3)
+        input_ids = [stringify({'alpha': i}) for i in [3, 1, 2, 3, 4, 5, 6]] + [stringify({'long': 'x' * 300})] * 2
+        self.assertEqual(seeder.seed(input_ids), {'read': 9, 'stored': 6, 'duplicates': 3, 'semaphore_id': None})
+        self.assertEqual([r[0] for r in self.dbc.fetchall('SELECT input_id FROM job ORDER BY job_id')],
+                         ['{"alpha" => 1}', '{"alpha" => 3}', '{"alpha" => 2}', '{"alpha" => 4}', '{"alpha" => 5}', '{"alpha" => 6}', '_extended_data_id 1'])
+        self.assertEqual(self.stats(self.fan_id), ('LOADING', 7, 7, 0))
+        # Again: nothing new
+        self.assertEqual(JobSeeder(self.url, str(self.fan_id)).seed(input_ids)['stored'], 0)
+        self.assertRaises(SeedException, JobSeeder, self.url, 'f%')
+
+    def test_funnel(self):
+        seeder = JobSeeder(self.url, 'fan', batch_size=2)
+        counts = seeder.seed([stringify({'alpha': i}) for i in range(5)], 'funnel', '{"n" => 5}')
+        self.assertEqual(counts['stored'], 5)
+        self.assertEqual(self.dbc.fetchall('SELECT local_jobs_counter, dependent_job_id FROM semaphore'), [(5, 1)])
+        self.assertEqual(self.dbc.fetchall('SELECT status, controlled_semaphore_id FROM job WHERE job_id=1'), [('SEMAPHORED', None)])
+        self.assertEqual(self.dbc.fetchall('SELECT COUNT(*) FROM job WHERE controlled_semaphore_id=?', (counts['semaphore_id'],)), [(5,)])
+        self.assertEqual(self.stats(self.funnel_id), ('LOADING', 1, 0, 1))
+
+        # More fans for the same funnel, and for the semaphore directly
+        counts = seeder.seed([stringify({'alpha': i}) for i in range(3, 8)], 'funnel', '{"n" => 5}')
+        self.assertEqual((counts['stored'], counts['semaphore_id']), (3, 1))
+        counts = seeder.seed([stringify({'alpha': 10})], semaphore_id=1)
+        self.assertEqual(self.dbc.fetchall('SELECT local_jobs_counter FROM semaphore'), [(9,)])
+        self.assertEqual(self.dbc.fetchall("SELECT COUNT(*) FROM log_message WHERE msg LIKE 'Discovered and using an existing funnel%'"), [(1,)])
+
+        # The funnel is released when there are no fans
+        seeder.seed([], 'funnel', '{"n" => 0}')
+        self.assertEqual(self.dbc.fetchall("SELECT status FROM job WHERE input_id='{\"n\" => 0}'"), [('READY',)])
+        self.assertRaisesRegex(SeedException, 'already been released', seeder.seed, [], semaphore_id=2)
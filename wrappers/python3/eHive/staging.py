@@ -0,0 +1,242 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Host-level cache of input files staged from shared storage.
+
+Files are identified by their absolute path, modification time and size,
+and copied once per host into the cache directory, which is shared by all
+the workers of the host. Concurrent workers are synchronised with file
+locks. The cache is bounded in size and evicts the least recently used
+files. Staged files are hard-linked into the worker's directory when
+possible, so that evicting them does not affect running jobs.
+
+The cache directory is EHIVE_PYTHON_STAGING_DIR (default: a directory in
+the system's temporary directory) and its size is bounded by
+EHIVE_PYTHON_STAGING_MAX_SIZE (in bytes, default: unlimited).
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class StagingCache:
+    """Size-bounded LRU cache of files, shared between processes"""
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_copied': 0, 'evictions': 0}
+        os.makedirs(os.path.join(self.path, 'entries'), exist_ok=True)
+        os.makedirs(os.path.join(self.path, 'locks'), exist_ok=True)
+
+    @classmethod
+    def from_environment(cls):
+        """Returns a StagingCache configured from the environment"""
+        path = os.environ.get('EHIVE_PYTHON_STAGING_DIR') or os.path.join(tempfile.gettempdir(), 'ehive_staging_{0}'.format(os.getuid()))
+        max_size = os.environ.get('EHIVE_PYTHON_STAGING_MAX_SIZE')
+        return cls(path, int(max_size) if max_size else None)
+
+    @contextlib.contextmanager
+    def __lock(self, name, blocking=True):
+        """Exclusive lock on the file "name" in the locks directory. Yields
+        False if the lock could not be taken in non-blocking mode"""
+        with open(os.path.join(self.path, 'locks', name), 'a') as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def entry_key(self, source_path, st):
+        """Identifier of a version of a file"""
+        s = '{0}\0{1}\0{2}'.format(os.path.abspath(source_path), st.st_mtime_ns, st.st_size)
+        return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+    def stage(self, source_path, dest_dir=None):
+        """Returns the path of a local copy of "source_path", copying the file
+        into the cache if needed. If dest_dir is given, the copy is hard-linked
+        into it (falling back to the path in the cache on another filesystem).
+        Files that cannot fit in the cache are not staged at all."""
+        st = os.stat(source_path)
+        if self.max_size is not None and st.st_size > self.max_size:
+            return source_path
+        key = self.entry_key(source_path, st)
+        entry_dir = os.path.join(self.path, 'entries', key)
+        entry_path = os.path.join(entry_dir, os.path.basename(source_path))
+
+        with self.__lock(key + '.lock'):
+            if os.path.exists(entry_path):
+                hit = True
+                os.utime(entry_dir)
+            else:
+                hit = False
+                self.__make_room(st.st_size)
+                os.makedirs(entry_dir, exist_ok=True)
+                (fd, tmp_path) = tempfile.mkstemp(dir=entry_dir, prefix='.tmp.')
+                os.close(fd)
+                try:
+                    # shutil uses sendfile() on Linux, avoiding copies in user space
+                    shutil.copyfile(source_path, tmp_path)
+                    os.replace(tmp_path, entry_path)
+                except:
+                    os.unlink(tmp_path)
+                    raise
+            self.__record_stats(hit, 0 if hit else st.st_size)
+
+        if dest_dir is None:
+            return entry_path
+        dest_path = os.path.join(dest_dir, key, os.path.basename(source_path))
+        if not os.path.exists(dest_path):
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            try:
+                os.link(entry_path, dest_path)
+            except OSError:
+                return entry_path
+        return dest_path
+
+    def entries(self):
+        """List of (key, last-used time, size) of all the entries"""
+        entries = []
+        entries_dir = os.path.join(self.path, 'entries')
+        for key in os.listdir(entries_dir):
+            entry_dir = os.path.join(entries_dir, key)
+            try:
+                size = sum(os.stat(os.path.join(entry_dir, f)).st_size for f in os.listdir(entry_dir))
+                entries.append((key, os.stat(entry_dir).st_mtime, size))
+            except OSError:
+                # Being evicted by another process
+                pass
+        return entries
+
+    def __make_room(self, size):
+        """Evict the least recently used entries until "size" more bytes can
+        be added. Entries being copied (i.e. locked) are left alone"""
+        if self.max_size is None:
+            return
+        with self.__lock('global.lock'):
+            entries = sorted(self.entries(), key=lambda e: e[1])
+            total = sum(e[2] for e in entries)
+            for (key, _, entry_size) in entries:
+                if total + size <= self.max_size:
+                    break
+                with self.__lock(key + '.lock', blocking=False) as locked:
+                    if locked:
+                        shutil.rmtree(os.path.join(self.path, 'entries', key), ignore_errors=True)
+                        total -= entry_size
+                        self.stats['evictions'] += 1
+
+    def __record_stats(self, hit, bytes_copied):
+        """Update the counters of this instance and the host-wide ones"""
+        self.stats['hits' if hit else 'misses'] += 1
+        self.stats['bytes_copied'] += bytes_copied
+        stats_path = os.path.join(self.path, 'stats.json')
+        with self.__lock('global.lock'):
+            try:
+                with open(stats_path, 'r') as fh:
+                    host_stats = json.load(fh)
+            except (OSError, ValueError):
+                host_stats = {'hits': 0, 'misses': 0, 'bytes_copied': 0}
+            host_stats['hits' if hit else 'misses'] += 1
+            host_stats['bytes_copied'] += bytes_copied
+            with open(stats_path + '.tmp', 'w') as fh:
+                json.dump(host_stats, fh)
+            os.replace(stats_path + '.tmp', stats_path)
+
+    def host_stats(self):
+        """Returns the counters accumulated by all the workers of the host"""
+        try:
+            with open(os.path.join(self.path, 'stats.json'), 'r') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {'hits': 0, 'misses': 0, 'bytes_copied': 0}
+
+    @staticmethod
+    def hit_rate(stats):
+        """Fraction of the requests that were served from the cache"""
+        n = stats['hits'] + stats['misses']
+        return stats['hits'] / n if n else 0.
+
+
+class StagingCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.dir, 'source.fa')
+        with open(self.source, 'w') as fh:
+            fh.write('>seq\nACGT\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_hits_and_misses(self):
+        cache = StagingCache(os.path.join(self.dir, 'cache'))
+        p1 = cache.stage(self.source)
+        p2 = cache.stage(self.source)
+        self.assertEqual(p1, p2)
+        self.assertNotEqual(p1, self.source)
+        self.assertEqual(os.path.basename(p1), 'source.fa')
+        with open(p1, 'r') as fh:
+            self.assertEqual(fh.read(), '>seq\nACGT\n')
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+        self.assertEqual(cache.hit_rate(cache.host_stats()), .5)
+
+        # A modified file is a new entry
+        with open(self.source, 'a') as fh:
+            fh.write('ACGT\n')
+        os.utime(self.source, ns=(0, 0))
+        p3 = cache.stage(self.source)
+        self.assertNotEqual(p1, p3)
+        self.assertEqual(cache.stats['misses'], 2)
+
+    def test_hard_link(self):
+        cache = StagingCache(os.path.join(self.dir, 'cache'))
+        dest_dir = os.path.join(self.dir, 'worker')
+        p = cache.stage(self.source, dest_dir)
+        self.assertTrue(p.startswith(dest_dir))
+        self.assertEqual(os.stat(p).st_nlink, 2)
+
+    def test_eviction(self):
+        cache = StagingCache(os.path.join(self.dir, 'cache'), max_size=25)
+        sources = []
+        for i in range(3):
+            sources.append(os.path.join(self.dir, 'f%d' % i))
+            with open(sources[-1], 'w') as fh:
+                fh.write('0123456789')
+        cache.stage(sources[0])
+        cache.stage(sources[1])
+        # Make f1 the least recently used one
+        os.utime(os.path.join(cache.path, 'entries', cache.entry_key(sources[1], os.stat(sources[1]))), (1000, 1000))
+        cache.stage(sources[2])
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertEqual(len(cache.entries()), 2)
+        cache.stage(sources[0])
+        self.assertEqual(cache.stats['hits'], 1)
+        # Too big to be staged
+        with open(sources[0], 'w') as fh:
+            fh.write('0' * 30)
+        self.assertEqual(cache.stage(sources[0]), sources[0])
@@ -0,0 +1,178 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Execution of a Runnable in the current process, without Perl nor database.
+
+    wrapper standalone <module_name> [--input-id JSON] [--param name=value ...]
+                       [--repeat N] [--warm-up N] [--profile] [--memory] ...
+
+runs the full life-cycle of a job with the same machinery as testRunnable.
+The events (dataflows, warnings, failure) are printed on the standard
+output as JSON lines, everything the Runnable prints goes to the standard
+error, as well as the timing / memory summary.
+"""
+
+import argparse
+import contextlib
+import json
+import sys
+import tempfile
+import unittest
+
+from .profiling import StepProfiler
+from .tests import testRunnable, CallbackEvents, DataflowEvent, WarningEvent, CompleteEarlyEvent, FailureEvent
+from .utils import find_module
+
+
+def parse_param(arg):
+    """Parses "name=value". The value is decoded as JSON if possible, and kept as a string otherwise"""
+    (name, sep, value) = arg.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError('"{0}" is not of the form name=value'.format(arg))
+    try:
+        return (name, json.loads(value))
+    except ValueError:
+        return (name, value)
+
+
+def event_as_dict(event):
+    """JSON-friendly representation of the events emitted by the Runnable"""
+    if isinstance(event, DataflowEvent):
+        return {'event': 'DATAFLOW', 'branch_name_or_code': event.branch_name_or_code, 'output_ids': event.output_ids}
+    if isinstance(event, WarningEvent):
+        return {'event': 'WARNING', 'message': event.message, 'is_error': event.is_error}
+    if isinstance(event, CompleteEarlyEvent):
+        return {'event': 'COMPLETE_EARLY', 'message': event.message}
+    return {'event': 'FAILURE', 'exception': event.exception.__name__, 'args': list(event.args)}
+
+
+def run_standalone(runnable_class, parameters, output=sys.stdout, repeat=1, warm_up=0, trace_malloc=False, profiler=None, no_write=False, is_retry=False, debug=0):
+    """Runs the job warm_up + repeat times and writes the events of the first
+    run to "output". Returns the statistics given by testRunnable and whether
+    the job failed"""
+    runs = []
+    failed = []
+    def new_run():
+        runs.append(None)
+        return [CallbackEvents(on_event)]
+    def on_event(event):
+        if isinstance(event, FailureEvent):
+            failed.append(event)
+        if len(runs) == 1:
+            output.write(json.dumps(event_as_dict(event), default=repr) + "\n")
+    config = {
+        'repeat': repeat,
+        'warm_up': warm_up,
+        'trace_malloc': trace_malloc,
+        'no_write': no_write,
+        'is_retry': is_retry,
+        'debug': debug,
+    }
+    if profiler is not None:
+        config['profiler'] = profiler
+    # The Runnable's own output must not be mixed with the events
+    with contextlib.redirect_stdout(sys.stderr):
+        statistics = testRunnable(unittest.TestCase(), runnable_class, parameters, new_run, config)
+    return (statistics, bool(failed))
+
+
+def format_statistics(statistics):
+    """Text table of the median of each measure, per step"""
+    measures = [m for m in ['wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'peak_rss_delta_mb', 'tracemalloc_peak_mb', 'events'] if m in statistics['total']]
+    lines = ['{0:<16}'.format('step') + ''.join('{0:>20}'.format(m) for m in measures)]
+    for (step, step_statistics) in statistics.items():
+        lines.append('{0:<16}'.format(step) + ''.join('{0:>20.6g}'.format(step_statistics[m]['p50']) for m in measures))
+    n_runs = statistics['total']['wall_seconds']['n']
+    if n_runs > 1:
+        total = statistics['total']['wall_seconds']
+        lines.append('{0} runs: min {1:.6g}s, p90 {2:.6g}s, max {3:.6g}s'.format(n_runs, total['min'], total['p90'], total['max']))
+    return "\n".join(lines)
+
+
+def main(argv):
+    """Entry point of "wrapper standalone". Returns the exit status"""
+    parser = argparse.ArgumentParser(prog='wrapper standalone', description='Runs a Runnable in the current process and prints its events as JSON lines')
+    parser.add_argument('module_name', help='Name of the Runnable module, e.g. eHive.examples.LongMult.DigitFactory')
+    parser.add_argument('--input-id', default='{}', help='Parameters of the job, as a JSON dictionary')
+    parser.add_argument('--param', action='append', type=parse_param, default=[], metavar='NAME=VALUE', help='Extra parameter (overrides --input-id). The value is parsed as JSON if possible')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of measured runs')
+    parser.add_argument('--warm-up', type=int, default=0, help='Number of runs before the measured ones')
+    parser.add_argument('--no-write', action='store_true', help='Skip write_output')
+    parser.add_argument('--retry', action='store_true', help='Run the job as a retry (i.e. run pre_cleanup)')
+    parser.add_argument('--debug', type=int, default=0, help='Debug level')
+    parser.add_argument('--profile', action='store_true', help='Profile the steps (last run) and print the hottest functions')
+    parser.add_argument('--profile-output', help='Save the profile in this file, in the pstats format')
+    parser.add_argument('--profile-top', type=int, default=15, help='Number of functions listed per step')
+    parser.add_argument('--memory', action='store_true', help='Also report the peak of the Python memory allocations (slower)')
+    parser.add_argument('--stats-output', help='Save the statistics in this file, in JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        parameters = json.loads(args.input_id)
+    except ValueError as e:
+        parser.error('--input-id is not valid JSON: {0}'.format(e))
+    if not isinstance(parameters, dict):
+        parser.error('--input-id must be a JSON dictionary')
+    parameters.update(args.param)
+
+    runnable_class = find_module(args.module_name)
+    profiler = StepProfiler() if (args.profile or args.profile_output) else None
+    (statistics, failed) = run_standalone(runnable_class, parameters, sys.stdout, args.repeat, args.warm_up, args.memory, profiler, args.no_write, args.retry, args.debug)
+    sys.stdout.flush()
+
+    print(format_statistics(statistics), file=sys.stderr)
+    if profiler is not None and profiler.profiles:
+        if args.profile:
+            print(profiler.summary(args.profile_top), file=sys.stderr)
+        if args.profile_output:
+            profiler.dump(args.profile_output)
+    if args.stats_output:
+        with open(args.stats_output, 'w') as fh:
+            json.dump(statistics, fh, indent=2)
+    return 1 if failed else 0
+
+
+class StandaloneTestCase(unittest.TestCase):
+
+    def test_run_standalone(self):
+        from .examples.LongMult.DigitFactory import DigitFactory
+        with tempfile.TemporaryFile('w+') as output:
+            (statistics, failed) = run_standalone(DigitFactory, {'b_multiplier': 9650, 'take_time': 0}, output, repeat=2, trace_malloc=True, profiler=StepProfiler())
+            output.seek(0)
+            events = [json.loads(l) for l in output]
+        self.assertFalse(failed)
+        # Only the events of the first run are printed
+        self.assertEqual([e['event'] for e in events], ['DATAFLOW', 'WARNING'])
+        self.assertEqual(sorted(o['digit'] for o in events[0]['output_ids']), ['5', '6', '9'])
+        self.assertEqual(statistics['total']['events']['n'], 2)
+        self.assertIn('tracemalloc_peak_mb', statistics['run'])
+        self.assertIn('2 runs', format_statistics(statistics))
+
+    def test_failure(self):
+        from .examples.LongMult.DigitFactory import DigitFactory
+        with tempfile.TemporaryFile('w+') as output:
+            (_, failed) = run_standalone(DigitFactory, {'take_time': 0}, output)
+            output.seek(0)
+            events = [json.loads(l) for l in output]
+        self.assertTrue(failed)
+        self.assertEqual(events[0]['event'], 'FAILURE')
+
+    def test_parse_param(self):
+        self.assertEqual(parse_param('a=3'), ('a', 3))
+        self.assertEqual(parse_param('a=[1, "x"]'), ('a', [1, 'x']))
+        self.assertEqual(parse_param('a=b=c'), ('a', 'b=c'))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_param('a')
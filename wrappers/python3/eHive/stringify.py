@@ -0,0 +1,256 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Python counterparts of stringify() and destringify() of
+Bio::EnsEMBL::Hive::Utils, i.e. how eHive stores structures (input_ids,
+parameters, accumulated values, etc) in the database.
+
+stringify() gives the same text as Perl's Data::Dumper configuration, e.g.
+{"a" => 1,"b" => [2,"x"]}, so that jobs created from Python are detected
+as duplicates of the ones created from Perl. destringify() parses the Perl
+literals that stringify() (and people writing PipeConfigs) produce:
+hashes, arrays, single- and double-quoted strings, numbers and undef. It
+does not evaluate arbitrary Perl code.
+"""
+
+import re
+import unittest
+
+
+class DestringifyException(ValueError):
+    """Raised when a string cannot be parsed as a Perl literal"""
+    pass
+
+
+# Data::Dumper only leaves unquoted the integers that fit in 32 bits
+_DUMPER_NUMBER_REGEX = re.compile(r'^(?:0|-?[1-9]\d{0,8})$')
+
+_QQ_ESCAPES = {'\a': '\\a', '\b': '\\b', '\t': '\\t', '\n': '\\n', '\f': '\\f', '\r': '\\r', '\x1b': '\\e'}
+
+
+def _perl_number(value):
+    """How Perl prints a number"""
+    if isinstance(value, float):
+        if value != value:
+            return 'NaN'
+        if value in (float('inf'), float('-inf')):
+            return 'Inf' if value > 0 else '-Inf'
+        if value == int(value) and abs(value) < 1e15:
+            return str(int(value))
+        return '%.15g' % value
+    return str(value)
+
+
+def _qquote(s):
+    """Double-quoted string, as Data::Dumper::qquote()"""
+    s = re.sub(r'([\\"@$])', r'\\\1', s)
+    s = re.sub(r'[^\x00-\x7f]', lambda m: '\\x{%x}' % ord(m.group(0)), s)
+    if re.search(r'[\x00-\x1f\x7f]', s):
+        s = re.sub(r'[\a\b\t\n\f\r\x1b]', lambda m: _QQ_ESCAPES[m.group(0)], s)
+        # Short octal escapes unless followed by a digit
+        s = re.sub(r'[\x00-\x1f](?!\d)', lambda m: '\\%o' % ord(m.group(0)), s)
+        s = re.sub(r'[\x00-\x1f\x7f]', lambda m: '\\%03o' % ord(m.group(0)), s)
+    return '"' + s + '"'
+
+
+def _scalar(value):
+    if not isinstance(value, str):
+        value = _perl_number(value)
+    if _DUMPER_NUMBER_REGEX.match(value):
+        return value
+    return _qquote(value)
+
+
+def stringify(structure):
+    """Perl representation of the structure, as
+    Bio::EnsEMBL::Hive::Utils::stringify(): sorted keys, no indentation"""
+    if structure is None:
+        return 'undef'
+    if isinstance(structure, bool):
+        return '1' if structure else '0'
+    if isinstance(structure, dict):
+        # Perl sorts the keys as strings
+        items = sorted((str(k) if not isinstance(k, str) else k, v) for (k, v) in structure.items())
+        return '{' + ','.join(_qquote(k) + ' => ' + stringify(v) for (k, v) in items) + '}'
+    if isinstance(structure, (list, tuple)):
+        return '[' + ','.join(stringify(v) for v in structure) + ']'
+    return _scalar(structure)
+
+
+# Same tests as in Bio::EnsEMBL::Hive::Utils::destringify()
+_LOOKS_LIKE_NUMBER_REGEX = re.compile(r'^\s*[-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?|0[xX][0-9a-fA-F]+)\s*$')
+_LITERAL_REGEX = re.compile(r'^(?:".*"|\'.*\'|\{.*\}|\[.*\])$', re.DOTALL)
+
+_TOKEN_REGEX = re.compile(r'''
+    \s*(?:
+        (?P<punct>=>|[{}\[\],])
+      | (?P<number>[-+]?(?:0[xX][0-9a-fA-F]+|(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][-+]?\d+)?))
+      | "(?P<dq>(?:[^"\\]|\\.)*)"
+      | '(?P<sq>(?:[^'\\]|\\.)*)'
+      | (?P<word>-?[A-Za-z_]\w*)
+    )''', re.VERBOSE | re.DOTALL)
+
+_DQ_ESCAPE_REGEX = re.compile(r'\\(?:x\{([0-9a-fA-F]*)\}|x([0-9a-fA-F]{0,2})|([0-7]{1,3})|(.))', re.DOTALL)
+_DQ_SIMPLE_ESCAPES = {'a': '\a', 'b': '\b', 't': '\t', 'n': '\n', 'f': '\f', 'r': '\r', 'e': '\x1b'}
+
+
+def _unescape_dq(s):
+    def repl(m):
+        (hex_braces, hex_short, octal, char) = m.groups()
+        if hex_braces is not None:
+            return chr(int(hex_braces or '0', 16))
+        if hex_short is not None:
+            return chr(int(hex_short or '0', 16))
+        if octal is not None:
+            return chr(int(octal, 8))
+        return _DQ_SIMPLE_ESCAPES.get(char, char)
+    return _DQ_ESCAPE_REGEX.sub(repl, s)
+
+
+def _unescape_sq(s):
+    return re.sub(r"\\([\\'])", r'\1', s)
+
+
+def _parse_number(text):
+    text = text.replace('_', '')
+    sign = -1 if text.startswith('-') else 1
+    digits = text.lstrip('+-')
+    if digits[:2] in ('0x', '0X'):
+        return sign * int(digits[2:], 16)
+    if re.match(r'^\d+$', digits):
+        # Perl reads the integer literals with a leading 0 as octal
+        if len(digits) > 1 and digits.startswith('0'):
+            return sign * int(digits, 8)
+        return sign * int(digits)
+    return sign * float(digits)
+
+
+class _PerlLiteralParser:
+    """Recursive-descent parser of Perl literals"""
+
+    def __init__(self, text):
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = _TOKEN_REGEX.match(text, pos)
+            if not m or m.end() == pos:
+                raise DestringifyException("Cannot parse '{0}' at position {1}".format(text, pos))
+            self.tokens.append(m)
+            pos = m.end()
+        self.i = 0
+
+    def peek(self):
+        return self.tokens[self.i] if self.i < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise DestringifyException('Unexpected end of the string')
+        self.i += 1
+        return token
+
+    def is_punct(self, token, punct):
+        return token is not None and token.group('punct') == punct
+
+    def parse(self):
+        value = self.value()
+        if self.peek() is not None:
+            raise DestringifyException("Unexpected '{0}'".format(self.peek().group(0).strip()))
+        return value
+
+    def value(self):
+        token = self.next()
+        punct = token.group('punct')
+        if punct == '{':
+            return self.sequence('}', True)
+        if punct == '[':
+            return self.sequence(']', False)
+        if punct is not None:
+            raise DestringifyException("Unexpected '{0}'".format(punct))
+        if token.group('number') is not None:
+            return _parse_number(token.group('number'))
+        if token.group('dq') is not None:
+            return _unescape_dq(token.group('dq'))
+        if token.group('sq') is not None:
+            return _unescape_sq(token.group('sq'))
+        word = token.group('word')
+        if word == 'undef':
+            return None
+        # Barewords are only allowed before "=>"
+        if self.is_punct(self.peek(), '=>'):
+            return word
+        raise DestringifyException("Bareword '{0}' not allowed".format(word))
+
+    def sequence(self, closing, is_hash):
+        # In Perl, hashes are lists too: "=>" and "," are the same
+        items = []
+        while True:
+            token = self.peek()
+            if self.is_punct(token, closing):
+                self.next()
+                break
+            if self.is_punct(token, ',') or self.is_punct(token, '=>'):
+                self.next()
+                continue
+            items.append(self.value())
+        if not is_hash:
+            return items
+        if len(items) % 2:
+            raise DestringifyException('Odd number of elements in hash')
+        return {(k if isinstance(k, str) else _perl_number(k) if k is not None else ''): v for (k, v) in zip(items[0::2], items[1::2])}
+
+
+def destringify(value):
+    """Parses a value stored by eHive, as
+    Bio::EnsEMBL::Hive::Utils::destringify(): strings that look like Perl
+    literals are evaluated, other strings are returned as they are"""
+    if not isinstance(value, str):
+        return value
+    if _LITERAL_REGEX.match(value) or _LOOKS_LIKE_NUMBER_REGEX.match(value) or value == 'undef':
+        try:
+            return _PerlLiteralParser(value).parse()
+        except DestringifyException:
+            # Like a failed eval() in Perl
+            return None
+    return value
+
+
+class StringifyTestCase(unittest.TestCase):
+
+    def test_stringify(self):
+        self.assertEqual(stringify({'b': 'x', 'a': 1, 'c': None}), '{"a" => 1,"b" => "x","c" => undef}')
+        self.assertEqual(stringify([1, -3, 1.5, 2.0, 1234567890, '007', '']), '[1,-3,"1.5",2,"1234567890","007",""]')
+        self.assertEqual(stringify({'k': {}, 'l': [], 'n': [{'x': [True, False]}]}), '{"k" => {},"l" => [],"n" => [{"x" => [1,0]}]}')
+        self.assertEqual(stringify({10: 'a', 9: 'b'}), '{"10" => "a","9" => "b"}')
+        self.assertEqual(stringify('a"b$c@d\\e\nf\x01g\x012\xe9'), '"a\\"b\\$c\\@d\\\\e\\nf\\1g\\0012\\x{e9}"')
+        self.assertEqual(stringify(0.1 + 0.2), '"0.3"')
+
+    def test_destringify(self):
+        self.assertEqual(destringify('{"a" => 1,"b" => "x","c" => undef}'), {'a': 1, 'b': 'x', 'c': None})
+        self.assertEqual(destringify("{ 'a' => [1, 2.5, -3,], b => 'it\\'s', 'c', \"d\" }"), {'a': [1, 2.5, -3], 'b': "it's", 'c': 'd'})
+        self.assertEqual(destringify('"a\\"b\\$c\\@d\\\\e\\nf\\1g\\0012\\x{e9}"'), 'a"b$c@d\\e\nf\x01g\x012\xe9')
+        self.assertEqual(destringify('42'), 42)
+        self.assertEqual(destringify(' 1e3 '), 1000.0)
+        self.assertEqual(destringify('undef'), None)
+        self.assertEqual(destringify('plain text'), 'plain text')
+        self.assertEqual(destringify('#param#'), '#param#')
+        self.assertEqual(destringify('{not perl}'), None)
+        self.assertEqual(destringify(None), None)
+
+    def test_round_trip(self):
+        for structure in [{}, [], {'a': [1, {'b': None}], 'c': 'x y "z"'}, ['\t\x00\u20ac', -7, 'undef', '1.50']]:
+            self.assertEqual(destringify(stringify(structure)), structure)
@@ -19,12 +19,15 @@ All testing functions, e.g. how to test a Runnable
 """
 
 import collections
+import contextlib
+import json
 import tempfile
 import shutil
 import traceback
 
 from .params import ParamContainer
 from .process import Job, CompleteEarlyException
+from .resources import ResourceMeter
 from .utils import find_module
 
 # The events that can be emitted during the execution of a job
@@ -34,6 +37,190 @@ CompleteEarlyEvent = collections.namedtuple('CompleteEarlyEvent', ['message'])
 FailureEvent = collections.namedtuple('FailureEvent', ['exception', 'args'])
 
 
+class EventMatcher:
+    """Base class of the objects that can be put in the list of expected
+    events of testRunnable to match a run of consecutive events at once.
+    Matchers are reset before every run of the job."""
+
+    def reset(self):
+        """Forget the events matched so far"""
+        raise NotImplementedError()
+
+    def accepts(self, event):
+        """Tells whether the event belongs to this matcher (and not to the next expected event)"""
+        raise NotImplementedError()
+
+    def consume(self, testcase, event):
+        """Check an accepted event"""
+        raise NotImplementedError()
+
+    def missing(self):
+        """Description of what has not been matched yet, or None if the matcher is complete"""
+        raise NotImplementedError()
+
+
+def _event_key(event):
+    """Hashable representation of an event"""
+    try:
+        return (type(event).__name__, json.dumps(list(event), sort_keys=True, default=repr))
+    except TypeError:
+        # e.g. dictionaries with keys of different types
+        return (type(event).__name__, repr(event))
+
+
+class UnorderedEvents(EventMatcher):
+    """Matches the given events in any order, e.g. the dataflow of a factory
+    whose order is not guaranteed. Duplicated events must be emitted as many
+    times as they are listed"""
+
+    def __init__(self, events):
+        self.expected = collections.Counter(_event_key(e) for e in events)
+        self.reset()
+
+    def reset(self):
+        self.remaining = self.expected.copy()
+
+    def accepts(self, event):
+        return self.remaining[_event_key(event)] > 0
+
+    def consume(self, testcase, event):
+        self.remaining[_event_key(event)] -= 1
+
+    def missing(self):
+        n = sum(self.remaining.values())
+        if not n:
+            return None
+        example = next(k for (k, c) in self.remaining.items() if c > 0)
+        return '{0} unordered events have not been emitted, e.g. {1}{2}'.format(n, *example)
+
+
+class CountEvents(EventMatcher):
+    """Matches exactly n consecutive events of a given type (and branch for
+    DataflowEvent) without storing them. Optionally, each event has to
+    satisfy a predicate, and / or one event every sample_every is compared
+    to expected(i), i being the index of the event in the run (from 0)"""
+
+    def __init__(self, n, event_type=DataflowEvent, branch_name_or_code=None, predicate=None, expected=None, sample_every=1):
+        self.n = n
+        self.event_type = event_type
+        self.branch_name_or_code = branch_name_or_code
+        self.predicate = predicate
+        self.expected = expected
+        self.sample_every = sample_every
+        self.reset()
+
+    def reset(self):
+        self.seen = 0
+
+    def accepts(self, event):
+        if self.seen >= self.n or not isinstance(event, self.event_type):
+            return False
+        return self.branch_name_or_code is None or event.branch_name_or_code == self.branch_name_or_code
+
+    def consume(self, testcase, event):
+        i = self.seen
+        self.seen += 1
+        if self.predicate is not None:
+            testcase.assertTrue(self.predicate(event), msg='Event #{0} of the run does not satisfy the predicate: {1}'.format(i, event))
+        if self.expected is not None and i % self.sample_every == 0:
+            testcase.assertEqual(event, self.expected(i), msg='Sampled event #{0} of the run'.format(i))
+
+    def missing(self):
+        if self.seen == self.n:
+            return None
+        branch = '' if self.branch_name_or_code is None else ' on branch {0}'.format(self.branch_name_or_code)
+        return 'Only {0} {1}{2} have been emitted out of {3}'.format(self.seen, self.event_type.__name__, branch, self.n)
+
+
+class OrderedEvents(EventMatcher):
+    """Matches a sequence of events in order, optionally restricted to the
+    dataflow on a given branch (to be combined with InterleavedEvents).
+    "events" can be a list or a function that returns a new iterable (e.g.
+    a generator function) so that the sequence is never held in memory"""
+
+    _end = object()
+
+    def __init__(self, events, branch_name_or_code=None):
+        self.events = events
+        self.branch_name_or_code = branch_name_or_code
+        self.reset()
+
+    def reset(self):
+        self.iterator = iter(self.events() if callable(self.events) else self.events)
+        self.next_event = next(self.iterator, self._end)
+        self.seen = 0
+
+    def accepts(self, event):
+        if self.next_event is self._end:
+            return False
+        return self.branch_name_or_code is None or (isinstance(event, DataflowEvent) and event.branch_name_or_code == self.branch_name_or_code)
+
+    def consume(self, testcase, event):
+        testcase.assertEqual(event, self.next_event, msg='Event #{0} of the sequence'.format(self.seen))
+        self.seen += 1
+        self.next_event = next(self.iterator, self._end)
+
+    def missing(self):
+        if self.next_event is self._end:
+            return None
+        return 'Only {0} events of the sequence have been emitted. Next expected event: {1}'.format(self.seen, self.next_event)
+
+
+class InterleavedEvents(EventMatcher):
+    """Combines several matchers whose events may be interleaved, e.g. one
+    per dataflow branch. Each event is given to the first matcher that
+    accepts it"""
+
+    def __init__(self, *matchers):
+        self.matchers = matchers
+
+    def reset(self):
+        for m in self.matchers:
+            m.reset()
+
+    def accepts(self, event):
+        return any(m.accepts(event) for m in self.matchers)
+
+    def consume(self, testcase, event):
+        next(m for m in self.matchers if m.accepts(event)).consume(testcase, event)
+
+    def missing(self):
+        missing = [m.missing() for m in self.matchers]
+        missing = [m for m in missing if m is not None]
+        return ' '.join(missing) if missing else None
+
+
+class CallbackEvents(EventMatcher):
+    """Accepts all the remaining events and passes them to callback(event)
+    instead of checking them. Used to run Runnables outside of tests"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def reset(self):
+        pass
+
+    def accepts(self, event):
+        return True
+
+    def consume(self, testcase, event):
+        self.callback(event)
+
+    def missing(self):
+        return None
+
+
+# Performance budgets that can be given in the configuration of testRunnable,
+# and the measure they apply to
+PERFORMANCE_BUDGETS = collections.OrderedDict([
+    ('max_wall_seconds', 'wall_seconds'),
+    ('max_cpu_seconds', 'cpu_seconds'),
+    ('max_peak_rss_delta_mb', 'peak_rss_delta_mb'),
+    ('max_tracemalloc_peak_mb', 'tracemalloc_peak_mb'),
+    ('max_events', 'events'),
+])
+
+
 def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=None):
     """Method to test a Runnable
 
@@ -42,12 +229,19 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
         runnableClass: Runnable being tested. Can be a string of the actual type.
         inputParameters: dictionary of input parameters. Will override the Runnable's
                          param_defaults() dictionary.
-        refEvents: list of "events" the Runnable is expected to raise (in the right
-                   order). Accepted events are
+        refEvents: list or iterable (e.g. a generator) of "events" the Runnable is
+                   expected to raise (in the right order). Accepted events are
                    - WarningEvent.
                    - DataflowEvent.
                    - CompleteEarlyEvent.
                    - FailureEvent.
+                   - EventMatcher objects (UnorderedEvents, CountEvents,
+                     OrderedEvents, InterleavedEvents) to match a run of
+                     events at once.
+                   The iterable is consumed as the events are emitted, so that
+                   large fan-outs can be tested in constant memory. With the
+                   "repeat" and "warm_up" options, refEvents must be a list or a
+                   function returning a new iterable.
         config: extra configuration options, given as a dictionary. Accepted keys are
                 - is_retry: bool or int, default False.
                             whether the job is considered a retry (i.e.  whether
@@ -59,6 +253,17 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
                               of the run.
                 - debug: int, default 0.
                          the debug level.
+                - checkpoint_dir: str, default EHIVE_PYTHON_CHECKPOINT_DIR.
+                                  directory of the checkpoints, e.g. shared
+                                  between a failing run and its retry.
+                - connected_branches: list, default not set.
+                                      branches that have dataflow rules (see
+                                      is_branch_connected). By default, all
+                                      the branches are connected.
+                - db_pool: eHive.db.ConnectionPool, default not set.
+                           pool that serves self.db_connection(), shared between
+                           the runs. By default, every run has its own pool,
+                           closed at the end of the run.
                 - test_autoflow: bool, default not set.
                                  when set, check that this is the final value of the
                                  job's autoflow attribute.
@@ -68,6 +273,33 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
                 - test_transient_error: bool, default not set.
                                         when set, check that this is the final value
                                         of the job's lethal_for_worker attribute.
+                - max_wall_seconds, max_cpu_seconds, max_peak_rss_delta_mb,
+                  max_tracemalloc_peak_mb, max_events:
+                        number or dictionary, default not set.
+                        performance budgets. A number applies to the whole job, a
+                        dictionary maps step names (e.g. "run") or "total" to
+                        their budget. The CPU time includes the child processes.
+                        The peak RSS is the high-water mark of the whole (testing)
+                        process, so the memory budget applies to how much the
+                        run raises it. max_tracemalloc_peak_mb requires
+                        trace_malloc. With repeats, the median is checked.
+                - repeat: int, default 1.
+                          number of times the job is run and measured.
+                - warm_up: int, default 0.
+                           number of runs done before the measured ones.
+                - trace_malloc: bool, default False.
+                                whether to add the peak of the Python memory
+                                allocations (tracemalloc_peak_mb) to the measures.
+                - profiler: eHive.profiling.StepProfiler, default not set.
+                            profiler the steps are run under (the profile of
+                            the last run is kept).
+
+    Returns:
+        The timing statistics of the measured runs, as a dictionary
+        {step or "total": {measure: statistics}}, where the measures are
+        wall_seconds, cpu_seconds, peak_rss_mb, peak_rss_delta_mb, events (and
+        tracemalloc_peak_mb if requested), and the statistics
+        are given by eHive.benchmarks.summarize (min, mean, p50, p90, etc).
     """
 
     # Find the actual class (type)
@@ -82,13 +314,18 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
             self.__configure()
             self.__job_life_cycle()
             self.__final_tests()
+            return self.__measures()
 
         def __configure(self):
             """Initialise all the parameters the Runnable may need"""
 
             # Copy all the input parameters in the class instance itself
             self.__config = config or {}
-            self.__refEvents = refEvents.copy()  # Don't modify the original list
+            self.__refEvents = iter(refEvents() if callable(refEvents) else refEvents)
+            self.__current_matcher = None
+            self.__resource_meter = ResourceMeter(self.__config.get('trace_malloc', False))
+            self.__event_counts = collections.Counter()
+            self.__current_step = None
 
             # Build the parameter hash
             paramsDict = {}
@@ -97,11 +334,23 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
             params = ParamContainer(paramsDict)
             self._BaseRunnable__params = params
 
+            # The staging cache and the database connections are set up on
+            # demand, and there is no tracing
+            from .checkpoint import CheckpointStore
+            if 'checkpoint_dir' in self.__config:
+                self._BaseRunnable__checkpoint_store = CheckpointStore(self.__config['checkpoint_dir'])
+            else:
+                self._BaseRunnable__checkpoint_store = CheckpointStore.from_environment()
+            self._BaseRunnable__staging_cache = None
+            self._BaseRunnable__tracer = None
+            self._BaseRunnable__db_pool = self.__config.get('db_pool')
+
             # Build the Job object
             job = Job()
             job.dbID = None
             job.input_id = str(inputParameters)  # FIXME: this should be a Perl stringification, not a Python one
             job.retry_count = int(self.__config.get('is_retry', False))
+            job.hive_pipeline_url = None
             job.autoflow = True
             job.lethal_for_worker = False
             job.transient_error = True
@@ -110,7 +359,7 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
             self.debug = self.__config.get('debug', 0)
 
         def __job_life_cycle(self):
-            """Run the job's life cycle. This must match BaseRunnable.__job_life_cycle"""
+            """Run the job's life cycle. This must match BaseRunnable.run_job_life_cycle"""
 
             # Which methods should be run
             steps = ['fetch_input', 'run']
@@ -138,6 +387,14 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
             except Exception as e:
                 self.__handle_exception(e)
 
+            # Like in a worker, the database connections outlive the job
+            # only if they are shared with the next runs
+            if self._BaseRunnable__db_pool is not None:
+                if 'db_pool' in self.__config:
+                    self._BaseRunnable__db_pool.end_of_job()
+                else:
+                    self._BaseRunnable__db_pool.close_all()
+
             if not self.__config.get('no_cleanup'):
                 self.__cleanup_worker_temp_directory()
 
@@ -145,7 +402,12 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
             """Run the method (one of "fetch_input", "run", "write_output",
             etc) if defined in the Runnable."""
             if hasattr(self, method):
-                getattr(self, method)()
+                self.__current_step = method
+                with contextlib.ExitStack() as stack:
+                    stack.enter_context(self.__resource_meter.measure(method))
+                    if 'profiler' in self.__config:
+                        stack.enter_context(self.__config['profiler'].profile(method))
+                    getattr(self, method)()
 
         def __handle_exception(self, e):
             """Capture and check the Runnable's own exceptions whilst letting
@@ -159,7 +421,18 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
 
         def __final_tests(self):
             """Extra tests once the job has ended"""
-            testcase.assertFalse(self.__refEvents, msg='The job has now ended and {} events have not been emitted'.format(len(self.__refEvents)))
+            if self.__current_matcher is not None:
+                missing = self.__current_matcher.missing()
+                testcase.assertIsNone(missing, msg='The job has now ended. {0}'.format(missing))
+            n_missing = 0
+            for expected in self.__refEvents:
+                if isinstance(expected, EventMatcher):
+                    # Matchers may be satisfied without any events
+                    expected.reset()
+                    n_missing += 1 if expected.missing() is not None else 0
+                else:
+                    n_missing += 1
+            testcase.assertFalse(n_missing, msg='The job has now ended and {} events have not been emitted'.format(n_missing))
 
             # Job attributes that the Runnable could have set and we want to test
             for attr in ['autoflow', 'lethal_for_worker', 'transient_error']:
@@ -167,6 +440,21 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
                 if tattr in self.__config:
                     testcase.assertEqual(getattr(self.input_job, attr), self.__config[tattr], msg='Final value of {}'.format(attr))
 
+        def __measures(self):
+            """Performance measures of each step and of the whole job"""
+            measures = collections.OrderedDict()
+            for (step, usage) in list(self.__resource_meter.steps.items()) + [('total', self.__resource_meter.total())]:
+                measures[step] = {
+                    'wall_seconds': usage['wall_seconds'],
+                    'cpu_seconds': sum(usage[k] for k in ['user_cpu_seconds', 'sys_cpu_seconds', 'children_user_cpu_seconds', 'children_sys_cpu_seconds']),
+                    'peak_rss_mb': usage['peak_rss_kb'] / 1024.,
+                    'peak_rss_delta_mb': usage['peak_rss_delta_kb'] / 1024.,
+                    'events': self.__event_counts[step] if step != 'total' else sum(self.__event_counts.values()),
+                }
+                if 'tracemalloc_peak_kb' in usage:
+                    measures[step]['tracemalloc_peak_mb'] = usage['tracemalloc_peak_kb'] / 1024.
+            return measures
+
         # Overridden BaseRunnable interface
         ###################################
 
@@ -190,6 +478,10 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
             event = WarningEvent(message, is_error)
             self.__compare_next_event(event)
 
+        def is_branch_connected(self, branch_name_or_code):
+            """Whether the branch is listed in connected_branches"""
+            return self.__config.get('connected_branches') is None or branch_name_or_code in self.__config['connected_branches']
+
         def dataflow(self, output_ids, branch_name_or_code=1):
             """Test that the dataflow event generated is expected"""
             if branch_name_or_code == 1:
@@ -201,10 +493,58 @@ def testRunnable(testcase, runnableClass, inputParameters, refEvents, config=Non
         def __compare_next_event(self, event):
             """Helper method for warning and dataflow.
             Check that the event that has been generated is expected."""
-            testcase.assertTrue(self.__refEvents, msg='No more events are expected but {} was raised'.format(event))
-            testcase.assertEqual(event, self.__refEvents.pop(0))
-
-    # Build the Runnable
-    # NOTE: not __init__ because we can't provide file descriptors, etc
-    runnable = RunnableTester.__new__(RunnableTester)
-    runnable.runTests()
+            self.__event_counts[self.__current_step] += 1
+            while True:
+                if self.__current_matcher is not None:
+                    if self.__current_matcher.accepts(event):
+                        self.__current_matcher.consume(testcase, event)
+                        return
+                    missing = self.__current_matcher.missing()
+                    testcase.assertIsNone(missing, msg='{0} was raised. {1}'.format(event, missing))
+                    self.__current_matcher = None
+                expected = next(self.__refEvents, None)
+                testcase.assertIsNotNone(expected, msg='No more events are expected but {} was raised'.format(event))
+                if not isinstance(expected, EventMatcher):
+                    testcase.assertEqual(event, expected)
+                    return
+                expected.reset()
+                self.__current_matcher = expected
+
+    config = config or {}
+    warm_up = config.get('warm_up', 0)
+    measured_runs = []
+    for i in range(warm_up + config.get('repeat', 1)):
+        # Build the Runnable
+        # NOTE: not __init__ because we can't provide file descriptors, etc
+        runnable = RunnableTester.__new__(RunnableTester)
+        measures = runnable.runTests()
+        if i >= warm_up:
+            measured_runs.append(measures)
+
+    from .benchmarks import summarize
+    statistics = collections.OrderedDict()
+    for measures in measured_runs:
+        for (step, step_measures) in measures.items():
+            for (measure, value) in step_measures.items():
+                statistics.setdefault(step, collections.OrderedDict()).setdefault(measure, []).append(value)
+    for step_statistics in statistics.values():
+        for measure in step_statistics:
+            step_statistics[measure] = summarize(step_statistics[measure])
+
+    _check_performance_budgets(testcase, statistics, config)
+    return statistics
+
+
+def _check_performance_budgets(testcase, statistics, config):
+    """Compare the median of the measures to the budgets found in config"""
+    for (budget_name, measure) in PERFORMANCE_BUDGETS.items():
+        if budget_name not in config:
+            continue
+        budgets = config[budget_name]
+        if not isinstance(budgets, dict):
+            budgets = {'total': budgets}
+        for (step, budget) in sorted(budgets.items()):
+            testcase.assertIn(step, statistics, msg='{0} has a budget for "{1}" but this step has not run'.format(budget_name, step))
+            testcase.assertIn(measure, statistics[step], msg='{0} needs {1}, which has not been measured'.format(budget_name, measure))
+            value = statistics[step][measure]['p50']
+            testcase.assertLessEqual(value, budget, msg='{0} of "{1}" is over budget ({2})'.format(measure, step, budget_name))
@@ -0,0 +1,185 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Timeline of the activity of the Python wrapper, in the Trace Event format
+understood by chrome://tracing and Perfetto (https://ui.perfetto.dev).
+
+When the environment variable EHIVE_PYTHON_TRACE_DIR is set, every worker
+writes its own trace file in that directory, with one event per job, per
+life-cycle step, per message exchanged with GuestProcess, and per span
+opened by the Runnable with `self.trace_span()`. Events are buffered in
+memory (at most EHIVE_PYTHON_TRACE_BUFFER events, default 10000) and
+appended to the file at the end of every job.
+
+The files of several workers can be merged into a single timeline with
+`wrapper trace_merge <trace_dir> <output_file>`.
+"""
+
+import contextlib
+import glob
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import threading
+import unittest
+
+
+class Tracer:
+    """Buffers trace events and appends them to a file"""
+
+    def __init__(self, path, buffer_size=10000):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.pid = os.getpid()
+        # Timestamps are on the wall clock so that traces of different workers can be aligned
+        self.clock_offset = time.time() - time.perf_counter()
+        self.fh = open(path, 'w')
+        self.fh.write('[\n')
+        self.first_event = True
+        self.buffer.append({'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                            'args': {'name': 'worker {0}:{1}'.format(socket.gethostname(), self.pid)}})
+
+    @classmethod
+    def from_environment(cls):
+        """Returns a Tracer configured from the environment, or None"""
+        directory = os.environ.get('EHIVE_PYTHON_TRACE_DIR')
+        if not directory:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'ehive_trace_{0}_{1}.json'.format(socket.gethostname(), os.getpid()))
+        return cls(path, int(os.environ.get('EHIVE_PYTHON_TRACE_BUFFER', 10000)))
+
+    def now(self):
+        """Current time, as understood by complete()"""
+        return time.perf_counter()
+
+    def complete(self, name, category, start, end, args=None):
+        """Records an event that started at "start" and ended at "end" (values returned by now())"""
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': threading.get_ident(),
+                 'ts': round((self.clock_offset + start) * 1e6, 3), 'dur': round((end - start) * 1e6, 3)}
+        if args:
+            event['args'] = args
+        self.buffer.append(event)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    @contextlib.contextmanager
+    def span(self, name, category='user', **args):
+        """Context manager that records the code run within it as one event"""
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.complete(name, category, start, self.now(), args)
+
+    def flush(self):
+        """Appends the buffered events to the file"""
+        if not self.buffer:
+            return
+        chunks = [json.dumps(e, separators=(',', ':'), default=repr) for e in self.buffer]
+        self.fh.write(('' if self.first_event else ',\n') + ',\n'.join(chunks))
+        self.fh.flush()
+        self.first_event = False
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.fh.write('\n]\n')
+        self.fh.close()
+
+
+@contextlib.contextmanager
+def null_span():
+    """Context manager that does nothing, used when tracing is disabled"""
+    yield
+
+
+def read_trace_file(path):
+    """Returns the events of a trace file, even if the file is incomplete
+    (the closing bracket is only written when the worker exits cleanly)"""
+    with open(path, 'r') as fh:
+        content = fh.read().strip()
+    if not content.endswith(']'):
+        content = content.rstrip(',') + ']'
+    return json.loads(content)
+
+
+def merge_trace_files(paths, output_path):
+    """Concatenates the events of several trace files in one file. The pids
+    are renumbered to tell apart workers from different hosts"""
+    pid_map = {}
+    events = []
+    for path in paths:
+        for e in read_trace_file(path):
+            key = (path, e.get('pid'))
+            if key not in pid_map:
+                pid_map[key] = len(pid_map) + 1
+            e['pid'] = pid_map[key]
+            events.append(e)
+    with open(output_path, 'w') as fh:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fh)
+    return len(events)
+
+
+def merge_trace_directory(directory, output_path):
+    """Merges all the trace files found in a directory"""
+    return merge_trace_files(sorted(glob.glob(os.path.join(directory, 'ehive_trace_*.json'))), output_path)
+
+
+class TracerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_tracer(self):
+        path = os.path.join(self.dir, 'ehive_trace_a.json')
+        tracer = Tracer(path, buffer_size=3)
+        with tracer.span('align', n=3):
+            pass
+        start = tracer.now()
+        tracer.complete('send WARNING', 'protocol', start, tracer.now(), {'bytes': 10})
+        # The buffer has been flushed but the file is not closed yet
+        events = read_trace_file(path)
+        self.assertEqual([e['name'] for e in events], ['process_name', 'align', 'send WARNING'])
+        self.assertEqual(events[1]['args'], {'n': 3})
+        with tracer.span('run', 'step'):
+            pass
+        tracer.close()
+        events = read_trace_file(path)
+        self.assertEqual(events[-1]['cat'], 'step')
+        self.assertGreaterEqual(events[-1]['ts'], events[1]['ts'])
+
+    def test_merge(self):
+        for name in ['a', 'b']:
+            tracer = Tracer(os.path.join(self.dir, 'ehive_trace_{0}.json'.format(name)))
+            with tracer.span('run', 'step'):
+                pass
+            if name == 'a':
+                tracer.close()
+            else:
+                tracer.flush()
+        output_path = os.path.join(self.dir, 'merged.json')
+        self.assertEqual(merge_trace_directory(self.dir, output_path), 4)
+        with open(output_path, 'r') as fh:
+            merged = json.load(fh)
+        self.assertEqual(sorted(set(e['pid'] for e in merged['traceEvents'])), [1, 2])
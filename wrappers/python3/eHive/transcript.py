@@ -0,0 +1,198 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Recording and replaying of the messages exchanged with GuestProcess.
+
+When the environment variable EHIVE_PYTHON_TRANSCRIPT_DIR is set,
+BaseRunnable writes the transcript of every job in that directory: the
+job configuration, every event sent to GuestProcess and every response,
+with timestamps. Transcripts are gzipped JSON lines.
+
+`wrapper replay <module_name> <transcript>` runs the Runnable again
+against a Python stand-in of GuestProcess that serves the recorded
+responses, so that a production job can be reproduced, profiled and
+benchmarked without Perl or a database.
+"""
+
+import gzip
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from .guest import GuestProcessStandIn, GuestProcessStandInException
+
+
+class TranscriptRecorder:
+    """Writes the messages of each job to its own transcript file"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.fh = None
+        self.tmp_path = None
+        self.pending = None
+        self.start = None
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls):
+        """Returns a TranscriptRecorder configured from the environment, or None"""
+        directory = os.environ.get('EHIVE_PYTHON_TRANSCRIPT_DIR')
+        return cls(directory) if directory else None
+
+    def record(self, direction, line):
+        """Records a message ('in' from GuestProcess, 'out' to GuestProcess).
+        Messages received outside of a job are only kept until the next one
+        as the job configuration arrives before begin_job() is called"""
+        now = time.time()
+        if self.fh is None:
+            self.pending = (now, direction, line)
+            return
+        self.__write(now, direction, line)
+
+    def __write(self, t, direction, line):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        self.fh.write(json.dumps([round(t - self.start, 6), direction, line.rstrip("\n")]) + "\n")
+
+    def begin_job(self):
+        """Starts a new transcript with the last message received (the job configuration)"""
+        (fd, self.tmp_path) = tempfile.mkstemp(dir=self.directory, prefix='.tmp.')
+        os.close(fd)
+        self.fh = gzip.open(self.tmp_path, 'wt', compresslevel=6)
+        self.start = self.pending[0] if self.pending else time.time()
+        if self.pending:
+            self.__write(*self.pending)
+            self.pending = None
+
+    def end_job(self, job):
+        """Closes the transcript and gives it its final name"""
+        self.fh.close()
+        self.fh = None
+        path = os.path.join(self.directory, 'job_id_{0}_{1}_{2}_{3}.transcript.gz'.format(job.dbID, job.retry_count, socket.gethostname(), os.getpid()))
+        os.replace(self.tmp_path, path)
+        self.tmp_path = None
+        return path
+
+    def abort_job(self):
+        """Closes and removes the transcript of a job that has not reached its end"""
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+        if self.tmp_path is not None:
+            try:
+                os.unlink(self.tmp_path)
+            except OSError:
+                pass
+            self.tmp_path = None
+
+
+def load_transcript(path):
+    """Returns the list of (time, direction, message) of a transcript"""
+    with gzip.open(path, 'rt') as fh:
+        return [(t, direction, json.loads(line)) for (t, direction, line) in (json.loads(l) for l in fh)]
+
+
+class ReplayStandIn(GuestProcessStandIn):
+    """GuestProcess stand-in that serves the job and the responses of a transcript"""
+
+    def __init__(self, transcript, keep_events=True):
+        incoming = [m for (_, d, m) in transcript if d == 'in']
+        self.recorded_events = [m for (_, d, m) in transcript if d == 'out' and 'event' in m]
+        self.recorded_responses = [m['response'] for m in incoming[1:]]
+        self.divergences = []
+        self.n_events = 0
+        super().__init__([incoming[0]], keep_events)
+
+    def respond(self, event, content):
+        i = self.n_events
+        self.n_events += 1
+        if i >= len(self.recorded_events):
+            self.divergences.append("Event #{0} ({1}) was not recorded".format(i, event))
+            return super().respond(event, content)
+        recorded = self.recorded_events[i]
+        if recorded['event'] != event:
+            self.divergences.append("Event #{0} is {1} but {2} was recorded".format(i, event, recorded['event']))
+        elif recorded['content'] != content and event != 'JOB_END':
+            self.divergences.append("Event #{0} ({1}) has a different content".format(i, event))
+        if event == 'WORKER_TEMP_DIRECTORY' or recorded['event'] != event:
+            # The recorded directory may not exist on this host
+            return super().respond(event, content)
+        return self.recorded_responses[i]
+
+
+class TranscriptTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_record_and_replay(self):
+        from .examples.LongMult.DigitFactory import DigitFactory
+        from .guest import make_job_config
+        os.environ['EHIVE_PYTHON_TRANSCRIPT_DIR'] = self.dir
+        try:
+            standin = GuestProcessStandIn([make_job_config({'b_multiplier': 9650, 'take_time': 0}, dbID=5)])
+            standin.run(DigitFactory)
+        finally:
+            del os.environ['EHIVE_PYTHON_TRANSCRIPT_DIR']
+        files = [f for f in os.listdir(self.dir) if not f.startswith('.')]
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('job_id_5_0_'))
+
+        transcript = load_transcript(os.path.join(self.dir, files[0]))
+        self.assertEqual(transcript[0][1], 'in')
+        self.assertEqual(transcript[0][2]['input_job']['dbID'], 5)
+        self.assertEqual(transcript[-1][2], {'response': 'OK'})
+
+        replay = ReplayStandIn(transcript)
+        replay.run(DigitFactory)
+        self.assertEqual(replay.divergences, [])
+        # The resource usage reported in JOB_END differs from one run to the other
+        self.assertEqual(replay.job_events[0][:-1], standin.job_events[0][:-1])
+        self.assertEqual(replay.job_results[0]['complete'], standin.job_results[0]['complete'])
+
+        # A Runnable that behaves differently
+        transcript[0][2]['input_job']['parameters']['b_multiplier'] = 10
+        replay = ReplayStandIn(transcript)
+        replay.run(DigitFactory)
+        self.assertEqual(replay.divergences, ['Event #3 (DATAFLOW) has a different content', 'Event #4 (WARNING) has a different content'])
+
+    def test_aborted_job(self):
+        from .examples.LongMult.DigitFactory import DigitFactory
+        from .guest import make_job_config
+
+        class LostConnectionStandIn(GuestProcessStandIn):
+            def respond(self, event, content):
+                if event == 'DATAFLOW':
+                    # The Runnable cannot get a response any more
+                    self.write_pipe.close()
+                    raise GuestProcessStandInException("Connection lost")
+                return super().respond(event, content)
+
+        os.environ['EHIVE_PYTHON_TRANSCRIPT_DIR'] = self.dir
+        try:
+            standin = LostConnectionStandIn([make_job_config({'b_multiplier': 9650, 'take_time': 0}, dbID=5)])
+            with self.assertRaises(Exception):
+                standin.run(DigitFactory)
+        finally:
+            del os.environ['EHIVE_PYTHON_TRANSCRIPT_DIR']
+        self.assertEqual(os.listdir(self.dir), [], 'The partial transcript is removed')
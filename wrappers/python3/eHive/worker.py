@@ -0,0 +1,1165 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Experimental Python worker for SQLite hive databases.
+
+`wrapper worker sqlite:///my_hive.db` does in a single process what
+runWorker.pl does with a GuestProcess: it registers a worker (LOCAL
+meadow), specializes into a python3 analysis, claims batches of jobs like
+AnalysisJobAdaptor::grab_jobs_for_role(), runs them in-process (there is
+no JSON pipe to cross), and applies their dataflow and the semaphores.
+Several such workers can run at the same time on the same database, and
+alongside Perl workers.
+
+Only the common cases are supported:
+ - analyses whose language is python3 (the others are left to Perl workers);
+ - dataflow to local analyses, including semaphored fans and funnels, and
+   input_id templates;
+ - dataflow to accumulators and to tables;
+ - the parameter stack (hive_use_param_stack and extend_param_stack);
+ - databases with or without triggers (hive_use_triggers).
+Analyses whose dataflow rules have conditions (WHEN) or target other
+databases, or whose control rules depend on other databases, are not
+taken.
+
+Differences with the Perl worker:
+ - The dataflow of a job is applied when the job ends, in the same
+   transaction as its completion, so a job that fails after calling
+   dataflow() does not leave new jobs behind. dataflow() thus returns
+   None instead of the ids of the new jobs.
+ - Jobs stay CLAIMED while they run (the status is not updated at every
+   step), their output is not redirected, runtime_msec is the wall time of
+   the whole job, and the resource usage is not recorded.
+ - The analysis statistics are only synchronized when a role ends.
+ - Semaphores that depend on semaphores of other databases cannot be
+   released: the job that would release them fails.
+"""
+
+import argparse
+import collections
+import getpass
+import hashlib
+import io
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import unittest
+import urllib.parse
+
+from . import db
+from . import params
+from .process import Job, ResultSink
+from .stringify import stringify, destringify
+from .utils import find_module
+
+
+class WorkerException(Exception):
+    """Raised when the pipeline uses a feature the Python worker does not
+    support, or when the dataflow of a job is invalid"""
+    pass
+
+
+# Same as Bio::EnsEMBL::Hive::DBSQL::DataflowRuleAdaptor
+BRANCH_CODES = {'MAIN': 1, 'ANYFAILURE': 0, 'MEMLIMIT': -1, 'RUNLIMIT': -2}
+
+# Longer input_ids are stored in the analysis_data table
+MAX_INPUT_ID_LENGTH = 255
+_EXTENDED_DATA_REGEX = re.compile(r'^_ext(?:\w+)_data_id (\d+)$')
+
+TAKEN_JOB_STATUSES = ('CLAIMED', 'PRE_CLEANUP', 'FETCH_INPUT', 'RUN', 'WRITE_OUTPUT', 'POST_HEALTHCHECK', 'POST_CLEANUP')
+COMPLETE_JOB_STATUSES = ('DONE', 'PASSED_ON')
+
+# Default of Bio::EnsEMBL::Hive::AnalysisStats::min_batch_time
+MIN_BATCH_TIME_MSEC = 2 * 60 * 1000
+
+
+def branch_name_2_code(branch_name_or_code):
+    """Maps a branch name (e.g. 'MAIN') to its code"""
+    if branch_name_or_code is None:
+        return 1
+    if isinstance(branch_name_or_code, int):
+        return branch_name_or_code
+    if re.match(r'^-?\d+$', str(branch_name_or_code)):
+        return int(branch_name_or_code)
+    try:
+        return BRANCH_CODES[str(branch_name_or_code).upper()]
+    except KeyError:
+        raise WorkerException("Could not map the branch_name '{0}' to the internal code".format(branch_name_or_code)) from None
+
+
+def _in_list(values):
+    return '(' + ','.join("'{0}'".format(v) for v in values) + ')'
+
+
+class HiveDatabase(db.DBConnection):
+    """Connection to a SQLite hive database. The connection is in autocommit
+    mode, and the changes are grouped in explicit transactions (see
+    transaction())"""
+
+    def __init__(self, url):
+        parsed = db.parse_url(url)
+        if parsed['driver'] != 'sqlite':
+            raise db.DBURLException("The Python worker only supports SQLite databases, not '{0}'".format(url))
+        if not parsed['dbname'] or not os.path.exists(parsed['dbname']):
+            raise WorkerException("The database '{0}' does not exist".format(url))
+        super().__init__(url)
+        meta = dict(self.fetchall('SELECT meta_key, meta_value FROM hive_meta'))
+        self.use_triggers = int(meta.get('hive_use_triggers') or 0)
+        self.use_param_stack = int(meta.get('hive_use_param_stack') or 0)
+        self.default_max_retry_count = int(meta.get('hive_default_max_retry_count') or 0)
+
+    def connect(self):
+        super().connect()
+        self.dbh.isolation_level = None
+
+    def transaction(self):
+        """Context manager that runs a block in a transaction. The
+        transaction takes the write lock immediately, so that concurrent
+        workers wait for each other instead of failing to upgrade their lock"""
+        return _Transaction(self)
+
+    def fetchone(self, sql, params=()):
+        rows = self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+    def increment_counter(self, counter, increment, analysis_id):
+        """AnalysisStatsAdaptor::increment_a_counter(): the counters are
+        maintained by the triggers, if any"""
+        if increment and not self.use_triggers:
+            self.execute('UPDATE analysis_stats SET {0} = {0} + (?) WHERE sync_lock=0 AND analysis_id=?'.format(counter), (increment, analysis_id))
+
+    def store_input_id(self, input_id):
+        """Returns what goes to the input_id column: the input_id itself, or
+        a reference to analysis_data if it is too long"""
+        if len(input_id) <= MAX_INPUT_ID_LENGTH:
+            return input_id
+        md5sum = hashlib.md5(input_id.encode('utf-8')).hexdigest()
+        (data_id,) = self.fetchone('SELECT MIN(analysis_data_id) FROM analysis_data WHERE md5sum = ? AND data = ?', (md5sum, input_id))
+        if data_id is None:
+            data_id = self.execute('INSERT INTO analysis_data (md5sum, data) VALUES (?, ?)', (md5sum, input_id)).lastrowid
+        return '_extended_data_id {0}'.format(data_id)
+
+    def fetch_input_id(self, stored_input_id):
+        """Reverse of store_input_id()"""
+        m = _EXTENDED_DATA_REGEX.match(stored_input_id)
+        if not m:
+            return stored_input_id
+        row = self.fetchone('SELECT data FROM analysis_data WHERE analysis_data_id = ?', (int(m.group(1)),))
+        if row is None:
+            raise WorkerException("Cannot find the data of '{0}'".format(stored_input_id))
+        return row[0]
+
+    def count_new_jobs(self, analysis_id, status, n_jobs):
+        """Adds n_jobs new jobs (READY or SEMAPHORED) to the statistics of the
+        analysis, as AnalysisJobAdaptor::store_jobs_and_adjust_counters()"""
+        if n_jobs and not self.use_triggers:
+            self.execute("UPDATE analysis_stats SET total_job_count=total_job_count+(?), {0}={0}+(?), status = CASE WHEN status!='BLOCKED' THEN 'LOADING' ELSE 'BLOCKED' END WHERE analysis_id=?".format(
+                'ready_job_count' if status == 'READY' else 'semaphored_job_count'), (n_jobs, n_jobs, analysis_id))
+
+    def increase_semaphore(self, semaphore_id, delta):
+        self.execute('UPDATE semaphore SET local_jobs_counter = local_jobs_counter + (?) WHERE semaphore_id=?', (delta, semaphore_id))
+
+    def decrease_semaphore(self, semaphore_id, delta):
+        self.increase_semaphore(semaphore_id, -delta)
+        self.release_if_ripe(semaphore_id)
+
+    def release_if_ripe(self, semaphore_id):
+        """Unblocks the dependent job once the counters of the semaphore have reached 0"""
+        (local_jobs_counter, remote_jobs_counter, dependent_job_id, dependent_semaphore_url) = self.fetchone(
+            'SELECT local_jobs_counter, remote_jobs_counter, dependent_job_id, dependent_semaphore_url FROM semaphore WHERE semaphore_id=?', (semaphore_id,))
+        if local_jobs_counter + remote_jobs_counter > 0:
+            return
+        if dependent_job_id is not None:
+            self.execute("UPDATE job SET status='READY' WHERE job_id=? AND status='SEMAPHORED'", (dependent_job_id,))
+        elif dependent_semaphore_url:
+            raise WorkerException('The semaphore {0} depends on the semaphore {1}, which the Python worker cannot release'.format(semaphore_id, dependent_semaphore_url))
+
+    def leech_funnel_semaphore(self, analysis_id, stored_input_id, param_id_stack, accu_id_stack):
+        """Finds the semaphore of an existing funnel job, blocking the job again
+        if it has not started yet, as AnalysisJobAdaptor::store_a_semaphored_group_of_jobs().
+        Returns the job_id and the semaphore_id"""
+        row = self.fetchone('SELECT job_id, status FROM job WHERE analysis_id=? AND input_id=? AND param_id_stack=? AND accu_id_stack=?',
+                            (analysis_id, stored_input_id, param_id_stack, accu_id_stack))
+        if row is None:
+            raise WorkerException('The funnel job could neither be stored nor fetched')
+        (funnel_job_id, status) = row
+        if status == 'READY':
+            # If the job hasn't run yet, we can still block it
+            self.execute("UPDATE job SET status='SEMAPHORED' WHERE job_id=? AND status NOT IN " + _in_list(('COMPILATION',) + TAKEN_JOB_STATUSES), (funnel_job_id,))
+            (status,) = self.fetchone('SELECT status FROM job WHERE job_id=?', (funnel_job_id,))
+        if status != 'SEMAPHORED':
+            raise WorkerException('The funnel job (id={0}) fetched from the database was not in SEMAPHORED status'.format(funnel_job_id))
+        row = self.fetchone('SELECT semaphore_id FROM semaphore WHERE dependent_job_id=?', (funnel_job_id,))
+        if row is None:
+            return (funnel_job_id, self.execute('INSERT INTO semaphore (local_jobs_counter, remote_jobs_counter, dependent_job_id) VALUES (0, 0, ?)', (funnel_job_id,)).lastrowid)
+        return (funnel_job_id, row[0])
+
+    def log_message(self, msg, message_class, job_id=None, role_id=None, worker_id=None, retry=None, status='UNKNOWN'):
+        self.execute('INSERT INTO log_message (job_id, role_id, worker_id, retry, status, msg, message_class) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     (job_id, role_id, worker_id, retry, status, msg, message_class))
+
+
+class _Transaction:
+
+    def __init__(self, hive_db):
+        self.hive_db = hive_db
+
+    def __enter__(self):
+        self.hive_db.dbh.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.hive_db.dbh.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+        return False
+
+
+class Analysis:
+    """The attributes of an analysis that matter to the worker"""
+
+    def __init__(self, row):
+        (self.analysis_id, self.logic_name, self.module, self.language, parameters, self.failed_job_tolerance,
+         self.max_retry_count, self.can_be_empty, self.priority, self.analysis_capacity, self.batch_size) = row
+        self.parameters = destringify(parameters) if parameters else {}
+        # Fan rules come first for the same branch code
+        self.rules_by_branch = {}
+        self.ctrl_conditions = []
+        # Reason why the worker cannot take this analysis
+        self.unsupported = None
+
+
+class DataflowRule:
+
+    def __init__(self, dataflow_rule_id, funnel_dataflow_rule_id):
+        self.dataflow_rule_id = dataflow_rule_id
+        self.funnel_dataflow_rule_id = funnel_dataflow_rule_id
+        self.targets = []
+
+
+class DataflowTarget:
+    """Where a dataflow rule sends the output_ids: an analysis, an
+    accumulator or a table (the "kind" attribute)"""
+
+    def __init__(self, url, input_id_template, extend_param_stack):
+        self.url = url
+        self.input_id_template = destringify(input_id_template) if input_id_template else None
+        self.extend_param_stack = bool(extend_param_stack)
+        (self.kind, self.options) = parse_target_url(url)
+        self.analysis = None
+
+
+def parse_target_url(url):
+    """Returns the kind of a (local) dataflow target and its options"""
+    if '://' in url:
+        raise WorkerException("'{0}' is in another database".format(url))
+    (name, _, query) = url.partition('?')
+    options = dict(urllib.parse.parse_qsl(query))
+    if 'accu_name' in options:
+        return ('accu', options)
+    if 'table_name' in options:
+        return ('table', options)
+    options['logic_name'] = name or options.get('logic_name')
+    if not options['logic_name']:
+        raise WorkerException("Cannot understand the URL '{0}'".format(url))
+    return ('analysis', options)
+
+
+class Pipeline:
+    """The analyses, rules and parameters of a hive database"""
+
+    def __init__(self, hive_db):
+        self.parameters = {name: destringify(value) for (name, value) in hive_db.fetchall('SELECT param_name, param_value FROM pipeline_wide_parameters')}
+        self.analyses = {}
+        self.analyses_by_name = {}
+        for row in hive_db.fetchall('SELECT analysis_id, logic_name, module, language, parameters, failed_job_tolerance, max_retry_count, can_be_empty, priority, analysis_capacity, batch_size FROM analysis_base ORDER BY analysis_id'):
+            analysis = Analysis(row)
+            self.analyses[analysis.analysis_id] = analysis
+            self.analyses_by_name[analysis.logic_name] = analysis
+
+        rules = collections.OrderedDict()
+        for (rule_id, from_analysis_id, branch_code, funnel_rule_id) in hive_db.fetchall('SELECT dataflow_rule_id, from_analysis_id, branch_code, funnel_dataflow_rule_id FROM dataflow_rule ORDER BY dataflow_rule_id'):
+            rule = rules[rule_id] = DataflowRule(rule_id, funnel_rule_id)
+            branch_rules = self.analyses[from_analysis_id].rules_by_branch.setdefault(branch_code, [])
+            if funnel_rule_id is not None:
+                branch_rules.insert(0, rule)
+            else:
+                branch_rules.append(rule)
+        from_analysis = {rule.dataflow_rule_id: analysis for analysis in self.analyses.values() for branch_rules in analysis.rules_by_branch.values() for rule in branch_rules}
+        for (rule_id, on_condition, input_id_template, extend_param_stack, to_analysis_url) in hive_db.fetchall('SELECT source_dataflow_rule_id, on_condition, input_id_template, extend_param_stack, to_analysis_url FROM dataflow_target ORDER BY rowid'):
+            analysis = from_analysis[rule_id]
+            if on_condition is not None:
+                analysis.unsupported = 'conditional dataflow'
+                continue
+            try:
+                target = DataflowTarget(to_analysis_url, input_id_template, extend_param_stack)
+                if target.kind == 'analysis':
+                    target.analysis = self.find_local_analysis(target.options['logic_name'])
+            except WorkerException as e:
+                analysis.unsupported = 'dataflow to {0}'.format(e)
+                continue
+            rules[rule_id].targets.append(target)
+
+        for (condition_analysis_url, ctrled_analysis_id) in hive_db.fetchall('SELECT condition_analysis_url, ctrled_analysis_id FROM analysis_ctrl_rule'):
+            analysis = self.analyses[ctrled_analysis_id]
+            try:
+                (kind, options) = parse_target_url(condition_analysis_url)
+                analysis.ctrl_conditions.append(self.find_local_analysis(options['logic_name']))
+            except (WorkerException, KeyError) as e:
+                analysis.unsupported = 'control rule on {0}'.format(e)
+
+        self.table_columns = {}
+
+    def find_local_analysis(self, logic_name):
+        if logic_name not in self.analyses_by_name:
+            raise WorkerException("'{0}' is not an analysis of this pipeline".format(logic_name))
+        return self.analyses_by_name[logic_name]
+
+    def match_analyses(self, analyses_pattern):
+        """The analyses matching a pattern like runWorker.pl's -analyses_pattern:
+        comma-separated logic_names (with % wildcards), analysis_ids or ranges of analysis_ids"""
+        if not analyses_pattern:
+            return list(self.analyses.values())
+        matches = collections.OrderedDict()
+        for pattern in analyses_pattern.split(','):
+            pattern = pattern.strip()
+            m = re.match(r'^(\d+)(?:\.\.(\d+))?$', pattern)
+            if m:
+                (first, last) = (int(m.group(1)), int(m.group(2) or m.group(1)))
+                selected = [a for a in self.analyses.values() if first <= a.analysis_id <= last]
+            else:
+                regex = re.compile('^' + '.*'.join(re.escape(p) for p in pattern.split('%')) + '$')
+                selected = [a for a in self.analyses.values() if regex.match(a.logic_name)]
+            for analysis in selected:
+                matches[analysis.analysis_id] = analysis
+        return list(matches.values())
+
+    def get_table_columns(self, hive_db, table_name):
+        if table_name not in self.table_columns:
+            columns = [row[1] for row in hive_db.fetchall('PRAGMA table_info({0})'.format(table_name))]
+            if not columns:
+                raise WorkerException("No table named '{0}'".format(table_name))
+            self.table_columns[table_name] = columns
+        return self.table_columns[table_name]
+
+
+_ACCU_KEY_REGEX = re.compile(r'\[(\d*)\]|\{(.*?)\}')
+
+
+def _vivify(container, key, kind):
+    current = container[key] if isinstance(container, list) else container.get(key)
+    if current is None:
+        current = container[key] = kind()
+    return current
+
+
+def add_accu_value(structures, struct_name, key_signature, value):
+    """Adds an accumulated value to the structures of a job, as
+    AccumulatorAdaptor::fetch_structures_for_job_ids() does: "[]" appends
+    to a list, "[i]" and "{key}" set an element, and "{}" counts the values"""
+    (container, key) = (structures, struct_name)
+    for m in _ACCU_KEY_REGEX.finditer(key_signature):
+        (array_index, hash_key) = m.groups()
+        if array_index is not None:
+            current = _vivify(container, key, list)
+            index = int(array_index) if array_index else len(current)
+            current.extend([None] * (index + 1 - len(current)))
+            (container, key) = (current, index)
+        else:
+            current = _vivify(container, key, dict)
+            if not hash_key:
+                count_key = '' if value is None else value if isinstance(value, str) else str(value)
+                current[count_key] = (current.get(count_key) or 0) + 1
+                return
+            (container, key) = (current, hash_key)
+    container[key] = value
+
+
+def _find_empty_brackets(signature, opening, closing):
+    pairs = re.findall(re.escape(opening) + '([^' + re.escape(closing) + ']*)' + re.escape(closing), signature)
+    return {i for (i, content) in enumerate(pairs) if content == ''}
+
+
+def check_empty_keys(key_signature, accu_address):
+    """Fails if a substitution in the address of an accumulator gave an empty key"""
+    for (opening, closing) in [('{', '}'), ('[', ']')]:
+        unexpected = _find_empty_brackets(key_signature, opening, closing) - _find_empty_brackets(accu_address, opening, closing)
+        if unexpected:
+            raise WorkerException("A key in the accumulator had an empty substitution. Bracket '{0}{1}' pair number {2}, substitution from '{3}' to '{4}'".format(
+                opening, closing, min(unexpected), accu_address, key_signature))
+
+
+def _perl_string(value):
+    """How a parameter is interpolated in an accumulator address"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return '1' if value else ''
+    return value if isinstance(value, str) else str(value)
+
+
+def _db_value(value):
+    """What a parameter becomes in a table column"""
+    if isinstance(value, (dict, list)):
+        return stringify(value)
+    return value
+
+
+class PendingJobIDs:
+    """What dataflow() returns in this worker. The jobs are only created when
+    the job ends, so their dbIDs cannot be given to the Runnable: using the
+    value fails the job (without retries)"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def __fail(self, *args):
+        self.job.transient_error = False
+        raise WorkerException("The Python worker creates the jobs when the job ends: the return value of dataflow() cannot be used")
+
+    __iter__ = __len__ = __getitem__ = __contains__ = __bool__ = __eq__ = __fail
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return '<PendingJobIDs>'
+
+
+class InProcessSink(ResultSink):
+    """Records the warnings and dataflows of the jobs in the jobs themselves,
+    for the worker to apply when the job ends"""
+
+    def __init__(self, worker):
+        self.worker = worker
+
+    def job_status_update(self, job, step):
+        job.step = step.upper()
+
+    def warning(self, job, message, is_error):
+        job.messages.append((message, is_error, job.step))
+
+    def dataflow(self, job, output_ids, branch_name_or_code, job_params):
+        job.dataflows.append((output_ids, branch_name_or_code))
+        return PendingJobIDs(job)
+
+    def is_branch_connected(self, job, branch_name_or_code):
+        analysis = self.worker.pipeline.analyses[job.analysis_id]
+        return bool(analysis.rules_by_branch.get(branch_name_2_code(branch_name_or_code)))
+
+    def worker_temp_directory(self):
+        return self.worker.temp_directory()
+
+    def job_end(self, job, complete, job_params, resource_usage):
+        # The dataflows are substituted with the final parameters of the job
+        job.params = job_params
+
+
+class Worker:
+    """A worker that runs the jobs of python3 analyses in its own process.
+    run() registers the worker, runs one or several roles and returns the
+    cause of death"""
+
+    def __init__(self, url, analyses_pattern=None, job_limit=None, life_span=None, retry_throwing_jobs=True,
+                 can_respecialize=False, execute_writes=True, beekeeper_id=None, debug=0):
+        self.hive_db = HiveDatabase(url)
+        self.hive_pipeline_url = db.unambig_url(db.parse_url(url))
+        self.pipeline = Pipeline(self.hive_db)
+        self.analyses_pattern = analyses_pattern
+        self.job_limit = job_limit
+        self.life_span = life_span
+        self.retry_throwing_jobs = retry_throwing_jobs
+        self.can_respecialize = can_respecialize
+        self.execute_writes = execute_writes
+        self.beekeeper_id = beekeeper_id
+        self.debug = debug
+        self.worker_id = None
+        self.role_id = None
+        self.work_done = 0
+        self.prev_job_error = False
+        self.cause_of_death = None
+        self.db_pool = db.ConnectionPool()
+        self.runnables = {}
+        self.created_temp_directory = None
+
+    def say(self, *args):
+        if self.debug:
+            print('Worker {0}'.format(self.worker_id), *args, file=sys.stderr)
+
+    # Worker and roles
+    ###################
+
+    def run(self):
+        """Registers the worker and runs jobs until there is nothing left to
+        do. Returns the cause of death"""
+        self.register()
+        self.born = time.monotonic()
+        try:
+            analysis = self.choose_analysis()
+            self.cause_of_death = 'NO_ROLE'
+            while analysis is not None:
+                self.cause_of_death = self.run_role(analysis)
+                if self.cause_of_death != 'NO_WORK' or not self.can_respecialize:
+                    break
+                analysis = self.choose_analysis()
+        except KeyboardInterrupt:
+            self.cause_of_death = 'KILLED_BY_USER'
+            raise
+        except Exception as e:
+            self.cause_of_death = 'SEE_MSG'
+            with self.hive_db.transaction():
+                self.hive_db.log_message('{0}: {1}'.format(type(e).__name__, e), 'WORKER_ERROR', worker_id=self.worker_id)
+            raise
+        finally:
+            self.register_death()
+        return self.cause_of_death
+
+    def register(self):
+        hostname = socket.gethostname()
+        try:
+            user = getpass.getuser()
+        except Exception:
+            user = None
+        with self.hive_db.transaction():
+            self.worker_id = self.hive_db.execute("INSERT INTO worker (meadow_type, meadow_name, meadow_host, meadow_user, process_id, beekeeper_id, status, when_born, when_checked_in) VALUES ('LOCAL', ?, ?, ?, ?, ?, 'READY', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+                                                  (hostname.split('.')[0], hostname, user, str(os.getpid()), self.beekeeper_id)).lastrowid
+        self.say('registered on', hostname)
+
+    def register_death(self):
+        with self.hive_db.transaction():
+            self.hive_db.execute("UPDATE worker SET status='DEAD', work_done=?, cause_of_death=?, when_died=CURRENT_TIMESTAMP, when_checked_in=CURRENT_TIMESTAMP WHERE worker_id=?",
+                                 (self.work_done, self.cause_of_death, self.worker_id))
+        self.db_pool.close_all()
+        if self.created_temp_directory is not None:
+            shutil.rmtree(self.created_temp_directory, ignore_errors=True)
+            self.created_temp_directory = None
+        self.say('died because of', self.cause_of_death)
+
+    def temp_directory(self):
+        """The temporary directory of the worker, removed when the worker dies"""
+        if self.created_temp_directory is None:
+            self.created_temp_directory = tempfile.mkdtemp(prefix='worker_{0}.'.format(self.worker_id))
+            with self.hive_db.transaction():
+                self.hive_db.execute('UPDATE worker SET temp_directory_name=? WHERE worker_id=?', (self.created_temp_directory, self.worker_id))
+        return self.created_temp_directory
+
+    def is_blocked(self, analysis):
+        """Whether a control rule blocks the analysis, i.e. one of its
+        condition analyses is not DONE (see AnalysisStats::check_blocking_control_rules)"""
+        for condition in analysis.ctrl_conditions:
+            (total, unfinished, failed) = self.hive_db.fetchone("SELECT COUNT(*), SUM(status NOT IN ('DONE','PASSED_ON','FAILED')), SUM(status='FAILED') FROM job WHERE analysis_id=?", (condition.analysis_id,))
+            if total == 0:
+                if not condition.can_be_empty:
+                    return True
+            elif unfinished or failed > condition.failed_job_tolerance * total / 100.0:
+                return True
+        return False
+
+    def choose_analysis(self):
+        """The python3 analysis with the highest priority that has READY jobs
+        and is neither blocked nor at its capacity, or None"""
+        candidates = []
+        for analysis in self.pipeline.match_analyses(self.analyses_pattern):
+            if analysis.language != 'python3':
+                continue
+            if analysis.unsupported:
+                self.say('cannot take', analysis.logic_name, 'because of its', analysis.unsupported)
+                continue
+            candidates.append(analysis)
+        candidates.sort(key=lambda a: (-a.priority, a.analysis_id))
+        for analysis in candidates:
+            (is_excluded,) = self.hive_db.fetchone('SELECT is_excluded FROM analysis_stats WHERE analysis_id=?', (analysis.analysis_id,)) or (0,)
+            if is_excluded or self.is_blocked(analysis):
+                continue
+            if not self.hive_db.fetchone("SELECT 1 FROM job WHERE analysis_id=? AND status='READY' LIMIT 1", (analysis.analysis_id,)):
+                continue
+            if analysis.analysis_capacity is not None and self.count_active_roles(analysis) >= analysis.analysis_capacity:
+                continue
+            return analysis
+        return None
+
+    def count_active_roles(self, analysis):
+        return self.hive_db.fetchone('SELECT COUNT(*) FROM role WHERE analysis_id=? AND when_finished IS NULL', (analysis.analysis_id,))[0]
+
+    def runnable_for(self, analysis):
+        """The Runnable object of the analysis, shared by all its jobs"""
+        if analysis.analysis_id not in self.runnables:
+            runnable_class = find_module(analysis.module)
+            self.runnables[analysis.analysis_id] = runnable_class.with_sink(InProcessSink(self), self.debug, analysis.logic_name, self.db_pool)
+        return self.runnables[analysis.analysis_id]
+
+    def run_role(self, analysis):
+        """Runs batches of jobs of the analysis. Returns the cause of death"""
+        with self.hive_db.transaction():
+            self.role_id = self.hive_db.execute('INSERT INTO role (worker_id, analysis_id, when_started) VALUES (?, ?, CURRENT_TIMESTAMP)', (self.worker_id, analysis.analysis_id)).lastrowid
+            self.hive_db.execute("UPDATE analysis_stats SET status='WORKING' WHERE analysis_id=? AND status!='BLOCKED'", (analysis.analysis_id,))
+            self.hive_db.increment_counter('num_running_workers', 1, analysis.analysis_id)
+        self.say('specialized into', analysis.logic_name, '(role {0})'.format(self.role_id))
+        try:
+            runnable = self.runnable_for(analysis)
+            cause_of_death = None
+            while cause_of_death is None:
+                cause_of_death = self.run_one_batch(analysis, runnable)
+            return cause_of_death
+        finally:
+            self.finalize_role(analysis)
+
+    def finalize_role(self, analysis):
+        with self.hive_db.transaction():
+            self.hive_db.execute('UPDATE role SET when_finished=CURRENT_TIMESTAMP WHERE role_id=?', (self.role_id,))
+            self.hive_db.increment_counter('num_running_workers', -1, analysis.analysis_id)
+            released = self.hive_db.execute("UPDATE job SET status='READY', role_id=NULL WHERE role_id=? AND status='CLAIMED'", (self.role_id,)).rowcount
+            self.hive_db.increment_counter('ready_job_count', released, analysis.analysis_id)
+        self.synchronize_stats(analysis)
+        self.role_id = None
+
+    def synchronize_stats(self, analysis):
+        """Recomputes the statistics and the status of the analysis, as
+        Queen::synchronize_AnalysisStats()"""
+        with self.hive_db.transaction():
+            num_running_workers = self.count_active_roles(analysis)
+            if self.hive_db.use_triggers:
+                (total, semaphored, ready, done, failed) = self.hive_db.fetchone('SELECT total_job_count, semaphored_job_count, ready_job_count, done_job_count, failed_job_count FROM analysis_stats WHERE analysis_id=?', (analysis.analysis_id,))
+            else:
+                counts = dict(self.hive_db.fetchall('SELECT status, COUNT(*) FROM job WHERE analysis_id=? GROUP BY status', (analysis.analysis_id,)))
+                (semaphored, ready, failed) = (counts.get('SEMAPHORED', 0), counts.get('READY', 0), counts.get('FAILED', 0))
+                done = sum(counts.get(s, 0) for s in COMPLETE_JOB_STATUSES)
+                total = sum(counts.values())
+            in_progress = total - semaphored - ready - done - failed
+            if self.is_blocked(analysis):
+                status = 'BLOCKED'
+            elif not total:
+                status = 'EMPTY'
+            elif total == done + failed:
+                status = 'FAILED' if failed > analysis.failed_job_tolerance * total / 100.0 else 'DONE'
+            elif ready and not in_progress:
+                status = 'READY'
+            elif not ready:
+                status = 'ALL_CLAIMED'
+            else:
+                status = 'WORKING'
+            self.hive_db.execute('UPDATE analysis_stats SET status=?, total_job_count=?, semaphored_job_count=?, ready_job_count=?, done_job_count=?, failed_job_count=?, num_running_workers=?, when_updated=CURRENT_TIMESTAMP WHERE analysis_id=? AND sync_lock=0',
+                                 (status, total, semaphored, ready, done, failed, num_running_workers, analysis.analysis_id))
+
+    # Batches and jobs
+    ###################
+
+    def batch_size(self, analysis):
+        """AnalysisStats::get_or_estimate_batch_size(), without the tail-trimming"""
+        if analysis.batch_size > 0:
+            return analysis.batch_size
+        row = self.hive_db.fetchone('SELECT avg_msec_per_job FROM analysis_stats WHERE analysis_id=?', (analysis.analysis_id,))
+        if row and row[0]:
+            return -(-MIN_BATCH_TIME_MSEC // max(row[0], 100))
+        return -analysis.batch_size or 1
+
+    def run_one_batch(self, analysis, runnable):
+        """Claims and runs a batch of jobs. Returns the cause of death, if
+        the worker has to stop"""
+        if self.life_span is not None and time.monotonic() - self.born >= self.life_span * 60:
+            return 'LIFESPAN'
+        how_many = self.batch_size(analysis)
+        if self.job_limit is not None:
+            if self.work_done >= self.job_limit:
+                return 'JOB_LIMIT'
+            how_many = min(how_many, self.job_limit - self.work_done)
+        jobs = self.claim_jobs(analysis, how_many)
+        if not jobs:
+            return 'NO_WORK'
+        for job in jobs:
+            self.run_job(analysis, runnable, job)
+            if self.cause_of_death == 'CONTAMINATED':
+                return self.cause_of_death
+        return None
+
+    def claim_jobs(self, analysis, how_many):
+        """Claims up to how_many READY jobs, as AnalysisJobAdaptor::grab_jobs_for_role():
+        the workers of the same analysis take different slices of the queue,
+        and first-time jobs are preferred"""
+        with self.hive_db.transaction():
+            (role_rank,) = self.hive_db.fetchone('SELECT COUNT(*) FROM role WHERE analysis_id=? AND when_finished IS NULL AND role_id<?', (analysis.analysis_id, self.role_id))
+            claimed = 0
+            for (virgin, offset) in [(True, how_many * role_rank), (False, how_many * role_rank), (False, 0)]:
+                sql = ("UPDATE job SET role_id=?, status='CLAIMED' WHERE job_id IN (SELECT job_id FROM job WHERE analysis_id=? AND status='READY'"
+                       + (' AND retry_count=0' if virgin else '') + ' LIMIT ? OFFSET ?) AND status=\'READY\'')
+                claimed = self.hive_db.execute(sql, (self.role_id, analysis.analysis_id, how_many, offset)).rowcount
+                if claimed:
+                    break
+            self.hive_db.increment_counter('ready_job_count', -claimed, analysis.analysis_id)
+            self.hive_db.execute("UPDATE worker SET status='JOB_LIFECYCLE', work_done=?, when_checked_in=CURRENT_TIMESTAMP WHERE worker_id=?", (self.work_done, self.worker_id))
+            if not claimed:
+                return []
+            rows = self.hive_db.fetchall("SELECT job_id, prev_job_id, input_id, param_id_stack, accu_id_stack, retry_count, controlled_semaphore_id FROM job WHERE role_id=? AND status='CLAIMED' ORDER BY job_id", (self.role_id,))
+        return [self.make_job(analysis, row) for row in rows]
+
+    def make_job(self, analysis, row):
+        job = Job()
+        (job.dbID, job.prev_job_id, stored_input_id, job.param_id_stack, job.accu_id_stack, job.retry_count, job.controlled_semaphore_id) = row
+        job.analysis_id = analysis.analysis_id
+        job.input_id = self.hive_db.fetch_input_id(stored_input_id)
+        job.hive_pipeline_url = self.hive_pipeline_url
+        job.autoflow = True
+        job.lethal_for_worker = False
+        job.transient_error = True
+        job.messages = []
+        job.dataflows = []
+        job.step = 'CLAIMED'
+        return job
+
+    def fetch_accu_structures(self, job_ids):
+        """The accumulated structures of the jobs, indexed by job_id"""
+        structures = {}
+        if job_ids:
+            rows = self.hive_db.fetchall('SELECT s.dependent_job_id, a.struct_name, a.key_signature, a.value FROM accu a JOIN semaphore s ON (s.semaphore_id=a.receiving_semaphore_id) WHERE s.dependent_job_id IN ({0})'.format(','.join('?' * len(job_ids))), job_ids)
+            for (job_id, struct_name, key_signature, value) in rows:
+                add_accu_value(structures.setdefault(job_id, {}), struct_name, key_signature, destringify(value))
+        return structures
+
+    def load_parameters(self, analysis, runnable, job):
+        """Returns the unsubstituted parameters of the job, as AnalysisJob::load_parameters():
+        defaults < pipeline-wide < analysis < param/accu stacks < input_id < accu"""
+        job.input_id_hash = destringify(job.input_id)
+        if not isinstance(job.input_id_hash, dict):
+            raise WorkerException("The input_id '{0}' is not a hash".format(job.input_id))
+        job.accu_hash = self.fetch_accu_structures([job.dbID]).get(job.dbID, {})
+        layers = [runnable.param_defaults(), self.pipeline.parameters, analysis.parameters]
+        stack = {}
+        param_ids = [int(i) for i in job.param_id_stack.split(',') if i]
+        if param_ids:
+            for (job_id, stored_input_id) in self.hive_db.fetchall('SELECT job_id, input_id FROM job WHERE job_id IN ({0})'.format(','.join('?' * len(param_ids))), param_ids):
+                stack[job_id * 2] = destringify(self.hive_db.fetch_input_id(stored_input_id))
+        accu_ids = [int(i) for i in job.accu_id_stack.split(',') if i]
+        for (job_id, structures) in self.fetch_accu_structures(accu_ids).items():
+            stack[job_id * 2 + 1] = structures
+        layers.extend(stack[k] for k in sorted(stack))
+        layers.extend([job.input_id_hash, job.accu_hash])
+        unsubstituted = {}
+        for layer in layers:
+            unsubstituted.update(layer)
+        return unsubstituted
+
+    def run_job(self, analysis, runnable, job):
+        start = time.monotonic()
+        try:
+            parameters = self.load_parameters(analysis, runnable, job)
+        except Exception as e:
+            job.transient_error = False
+            job.messages.append(('Could not load the parameters of the job: {0}'.format(e), True, job.step))
+            died_somewhere = True
+        else:
+            died_somewhere = not runnable.run_job_life_cycle(job, parameters, self.execute_writes)
+        job.runtime_msec = int((time.monotonic() - start) * 1000)
+
+        if not died_somewhere:
+            try:
+                with self.hive_db.transaction():
+                    self.complete_job(analysis, job)
+            except Exception as e:
+                died_somewhere = True
+                job.messages.append(('{0}: {1}'.format(type(e).__name__, e), True, 'WRITE_OUTPUT'))
+        if died_somewhere:
+            with self.hive_db.transaction():
+                self.fail_job(analysis, job)
+        else:
+            self.work_done += 1
+        self.say('Job', job.dbID, ': died' if died_somewhere else ': complete')
+
+        if (died_somewhere and self.prev_job_error) or job.lethal_for_worker:
+            self.say("Job's error has contaminated the Worker, so the Worker will now die")
+            self.cause_of_death = 'CONTAMINATED'
+        self.prev_job_error = died_somewhere
+
+    def store_messages(self, job):
+        for (message, is_error, step) in job.messages:
+            self.hive_db.log_message(message, 'WORKER_ERROR' if is_error else 'INFO', job.dbID, self.role_id, self.worker_id, job.retry_count, step)
+
+    def complete_job(self, analysis, job):
+        """Applies the dataflow of the job and marks it as DONE"""
+        fan_cache = collections.OrderedDict()
+        for (output_ids, branch_name_or_code) in job.dataflows:
+            self.dataflow_output_id(analysis, job, fan_cache, output_ids, branch_name_or_code)
+        if self.execute_writes and job.autoflow:
+            self.dataflow_output_id(analysis, job, fan_cache, None, 1)
+        if fan_cache:
+            job.transient_error = False
+            raise WorkerException("The group of semaphored jobs is incomplete ! Some fan jobs (coming from dataflow_rule_id(s) {0}) are missing a job on their funnel. Check the order of your dataflow_output_id() calls.".format(
+                ','.join(str(i) for i in fan_cache)))
+        self.store_messages(job)
+        self.hive_db.execute("UPDATE job SET status='DONE', when_completed=CURRENT_TIMESTAMP, runtime_msec=?, query_count=0 WHERE job_id=?", (job.runtime_msec, job.dbID))
+        if job.controlled_semaphore_id is not None:
+            self.hive_db.decrease_semaphore(job.controlled_semaphore_id, 1)
+        self.hive_db.execute('UPDATE role SET attempted_jobs=attempted_jobs+1, done_jobs=done_jobs+1 WHERE role_id=?', (self.role_id,))
+
+    def fail_job(self, analysis, job):
+        """Stores the error and releases the job, as AnalysisJobAdaptor::release_and_age_job()"""
+        self.store_messages(job)
+        may_retry = int(bool(job.transient_error and self.retry_throwing_jobs))
+        max_retry_count = analysis.max_retry_count if analysis.max_retry_count is not None else self.hive_db.default_max_retry_count
+        self.hive_db.execute("UPDATE job SET status = CASE WHEN ? AND (retry_count<?) THEN 'READY' ELSE 'FAILED' END, retry_count=retry_count+1, runtime_msec=? WHERE job_id=? AND status IN " + _in_list(TAKEN_JOB_STATUSES),
+                             (may_retry, max_retry_count, job.runtime_msec, job.dbID))
+        (status,) = self.hive_db.fetchone('SELECT status FROM job WHERE job_id=?', (job.dbID,))
+        self.hive_db.increment_counter('failed_job_count' if status == 'FAILED' else 'ready_job_count', 1, analysis.analysis_id)
+        self.hive_db.execute('UPDATE role SET attempted_jobs=attempted_jobs+1 WHERE role_id=?', (self.role_id,))
+
+    # Dataflow
+    ###########
+
+    def param_possibly_overridden(self, job_params, param_name, output_id):
+        if isinstance(output_id, dict) and param_name in output_id:
+            return output_id[param_name]
+        try:
+            return job_params.get_param(param_name)
+        except Exception:
+            return None
+
+    def substitute_template(self, job_params, template, output_id):
+        """Substitutes the parameters of the job, overridden by the output_id, into an input_id_template"""
+        container = params.ParamContainer(job_params.unsubstituted_param_hash)
+        container.param_hash = {k: v for (k, v) in job_params.param_hash.items() if k not in output_id}
+        container.param_hash.update(output_id)
+        return container.substitute_string(template)
+
+    def dataflow_output_id(self, analysis, job, fan_cache, output_ids, branch_name_or_code):
+        """AnalysisJob::dataflow_output_id() for unconditional rules"""
+        if isinstance(output_ids, str):
+            output_ids = destringify(output_ids)
+        if not isinstance(output_ids, list):
+            output_ids = [output_ids]
+        output_ids = [destringify(o) if isinstance(o, str) else o for o in output_ids]
+        for output_id in output_ids:
+            if output_id is not None and not isinstance(output_id, dict):
+                raise WorkerException('{0} is not a hashref ! Cannot dataflow'.format(stringify(output_id)))
+        branch_code = branch_name_2_code(branch_name_or_code)
+        if branch_code == 1:
+            job.autoflow = False
+
+        for rule in analysis.rules_by_branch.get(branch_code, []):
+            if fan_cache.get(rule.dataflow_rule_id) and len(output_ids) * len(rule.targets) != 1:
+                raise WorkerException('The total number of funnel output_ids was {0}, but expected to be 1. Please investigate'.format(len(output_ids) * len(rule.targets)))
+            if not output_ids:
+                continue
+            for target in rule.targets:
+                extend_param_stack = self.hive_db.use_param_stack or target.extend_param_stack
+                default_param_hash = {} if extend_param_stack else job.input_id_hash
+                target_output_ids = [o if o is not None else default_param_hash for o in output_ids]
+                if target.input_id_template is not None:
+                    target_output_ids = [self.substitute_template(job.params, target.input_id_template, o) for o in target_output_ids]
+                if target.kind == 'analysis':
+                    self.analysis_dataflow(target, rule, job, fan_cache, target_output_ids, extend_param_stack)
+                elif target.kind == 'accu':
+                    self.accu_dataflow(target, job, target_output_ids)
+                else:
+                    self.table_dataflow(target, job, target_output_ids)
+
+    def analysis_dataflow(self, target, rule, job, fan_cache, output_ids, push_emitting_job_on_stack):
+        """Analysis::dataflow(): creates the jobs, or caches the fan jobs until their funnel comes"""
+        param_id_stack = job.param_id_stack
+        accu_id_stack = job.accu_id_stack
+        if push_emitting_job_on_stack:
+            if job.input_id and job.input_id != '{}':
+                param_id_stack = (param_id_stack + ',' if param_id_stack else '') + str(job.dbID)
+            if job.accu_hash:
+                accu_id_stack = (accu_id_stack + ',' if accu_id_stack else '') + str(job.dbID)
+        new_jobs = [{
+            'analysis': target.analysis,
+            'input_id': stringify(output_id),
+            'param_id_stack': param_id_stack,
+            'accu_id_stack': accu_id_stack,
+            'prev_job_id': job.dbID,
+            'status': 'READY',
+        } for output_id in output_ids]
+
+        if rule.funnel_dataflow_rule_id is not None:
+            fan_cache.setdefault(rule.funnel_dataflow_rule_id, []).extend(new_jobs)
+            return
+        fan_jobs = fan_cache.pop(rule.dataflow_rule_id, None)
+        if fan_jobs:
+            if len(new_jobs) != 1:
+                job.transient_error = False
+                raise WorkerException('Asked to dataflow into {0} funnel jobs instead of 1'.format(len(new_jobs)))
+            self.store_a_semaphored_group_of_jobs(new_jobs[0], fan_jobs, job)
+        else:
+            self.store_jobs(new_jobs, job.controlled_semaphore_id, False, job)
+
+    def store_jobs(self, new_jobs, controlled_semaphore_id, push_new_semaphore, emitting_job):
+        """AnalysisJobAdaptor::store_jobs_and_adjust_counters(). Returns the
+        ids of the jobs that were stored, i.e. were not duplicates"""
+        if controlled_semaphore_id is not None and not push_new_semaphore and new_jobs:
+            # "pre-increase" the semaphore before creating the controlling jobs
+            self.hive_db.increase_semaphore(controlled_semaphore_id, len(new_jobs))
+        job_ids = []
+        n_failed = 0
+        for new_job in new_jobs:
+            analysis = new_job['analysis']
+            stored_input_id = self.hive_db.store_input_id(new_job['input_id'])
+            cursor = self.hive_db.execute('INSERT OR IGNORE INTO job (prev_job_id, analysis_id, input_id, param_id_stack, accu_id_stack, status, controlled_semaphore_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                          (new_job['prev_job_id'], analysis.analysis_id, stored_input_id, new_job['param_id_stack'], new_job['accu_id_stack'], new_job['status'], controlled_semaphore_id))
+            if cursor.rowcount:
+                job_ids.append(cursor.lastrowid)
+                self.hive_db.count_new_jobs(analysis.analysis_id, new_job['status'], 1)
+            else:
+                n_failed += 1
+                self.hive_db.log_message('JobAdaptor failed to store the local Job( analysis_id={0}, {1} ), possibly due to a collision'.format(analysis.analysis_id, new_job['input_id']),
+                                         'PIPELINE_CAUTION', emitting_job.dbID, self.role_id, self.worker_id, emitting_job.retry_count)
+        if controlled_semaphore_id is not None and n_failed:
+            self.hive_db.decrease_semaphore(controlled_semaphore_id, n_failed)
+        return job_ids
+
+    def store_a_semaphored_group_of_jobs(self, funnel_job, fan_jobs, emitting_job):
+        """AnalysisJobAdaptor::store_a_semaphored_group_of_jobs(): the funnel
+        job, blocked by a new semaphore (or the semaphore of an identical
+        funnel job if there is one), and the fan jobs that control it"""
+        funnel_job['status'] = 'SEMAPHORED'
+        funnel_job_ids = self.store_jobs([funnel_job], emitting_job.controlled_semaphore_id, False, emitting_job)
+        if funnel_job_ids:
+            semaphore_id = self.hive_db.execute('INSERT INTO semaphore (local_jobs_counter, remote_jobs_counter, dependent_job_id) VALUES (?, 0, ?)', (len(fan_jobs), funnel_job_ids[0])).lastrowid
+            self.hive_db.release_if_ripe(semaphore_id)
+        else:
+            # The funnel job already exists: let's leech to it
+            (funnel_job_id, semaphore_id) = self.hive_db.leech_funnel_semaphore(funnel_job['analysis'].analysis_id, self.hive_db.store_input_id(funnel_job['input_id']),
+                                                                                funnel_job['param_id_stack'], funnel_job['accu_id_stack'])
+            self.hive_db.increase_semaphore(semaphore_id, len(fan_jobs))
+            self.hive_db.log_message('Discovered and using an existing funnel job_id={0}'.format(funnel_job_id), 'INFO', emitting_job.dbID, self.role_id, self.worker_id, emitting_job.retry_count)
+        self.store_jobs(fan_jobs, semaphore_id, True, emitting_job)
+
+    def accu_dataflow(self, target, job, output_ids):
+        """Accumulator::dataflow(): stores the values for the semaphore the job controls"""
+        if job.controlled_semaphore_id is None:
+            raise WorkerException('No controlled semaphore, cannot perform accumulated dataflow')
+        accu_name = target.options['accu_name']
+        accu_address = target.options.get('accu_address', '')
+        accu_input_variable = target.options.get('accu_input_variable') or accu_name
+        rows = []
+        for output_id in output_ids:
+            key_signature = re.sub(r'\w+', lambda m: _perl_string(self.param_possibly_overridden(job.params, m.group(0), output_id)), accu_address)
+            check_empty_keys(key_signature, accu_address)
+            rows.append((job.dbID, job.controlled_semaphore_id, accu_name, key_signature, stringify(self.param_possibly_overridden(job.params, accu_input_variable, output_id))))
+        self.hive_db.dbh.executemany('INSERT INTO accu (sending_job_id, receiving_semaphore_id, struct_name, key_signature, value) VALUES (?, ?, ?, ?, ?)', rows)
+
+    def table_dataflow(self, target, job, output_ids):
+        """NakedTable::dataflow(): one row per output_id, the columns being taken from the parameters"""
+        table_name = target.options['table_name']
+        columns = self.pipeline.get_table_columns(self.hive_db, table_name)
+        insertion_method = target.options.get('insertion_method') or 'INSERT_IGNORE'
+        sql_verbs = {'INSERT': 'INSERT', 'INSERT_IGNORE': 'INSERT OR IGNORE', 'REPLACE': 'INSERT OR REPLACE'}
+        if insertion_method not in sql_verbs:
+            raise WorkerException("Unknown insertion_method '{0}'".format(insertion_method))
+        rows = [tuple(_db_value(self.param_possibly_overridden(job.params, c, output_id)) for c in columns) for output_id in output_ids]
+        self.hive_db.dbh.executemany('{0} INTO {1} ({2}) VALUES ({3})'.format(sql_verbs[insertion_method], table_name, ', '.join(columns), ', '.join('?' * len(columns))), rows)
+
+
+def main(argv):
+    """Entry point of "wrapper worker". Returns the exit status"""
+    parser = argparse.ArgumentParser(prog='wrapper worker', description='Runs the jobs of the python3 analyses of a SQLite hive database in the current process (experimental)')
+    parser.add_argument('url', help='URL of the hive database, e.g. sqlite:///my_hive.db')
+    parser.add_argument('--analyses-pattern', help='Restrict the worker to these analyses: comma-separated logic_names (with %% wildcards), analysis_ids or ranges of analysis_ids')
+    parser.add_argument('--job-limit', type=int, help='Number of jobs to run before dying')
+    parser.add_argument('--life-span', type=float, help='Number of minutes after which the worker stops taking new batches')
+    parser.add_argument('--no-retry-throwing-jobs', action='store_true', help='Mark the jobs that fail as FAILED instead of retrying them')
+    parser.add_argument('--can-respecialize', action='store_true', help='Move on to another analysis when the current one has no jobs left')
+    parser.add_argument('--no-write', action='store_true', help='Skip write_output (and thus the dataflow)')
+    parser.add_argument('--beekeeper-id', type=int, help='beekeeper_id to record in the worker table')
+    parser.add_argument('--debug', type=int, default=0, help='Debug level')
+    args = parser.parse_args(argv)
+
+    try:
+        worker = Worker(args.url, args.analyses_pattern, args.job_limit, args.life_span, not args.no_retry_throwing_jobs,
+                        args.can_respecialize, not args.no_write, args.beekeeper_id, args.debug)
+    except (WorkerException, db.DBURLException) as e:
+        print(e, file=sys.stderr)
+        return 1
+    cause_of_death = worker.run()
+    print('Worker {0} died because of {1} after {2} jobs'.format(worker.worker_id, cause_of_death, worker.work_done), file=sys.stderr)
+    return 0
+
+
+def ehive_sql_dir():
+    """The directory of the SQL schema files, in EHIVE_ROOT_DIR or in the checkout this package belongs to"""
+    root_dir = os.environ.get('EHIVE_ROOT_DIR') or os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+    return os.path.join(root_dir, 'sql')
+
+
+def create_hive_database(path, meta=None):
+    """Creates an empty SQLite hive database (without triggers). Returns its URL"""
+    url = 'sqlite:///' + path
+    dbc = db.DBConnection(url)
+    with open(os.path.join(ehive_sql_dir(), 'tables.sqlite')) as fh:
+        dbc.dbh.executescript(fh.read())
+    hive_meta = {'hive_use_triggers': 0, 'hive_use_param_stack': 0, 'hive_default_max_retry_count': 3}
+    hive_meta.update(meta or {})
+    dbc.executemany('INSERT INTO hive_meta (meta_key, meta_value) VALUES (?, ?)', [(k, str(v)) for (k, v) in hive_meta.items()])
+    dbc.close()
+    return url
+
+
+class HiveDatabaseTestMixin:
+    """Test fixtures: a new SQLite hive database in a temporary directory,
+    and helpers to add analyses, dataflow rules and jobs to it"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'hive.db')
+        self.url = create_hive_database(self.path, {'hive_use_param_stack': 1})
+        self.dbc = db.DBConnection(self.url)
+
+    def tearDown(self):
+        self.dbc.close()
+        shutil.rmtree(self.dir)
+
+    def add_analysis(self, logic_name, module, language='python3', parameters=None, **columns):
+        columns.setdefault('max_retry_count', 3)
+        analysis_id = self.dbc.execute('INSERT INTO analysis_base (logic_name, module, language, parameters, resource_class_id, {0}) VALUES (?, ?, ?, ?, 1{1})'.format(
+            ', '.join(columns), ', ?' * len(columns)), (logic_name, module, language, stringify(parameters or {})) + tuple(columns.values())).lastrowid
+        self.dbc.execute("INSERT INTO analysis_stats (analysis_id, status) VALUES (?, 'EMPTY')", (analysis_id,))
+        self.dbc.commit()
+        return analysis_id
+
+    def add_rule(self, from_analysis_id, branch_code, to_urls, funnel_dataflow_rule_id=None):
+        rule_id = self.dbc.execute('INSERT INTO dataflow_rule (from_analysis_id, branch_code, funnel_dataflow_rule_id) VALUES (?, ?, ?)', (from_analysis_id, branch_code, funnel_dataflow_rule_id)).lastrowid
+        for url in to_urls:
+            self.dbc.execute('INSERT INTO dataflow_target (source_dataflow_rule_id, to_analysis_url) VALUES (?, ?)', (rule_id, url))
+        self.dbc.commit()
+        return rule_id
+
+    def add_job(self, analysis_id, input_id):
+        self.dbc.execute('INSERT INTO job (analysis_id, input_id) VALUES (?, ?)', (analysis_id, stringify(input_id)))
+        self.dbc.execute('UPDATE analysis_stats SET total_job_count=total_job_count+1, ready_job_count=ready_job_count+1 WHERE analysis_id=?', (analysis_id,))
+        self.dbc.commit()
+
+
+class WorkerTestCase(HiveDatabaseTestMixin, unittest.TestCase):
+
+    def run_worker(self, **kwargs):
+        worker = Worker(self.url, **kwargs)
+        # Some Runnables print things
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            return (worker.run(), worker)
+        finally:
+            sys.stdout = stdout
+
+    def test_parsing(self):
+        self.assertEqual(branch_name_2_code('MAIN'), 1)
+        self.assertEqual(branch_name_2_code('-2'), -2)
+        self.assertRaises(WorkerException, branch_name_2_code, 'NOWHERE')
+        self.assertEqual(parse_target_url('?accu_name=a&accu_address={x}'), ('accu', {'accu_name': 'a', 'accu_address': '{x}'}))
+        self.assertEqual(parse_target_url('?table_name=final_result'), ('table', {'table_name': 'final_result'}))
+        self.assertEqual(parse_target_url('add_together'), ('analysis', {'logic_name': 'add_together'}))
+        self.assertRaises(WorkerException, parse_target_url, 'mysql://host/other_db?logic_name=x')
+
+    def test_accu_structures(self):
+        structures = {}
+        for (name, signature, value) in [('h', '{a}', 1), ('h', '{b}', 2), ('l', '[]', 'x'), ('l', '[]', 'y'), ('l2', '[2]', 3),
+                                         ('c', '{}', 'x'), ('c', '{}', 'x'), ('n', '{a}[1]', 5), ('s', '', 7)]:
+            add_accu_value(structures, name, signature, value)
+        self.assertEqual(structures, {'h': {'a': 1, 'b': 2}, 'l': ['x', 'y'], 'l2': [None, None, 3], 'c': {'x': 2}, 'n': {'a': [None, 5]}, 's': 7})
+        check_empty_keys('{a}[]', '{x}[]')
+        self.assertRaises(WorkerException, check_empty_keys, '{}', '{x}')
+
+    def test_long_mult(self):
+        # Same as Bio::EnsEMBL::Hive::Examples::LongMult::PipeConfig::LongMultSt_pyconf
+        self.dbc.execute('CREATE TABLE final_result (a_multiplier varchar(255) NOT NULL, b_multiplier varchar(255) NOT NULL, result varchar(255) NOT NULL, PRIMARY KEY (a_multiplier, b_multiplier))')
+        self.dbc.execute("INSERT INTO pipeline_wide_parameters (param_name, param_value) VALUES ('take_time', '0')")
+        self.dbc.commit()
+        take_b_apart = self.add_analysis('take_b_apart', 'eHive.examples.LongMult.DigitFactory', analysis_capacity=2)
+        part_multiply = self.add_analysis('part_multiply', 'eHive.examples.LongMult.PartMultiply', analysis_capacity=4, batch_size=3)
+        add_together = self.add_analysis('add_together', 'eHive.examples.LongMult.AddTogether')
+        last = self.add_analysis('last', 'Bio::EnsEMBL::Hive::RunnableDB::Dummy', language=None)
+        funnel_rule_id = self.add_rule(take_b_apart, 1, ['add_together'])
+        self.add_rule(take_b_apart, 2, ['part_multiply'], funnel_rule_id)
+        self.add_rule(part_multiply, 1, ['?accu_name=partial_product&accu_address={digit}'])
+        self.add_rule(add_together, 1, ['?table_name=final_result', 'last'])
+        self.add_job(take_b_apart, {'a_multiplier': '9650156169', 'b_multiplier': '327358788'})
+        self.add_job(take_b_apart, {'a_multiplier': '327358788', 'b_multiplier': '9650156169'})
+
+        (cause_of_death, worker) = self.run_worker(can_respecialize=True)
+        self.assertEqual(cause_of_death, 'NO_WORK')
+        # 0 and 1 are not multiplied, and the digits are deduplicated
+        self.assertEqual(worker.work_done, 2 + 8 + 2)
+        self.assertEqual(sorted(self.dbc.fetchall('SELECT * FROM final_result')), [('327358788', '9650156169', str(327358788 * 9650156169)), ('9650156169', '327358788', str(327358788 * 9650156169))])
+        self.assertEqual(dict(self.dbc.fetchall('SELECT analysis_id, COUNT(*) FROM job WHERE status="DONE" GROUP BY analysis_id')), {take_b_apart: 2, part_multiply: 8, add_together: 2})
+        # The Perl analysis is left to Perl workers, with the parameters on the stack
+        self.assertEqual(self.dbc.fetchall('SELECT input_id, status FROM job WHERE analysis_id=?', (last,)), [('{"result" => "3159063427494563172"}', 'READY')] * 2)
+        self.assertEqual(self.dbc.fetchall('SELECT COUNT(*) FROM job WHERE analysis_id=? AND param_id_stack!=""', (part_multiply,)), [(8,)])
+        self.assertEqual(self.dbc.fetchall('SELECT local_jobs_counter FROM semaphore'), [(0,), (0,)])
+        self.assertEqual(self.dbc.fetchall("SELECT status, done_job_count, num_running_workers FROM analysis_stats WHERE analysis_id=?", (part_multiply,)), [('DONE', 8, 0)])
+        self.assertEqual(self.dbc.fetchall('SELECT COUNT(*), SUM(when_finished IS NOT NULL) FROM role'), [(3, 3)])
+        self.assertEqual(self.dbc.fetchall('SELECT status, cause_of_death, work_done FROM worker'), [('DEAD', 'NO_WORK', 12)])
+        self.assertEqual(self.dbc.fetchall("SELECT COUNT(*) FROM log_message WHERE msg LIKE '%multiplication jobs have been created'"), [(2,)])
+
+        # Another worker has nothing to do
+        (cause_of_death, worker) = self.run_worker()
+        self.assertEqual(cause_of_death, 'NO_ROLE')
+
+    def test_failures(self):
+        analysis_id = self.add_analysis('test', 'eHive.examples.TestRunnable', max_retry_count=1)
+        self.add_rule(analysis_id, 2, ['?table_name=gammas'])
+        self.dbc.execute('CREATE TABLE gammas (gamma INT)')
+        self.dbc.commit()
+        for input_id in [{}, {'beta': -37}, {'alpha': 237}, {'alpha': 238}, {'alpha': 1}]:
+            self.add_job(analysis_id, input_id)
+
+        # Two failures in a row contaminate the worker
+        (cause_of_death, worker) = self.run_worker(job_limit=10)
+        self.assertEqual(cause_of_death, 'CONTAMINATED')
+        self.assertEqual(self.dbc.fetchall('SELECT input_id, status, retry_count FROM job ORDER BY job_id'), [
+            ('{}', 'DONE', 0), ('{"beta" => -37}', 'DONE', 0), ('{"alpha" => 237}', 'READY', 1), ('{"alpha" => 238}', 'READY', 1), ('{"alpha" => 1}', 'READY', 0)])
+        self.assertEqual(self.dbc.fetchall('SELECT gamma FROM gammas'), [(115,)])
+        self.assertEqual(self.dbc.fetchall("SELECT COUNT(*) FROM log_message WHERE message_class='WORKER_ERROR' AND msg LIKE 'OverflowError: 315%' AND status='RUN'"), [(1,)])
+        self.assertEqual(self.dbc.fetchall("SELECT msg FROM log_message WHERE job_id=2 AND status='RUN'"), [('Run the world !',), ('Nothing to do',)])
+
+        # The fresh job first, then the retries, up to max_retry_count
+        (cause_of_death, worker) = self.run_worker(job_limit=1)
+        self.assertEqual(cause_of_death, 'JOB_LIMIT')
+        (cause_of_death, worker) = self.run_worker(retry_throwing_jobs=False)
+        self.assertEqual(cause_of_death, 'CONTAMINATED')
+        self.assertEqual(self.dbc.fetchall('SELECT status, retry_count FROM job ORDER BY job_id'), [('DONE', 0), ('DONE', 0), ('FAILED', 2), ('FAILED', 2), ('DONE', 0)])
+        self.assertEqual(self.dbc.fetchall('SELECT gamma FROM gammas ORDER BY gamma'), [(79,), (115,)])
+        self.assertEqual(self.dbc.fetchall('SELECT status, failed_job_count FROM analysis_stats'), [('FAILED', 2)])
+
+    def test_connected_branches(self):
+        # Timeouts go to branch -2 when it is connected, and fail the job otherwise
+        connected = self.add_analysis('connected', 'eHive.runnables.SystemCmd', parameters={'timeout': 0.1}, max_retry_count=0)
+        not_connected = self.add_analysis('not_connected', 'eHive.runnables.SystemCmd', parameters={'timeout': 0.1}, max_retry_count=0)
+        self.add_rule(connected, -2, ['?table_name=timeouts'])
+        self.dbc.execute('CREATE TABLE timeouts (cmd VARCHAR(255))')
+        self.dbc.commit()
+        self.add_job(connected, {'cmd': 'sleep 5'})
+        self.add_job(not_connected, {'cmd': 'sleep 5'})
+        self.run_worker(can_respecialize=True)
+        self.assertEqual(self.dbc.fetchall('SELECT analysis_id, status FROM job ORDER BY job_id'), [(connected, 'DONE'), (not_connected, 'FAILED')])
+        self.assertEqual(self.dbc.fetchall('SELECT cmd FROM timeouts'), [('sleep 5',)])
+
+    def test_dataflow_return_value(self):
+        job = Job()
+        job.transient_error = True
+        job.dataflows = []
+        job_ids = InProcessSink(None).dataflow(job, {'a': 1}, 2, None)
+        self.assertEqual(job.dataflows, [({'a': 1}, 2)])
+        self.assertIsNotNone(job_ids)
+        self.assertTrue(job.transient_error)
+        for use in [list, len, bool, lambda x: x[0]]:
+            self.assertRaises(WorkerException, use, job_ids)
+        self.assertFalse(job.transient_error)
+
+    def test_unsupported(self):
+        analysis_id = self.add_analysis('remote', 'eHive.examples.TestRunnable')
+        self.add_rule(analysis_id, 1, ['mysql://host/other_db?logic_name=x'])
+        self.add_job(analysis_id, {})
+        (cause_of_death, worker) = self.run_worker()
+        self.assertEqual(cause_of_death, 'NO_ROLE')
+        self.assertEqual(worker.pipeline.analyses[analysis_id].unsupported, "dataflow to 'mysql://host/other_db?logic_name=x' is in another database")
+        self.assertRaises(db.DBURLException, Worker, 'mysql://host/db')